@@ -0,0 +1,215 @@
+import os
+import numpy as np
+
+import profiling
+from rax import load_rax, sampling_freq
+
+# Correction of the retention time drift of runs before their peaks are matched to a database.
+# Each run is first shifted as a whole by the lag of its RAX trace that best correlates with a
+# reference trace (when both are available). The peaks of the anchor compounds are then found
+# around their library retention times, and the retention times of the run are corrected by
+# the piecewise-linear interpolation of the anchor shifts (constant before the first and after
+# the last anchor). Runs are corrected in batches: the peaks of all runs are placed on one
+# axis, each run offset past the previous one, so every anchor search and interpolation is a
+# single searchsorted over all runs.
+#
+# Alignment options (the alignment of manifest jobs), for liquid samples or for both gas
+# detectors, or for one detector only with the tcd/fid prefix (e.g. tcdAnchors, fidReference):
+#   anchors: compounds or classifications of the database used as anchors (default: the
+#     internal standard of liquid samples, Helium for TCD and Methane for FID)
+#   window: distance [min] from the library retention time of an anchor searched for its
+#     peak, the closest one of the window (default 0.2)
+#   reference: RAX trace of the experiment the traces of the runs are correlated with
+#   maxShift: largest shift [min] of a trace from the reference (default 1.0)
+#   tolerance: largest distance [min] between a corrected peak and its compound (default none)
+#   ambiguity: matches with more than one candidate within this distance [min] are left
+#     unmatched and flagged as ambiguous (default: the tolerance)
+
+OPTIONS = ['anchors', 'window', 'reference', 'maxShift', 'tolerance', 'ambiguity']
+DETECTORS = ['tcd', 'fid']
+DEFAULT_ANCHORS = {'liquid': ['internal standard'], 'tcd': ['Helium'], 'fid': ['Methane']}
+WINDOW = 0.2
+MAX_SHIFT = 1.0
+CHUNK_RUNS = 64 # Traces cross-correlated at once, bounding the memory of the spectra
+
+
+# Options of one detector ('liquid', 'tcd' or 'fid'): the {detector}{Option} entries override
+# the shared ones
+def detector_options(options, detector):
+  options = dict(options or {})
+  for option in OPTIONS:
+    key = detector + option[0].upper() + option[1:]
+    if key in options:
+      options[option] = options[key]
+  return {option: options[option] for option in OPTIONS if option in options}
+
+
+# Database rows of the anchors, given by compound or classification name. Default anchors
+# missing from the database are ignored.
+def anchor_rows(database, anchors=None, detector='liquid'):
+  names = DEFAULT_ANCHORS[detector] if anchors is None else anchors
+  rows = []
+  for name in names:
+    if name in database.compounds:
+      rows.append(database.compounds[name])
+    elif name in database.groups:
+      rows.extend(database.groups[name])
+    elif anchors is not None:
+      raise Exception(f'Anchor {name} not found in {os.path.basename(database.path)}.')
+  return np.unique(np.asarray(rows, dtype=int))
+
+
+# RAX trace of a peak report (same name, .RAX extension), None when there is none
+def trace_file(fileName):
+  raxFile = os.path.splitext(fileName)[0] + '.RAX'
+  return raxFile if os.path.isfile(raxFile) else None
+
+
+# Lag [min] of each trace that best correlates with the reference, within maxShift (positive
+# when the peaks of the trace come later). Traces are correlated by their first difference,
+# so the baseline does not weigh in, through the spectra of CHUNK_RUNS traces at a time.
+def trace_shifts(traces, reference, freq, maxShift=MAX_SHIFT):
+  maxLag = int(round(maxShift * freq * 60))
+  length = max([len(reference)] + [len(t) for t in traces]) + maxLag
+  size = 1 << int(length - 1).bit_length()
+
+  def normalized(points):
+    diff = np.diff(np.asarray(points, dtype=np.float32))
+    std = diff.std() if len(diff) else 0
+    return (diff - diff.mean()) / std if std > 0 else np.zeros_like(diff)
+
+  spectrum = np.conj(np.fft.rfft(normalized(reference), size))
+  lags = np.arange(-maxLag, maxLag + 1)
+  shifts = np.empty(len(traces))
+  for start in range(0, len(traces), CHUNK_RUNS):
+    chunk = traces[start:start + CHUNK_RUNS]
+    stacked = np.zeros((len(chunk), size), dtype=np.float32)
+    for num, points in enumerate(chunk):
+      values = normalized(points)
+      stacked[num, :len(values)] = values
+    correlation = np.fft.irfft(np.fft.rfft(stacked, axis=1) * spectrum, size, axis=1)
+    correlation = correlation[:, lags % size]
+    shifts[start:start + len(chunk)] = lags[np.argmax(correlation, axis=1)] / (freq * 60)
+  return shifts
+
+
+# Values of N runs on one increasing axis: run n is offset by n spans, a span being longer
+# than the range of the values of every run
+def run_axis(values, runs, low, span):
+  return np.asarray(values, dtype=float) - low + runs * span
+
+
+# Retention time of the peak of each anchor in each run, as a (run x anchor) matrix, NaN
+# where the run has no peak within window of the anchor. Anchors are searched in order of
+# retention time, each one around its library retention time shifted as the last anchor found
+# in the run (initially by the shift of the run), and its peak is the closest one to it (the
+# largest one of equally close peaks). Every run is searched at once for each anchor.
+#   rts, areas: retention times and areas of the peaks of each run
+def find_anchors(rts, areas, libraryRt, shifts, window=WINDOW):
+  libraryRt = np.asarray(libraryRt, dtype=float)
+  numRuns, numAnchors = len(rts), len(libraryRt)
+  run = np.repeat(np.arange(numRuns), [len(rt) for rt in rts])
+  rt = np.concatenate([np.asarray(rt, dtype=float) for rt in rts] or [np.empty(0)])
+  area = np.concatenate([np.asarray(a, dtype=float) for a in areas] or [np.empty(0)])
+  shifts = np.asarray(shifts, dtype=float).copy()
+  # Every window stays within margin of the peaks and of the initial windows
+  margin = np.ptp(rt) + np.ptp(libraryRt) + window + 1 if len(rt) and numAnchors else 1
+  low = min(rt.min(initial=0), (libraryRt.min(initial=0) + shifts.min(initial=0))) - margin
+  span = max(rt.max(initial=0), (libraryRt.max(initial=0) + shifts.max(initial=0))) + margin - low
+
+  order = np.argsort(run_axis(rt, run, low, span), kind='stable')
+  rt, area = rt[order], area[order]
+  axis = run_axis(rt, run[order], low, span)
+  runs = np.arange(numRuns)
+  observed = np.full((numRuns, numAnchors), np.nan)
+  for anchor in np.argsort(libraryRt, kind='stable'):
+    centers = libraryRt[anchor] + shifts
+    starts = np.searchsorted(axis, run_axis(centers - window, runs, low, span), 'left')
+    stops = np.searchsorted(axis, run_axis(centers + window, runs, low, span), 'right')
+
+    # Peaks of every window, the closest one first
+    sizes = stops - starts
+    windows = np.repeat(runs, sizes)
+    peaks = np.repeat(starts - np.cumsum(sizes) + sizes, sizes) + np.arange(sizes.sum())
+    distances = np.abs(rt[peaks] - centers[windows])
+    order = np.lexsort((-area[peaks], distances, windows))
+    windows, peaks = windows[order], peaks[order]
+    first = np.concatenate([[True], windows[1:] != windows[:-1]]) if len(windows) else np.empty(0, dtype=bool)
+
+    observed[windows[first], anchor] = rt[peaks[first]]
+    shifts[windows[first]] = rt[peaks[first]] - libraryRt[anchor]
+  return observed
+
+
+# Correction [min] of each retention time of N runs, interpolated between the shifts
+# (library - observed) of the anchors found in its run, and -fallback for runs without anchors
+def interpolate_shifts(rts, observed, libraryRt, fallback):
+  numRuns = len(rts)
+  counts = [len(rt) for rt in rts]
+  run = np.repeat(np.arange(numRuns), counts)
+  rt = np.concatenate([np.asarray(rt, dtype=float) for rt in rts] or [np.empty(0)])
+
+  anchorRuns, anchors = np.nonzero(np.isfinite(observed))
+  anchorRt = observed[anchorRuns, anchors]
+  order = np.lexsort((anchorRt, anchorRuns))
+  anchorRuns, anchorRt = anchorRuns[order], anchorRt[order]
+  anchorShifts = np.asarray(libraryRt, dtype=float)[anchors[order]] - anchorRt
+  if len(anchorRt) == 0:
+    return np.split(-np.asarray(fallback, dtype=float)[run], np.cumsum(counts)[:-1])
+
+  low = min(rt.min(initial=0), anchorRt.min())
+  span = max(rt.max(initial=0), anchorRt.max()) - low + 1
+  positions = np.searchsorted(run_axis(anchorRt, anchorRuns, low, span), run_axis(rt, run, low, span))
+  first = np.searchsorted(anchorRuns, np.arange(numRuns), 'left')[run]
+  last = np.searchsorted(anchorRuns, np.arange(numRuns), 'right')[run] - 1
+  found = last >= first
+  left = np.clip(positions - 1, first, np.maximum(last, first))
+  right = np.clip(positions, first, np.maximum(last, first))
+  left, right = np.minimum(left, len(anchorRt) - 1), np.minimum(right, len(anchorRt) - 1)
+
+  x0, x1 = anchorRt[left], anchorRt[right]
+  y0, y1 = anchorShifts[left], anchorShifts[right]
+  step = np.where(x1 > x0, x1 - x0, 1)
+  fraction = np.where(x1 > x0, np.clip((rt - x0) / step, 0, 1), 0)
+  corrections = np.where(found, y0 + fraction * (y1 - y0), -np.asarray(fallback, dtype=float)[run])
+  return np.split(corrections, np.cumsum(counts)[:-1])
+
+
+# Retention times of the peaks of N runs of one detector, corrected to the library scale of
+# their database
+#   rts, areas: peak tables of each run
+#   traces: RAX points of each run (None for the runs without trace), correlated with the
+#     reference points when given
+#   detector: 'liquid', 'tcd' or 'fid', for the default anchors and the sampling frequency
+def align_runs(database, rts, areas, options=None, traces=None, reference=None, detector='liquid'):
+  options = options or {}
+  with profiling.stage('align', sum(len(rt) for rt in rts)):
+    shifts = np.zeros(len(rts))
+    if reference is not None and traces is not None:
+      traced = [num for num, points in enumerate(traces) if points is not None]
+      if traced:
+        freq = sampling_freq(detector != 'liquid')
+        shifts[traced] = trace_shifts([traces[num] for num in traced], reference, freq, options.get('maxShift', MAX_SHIFT))
+
+    rows = anchor_rows(database, options.get('anchors'), detector)
+    libraryRt = database.rt[rows]
+    observed = find_anchors(rts, areas, libraryRt, shifts, options.get('window', WINDOW))
+    corrections = interpolate_shifts(rts, observed, libraryRt, shifts)
+    return [np.asarray(rt, dtype=float) + correction for rt, correction in zip(rts, corrections)]
+
+
+# RAX points of a run: its RAX file, or the trace of its peak report (None when there is none)
+def run_trace(fileName, gas=False):
+  raxFile = fileName if fileName and fileName.upper().endswith('.RAX') else fileName and trace_file(fileName)
+  return load_rax(raxFile, gas)[1] if raxFile else None
+
+
+# Corrected retention times of the peaks of N runs (peak tables of fileNames), with their
+# traces when the options have a reference trace
+def align_peaks(rts, areas, database, options, fileNames=None, detector='liquid'):
+  traces = reference = None
+  if options.get('reference'):
+    gas = detector != 'liquid'
+    reference = load_rax(options['reference'], gas)[1]
+    traces = [run_trace(f, gas) for f in fileNames or [None] * len(rts)]
+  return align_runs(database, rts, areas, options, traces, reference, detector)
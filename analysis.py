@@ -1,22 +1,242 @@
 import glob
 import os
+import numpy as np
 import pandas as pd
 
-TIME_COLUMN = 'RT' # Must have the same name in input files and data/database.csv
+import cache
+import output
+import profiling
+import quantify
+import tx0
+from results import GasResults, LiquidResults
+from database import TIME_COLUMN, load_database
+from matching import match_nearest, match_within
+from peaks import find_peaks
+
 PEAK_COLUMN = 'Area' # Column used for peak detection, must only be present in input files
 
+COMPOUNDS_TO_ISOLATE = ['None', 'Nitrogen', 'Isobutylene', '1-Butene', '1,3-Butadiene', 'Butane', 'Isobutane']
+
+
+def list_databases(kind):
+  databases = sorted(glob.glob(os.path.join('data', kind, '*.csv')))
+  if len(databases) == 0:
+    raise Exception(f'No database found in data/{kind} folder.')
+  return databases
+
+
+# Peak table of a TX0 report. The cache kind names the parser: entries of the previous
+# fixed-header parser ('tx0') are not reused.
+def read_tx0(fileName):
+  return cache.cached_frame(fileName, 'tx0-v2', tx0.peak_table)
+
+
+def read_peak_csv(fileName):
+  return cache.cached_frame(fileName, 'csv', pd.read_csv).sort_values(by=[TIME_COLUMN])
+
+
+# Peak table of a TX0 or CSV report, or integrated from the raw points of a RAX file
+def read_peaks(fileName, gas=False):
+  extension = os.path.splitext(fileName)[1].upper()
+  if extension == '.TX0':
+    return read_tx0(fileName)
+  if extension == '.RAX':
+    import integration
+    return integration.integrate_rax([fileName], gas)[0]
+  return read_peak_csv(fileName)
+
+
+# Name of the csv table saved in the output folder for an input file
+def results_name(fileName):
+  return os.path.splitext(os.path.basename(fileName))[0] + '.csv'
+
+
+# Results table of one input file (GasResults or LiquidResults), in the output formats of output.configure
+def save_results(experiment, results, fileName):
+  if output.writes_results():
+    output.write_results(experiment, results.to_frame(), fileName)
+
+
+# Peak tables of the files of one sample
+def parse_peaks(*fileNames, gas=False):
+  with profiling.stage('parse') as stage:
+    frames = [read_peaks(fileName, gas) for fileName in fileNames]
+    stage.rows = sum(len(fileDf) for fileDf in frames)
+  return frames
+
+
+# Match TCD and FID peaks (TX0 reports or RAX traces) of one sample to their CompoundDatabase and compute the mass of each compound.
+# alignment: options of alignment.py, to correct the retention time drift of the sample before matching
+# unique: each TCD compound matched to one peak only, in retention time order (by default, the
+#   closest compound of every peak, as the original analysis; aligned matches are always unique)
+def gas_results(tcdFileName, fidFileName, tcdDatabase, fidDatabase, sampleVol, alignment=None, unique=False):
+  tcdFileDf, fidFileDf = parse_peaks(tcdFileName, fidFileName, gas=True)
+  return match_gas(tcdFileDf, fidFileDf, tcdDatabase, fidDatabase, sampleVol, alignment, (tcdFileName, fidFileName), unique=unique)
+
+
+# Database row matched to each TCD and FID peak (-1 when unmatched)
+def gas_matches(tcdFileDf, fidFileDf, tcdDatabase, fidDatabase, unique=False):
+  # TCD Analysis: closest row in tcdDatabase for each peak, with unique each compound matched only once
+  tcdMatches = match_nearest(tcdFileDf[TIME_COLUMN], tcdDatabase.rt_index(), unique=unique)
+  # FID Analysis: closest row in fidDatabase for each peak
+  fidMatches = match_nearest(fidFileDf[TIME_COLUMN], fidDatabase.index)
+  return tcdMatches, fidMatches
+
+
+# Alignment options of one detector ('liquid', 'tcd' or 'fid')
+def detector_alignment(alignment, detector):
+  import alignment as align
+  return align.detector_options(alignment, detector)
+
+
+# Retention times of the peaks of N runs of one detector (peak tables of fileNames) corrected
+# for their drift, all runs in one batch
+def align_detector(frames, database, alignment, fileNames, detector):
+  import alignment as align
+  rts = [fileDf[TIME_COLUMN] for fileDf in frames]
+  areas = [fileDf[PEAK_COLUMN] for fileDf in frames]
+  return align.align_peaks(rts, areas, database, detector_alignment(alignment, detector), fileNames, detector)
+
+
+# Aligned (TCD, FID) retention times of N gas samples, from their TCD and FID peak tables
+# (files fileNames, as (TCD, FID) pairs)
+def align_gas(tcdFrames, fidFrames, tcdDatabase, fidDatabase, alignment, fileNames):
+  tcdRts = align_detector(tcdFrames, tcdDatabase, alignment, [tcd for tcd, _ in fileNames], 'tcd')
+  fidRts = align_detector(fidFrames, fidDatabase, alignment, [fid for _, fid in fileNames], 'fid')
+  return list(zip(tcdRts, fidRts))
+
+
+# GasResults of gas_results from the TCD and FID peak tables (files fileNames).
+# alignedRt: (TCD, FID) retention times aligned with other samples by align_gas; the sample is
+# aligned alone otherwise
+def match_gas(tcdFileDf, fidFileDf, tcdDatabase, fidDatabase, sampleVol, alignment=None, fileNames=(None, None), alignedRt=None, unique=False):
+  if alignment is not None:
+    tcdRt, fidRt = alignedRt or align_gas([tcdFileDf], [fidFileDf], tcdDatabase, fidDatabase, alignment, [fileNames])[0]
+    tcdOptions, fidOptions = detector_alignment(alignment, 'tcd'), detector_alignment(alignment, 'fid')
+    with profiling.stage('match', len(tcdFileDf) + len(fidFileDf)):
+      # Within the tolerance of each detector, each TCD compound matched only once
+      tcdRows, tcdFlags = match_within(tcdRt, tcdDatabase.rt_index(), True, tcdOptions.get('tolerance'), tcdOptions.get('ambiguity'))
+      fidRows, fidFlags = match_within(fidRt, fidDatabase.index, False, fidOptions.get('tolerance'), fidOptions.get('ambiguity'))
+      return (
+        GasResults(tcdFileDf, tcdDatabase, tcdRows, sampleVol, tcdRt, tcdFlags),
+        GasResults(fidFileDf, fidDatabase, fidRows, sampleVol, fidRt, fidFlags),
+      )
+  with profiling.stage('match', len(tcdFileDf) + len(fidFileDf)):
+    tcdMatches, fidMatches = gas_matches(tcdFileDf, fidFileDf, tcdDatabase, fidDatabase, unique)
+    return (
+      GasResults(tcdFileDf, tcdDatabase, tcdMatches, sampleVol),
+      GasResults(fidFileDf, fidDatabase, fidMatches, sampleVol),
+    )
+
+
+# Mass per classification of one gas sample, optionally isolating one compound
+def gas_summary(tcdResults, fidResults, sampleMass, isolate='None'):
+  if isolate not in COMPOUNDS_TO_ISOLATE:
+    raise Exception(f'Invalid compound to isolate: {isolate}.')
+  summaryDf = quantify.gas_summaries([quantify.gas_sample(tcdResults, fidResults, sampleMass, isolate)])
+  return summaryDf.rename(columns={'Mass_1': 'Mass'})
+
+
+# Match the compounds of a CompoundDatabase to the local Area peaks of one liquid sample
+# (CSV report or RAX trace).
+# detection: options of peaks.find_peaks (by default, every strict local maximum)
+# alignment: options of alignment.py, to correct the retention time drift of the sample before matching
+# unique: each peak matched to one compound only, in database order (by default, the closest
+#   peak of every compound, as the original analysis; aligned matches are always unique)
+def liquid_results(file, database, detection=None, alignment=None, unique=False):
+  fileDf, = parse_peaks(file)
+  return match_liquid(fileDf, database, detection, alignment, file, unique=unique)
+
+
+# Row of fileDf matched to each compound of the database (-1 when unmatched)
+def liquid_matches(fileDf, database, detection=None, unique=False):
+  # Select only local Area peaks from fileDf
+  peaks = find_peaks(fileDf[PEAK_COLUMN].to_numpy(), **(detection or {}))
+
+  # Closest peak for each compound, with unique each peak matched only once
+  matches = match_nearest(database.rt, fileDf[TIME_COLUMN].to_numpy()[peaks], unique=unique)
+  rows = np.full(len(matches), -1)
+  rows[matches >= 0] = peaks[matches[matches >= 0]]
+  return rows
+
+
+# Peak of fileDf matched to each compound of the database within the tolerance of the
+# alignment options, using the aligned retention times of the peaks, with the flag of each match
+def aligned_liquid_matches(fileDf, database, alignedRt, options, detection=None):
+  peaks = find_peaks(fileDf[PEAK_COLUMN].to_numpy(), **(detection or {}))
+  matches, flags = match_within(database.rt, alignedRt[peaks], True, options.get('tolerance'), options.get('ambiguity'))
+  rows = np.full(len(matches), -1)
+  rows[matches >= 0] = peaks[matches[matches >= 0]]
+  return rows, flags
+
+
+# LiquidResults of liquid_results from the peak table of the sample (file fileName).
+# alignedRt: retention times aligned with other samples by align_detector; the sample is
+# aligned alone otherwise
+def match_liquid(fileDf, database, detection=None, alignment=None, fileName=None, alignedRt=None, unique=False):
+  if alignment is not None:
+    if alignedRt is None:
+      alignedRt = align_detector([fileDf], database, alignment, [fileName], 'liquid')[0]
+    options = detector_alignment(alignment, 'liquid')
+    with profiling.stage('match', len(fileDf)):
+      rows, flags = aligned_liquid_matches(fileDf, database, alignedRt, options, detection)
+      return LiquidResults(fileDf, database, rows, alignedRt, flags)
+  with profiling.stage('match', len(fileDf)):
+    return LiquidResults(fileDf, database, liquid_matches(fileDf, database, detection, unique))
+
+
+# Mass per classification of one liquid sample, using the internal standard area
+def liquid_summary(results, sampleMass, isMass):
+  summaryDf = quantify.liquid_summaries([quantify.liquid_sample(results, sampleMass, isMass)])
+  return summaryDf.rename(columns={'Mass_1': 'Mass'})
+
+
+# Merge the summaries of all triplicates, identifying each one as Mass_n
+@profiling.profiled('summarize')
+def merge_summaries(summaries):
+  if len(summaries) == 0:
+    return pd.DataFrame()
+  return pd.concat([
+    thisSummaryDf.rename(columns={'Mass': f'Mass_{num+1}'})
+    for num, thisSummaryDf in enumerate(summaries)
+  ], axis=1)
+
+
+def save_summary(experiment, summaryDf):
+  output.write_summary(experiment, summaryDf)
+
+
+def select_database(databases):
+  print('Available databases:')
+  print('; '.join(
+    [f'[{i+1}] {os.path.basename(database)}' for i, database in enumerate(databases)]
+  ))
+  try:
+    databaseNum = int(input('Database number (default=1): '))
+    assert databaseNum > 0 and databaseNum <= len(databases)
+  except (ValueError, AssertionError):
+    print(f'Warning: invalid number, [1] {os.path.basename(databases[0])} will be used.')
+    databaseNum = 1
+  return databases[databaseNum-1]
+
+
+def input_positive(message):
+  while True:
+    try:
+      value = float(input(message))
+      assert value > 0
+      return value
+    except (ValueError, AssertionError):
+      print('Error: invalid value. Try again.')
+
 
 def gas_analysis(experiment):
+  profiling.set_experiment(experiment)
   inputFiles = sorted(glob.glob(os.path.join('input', experiment, '*.TX0')))
-  summaryDf = pd.DataFrame()
-
-  tcdDatabases = sorted(glob.glob(os.path.join('data', 'tcd', '*.csv')))
-  if len(tcdDatabases) == 0:
-    raise Exception('No database found in data/tcd folder.')
+  samples = []
 
-  fidDatabases = sorted(glob.glob(os.path.join('data', 'fid', '*.csv')))
-  if len(fidDatabases) == 0:
-    raise Exception('No database found in data/fid folder.')
+  tcdDatabases = list_databases('tcd')
+  fidDatabases = list_databases('fid')
 
   for num in range(3):
     # TCD data file
@@ -35,37 +255,8 @@ def gas_analysis(experiment):
     if fileNum == 0:
       break
 
-    # Internal variables for processing
     tcdFileName = inputFiles[fileNum-1]
-    tcdFileDf = pd.read_csv(
-      tcdFileName, encoding='latin1', skiprows=15, header=None,
-      names=[TIME_COLUMN, PEAK_COLUMN], usecols=[1,2]
-    )
-    tcdFileDf = tcdFileDf.apply(pd.to_numeric, errors='coerce').dropna().sort_values(by=[TIME_COLUMN])
-    tcdInputDf = tcdFileDf.copy()
-    tcdResultsDf = pd.DataFrame()
-
-    # Database choice
-    print('Available databases:')
-    print('; '.join(
-      [f'[{i+1}] {os.path.basename(database)}' for i, database in enumerate(tcdDatabases)]
-    ))
-    try:
-      databaseNum = int(input('Database number (default=1): '))
-      assert databaseNum > 0 and databaseNum <= len(tcdDatabases)
-    except (ValueError, AssertionError):
-      print(f'Warning: invalid number, [1] {os.path.basename(tcdDatabases[0])} will be used.')
-      databaseNum = 1
-    tcdDatabase = pd.read_csv(tcdDatabases[databaseNum-1])
-
-    # TCD Analysis
-    for _, inputRow in tcdInputDf.iterrows():
-      # Find closest row in tcdDatabase to inputRow[TIME_COLUMN]
-      rowResult = tcdDatabase.iloc[(tcdDatabase[TIME_COLUMN]-inputRow[TIME_COLUMN]).abs().argsort()[:1]]
-      newResults = pd.concat([inputRow, rowResult.squeeze().drop([TIME_COLUMN])])
-      tcdResultsDf = pd.concat([tcdResultsDf, newResults.to_frame().T], ignore_index=True)
-      # Filter out found compounds in tcdDatabase
-      tcdDatabase = tcdDatabase[(tcdDatabase[TIME_COLUMN].isin(tcdResultsDf[TIME_COLUMN]) == False)]
+    tcdDatabase = load_database(select_database(tcdDatabases))
 
     # FID data file
     print('Avaliable files:')
@@ -79,216 +270,56 @@ def gas_analysis(experiment):
         break
       except (ValueError, AssertionError):
         print('Error: invalid file number. Try again.')
-    
-    # Internal variables for processing
-    fidFileName = inputFiles[fileNum-1]
-    fidFileDf = pd.read_csv(
-      fidFileName, encoding='latin1', skiprows=15, header=None,
-      names=[TIME_COLUMN, PEAK_COLUMN], usecols=[1,2]
-    )
-    fidFileDf = fidFileDf.apply(pd.to_numeric, errors='coerce').dropna().sort_values(by=[TIME_COLUMN])
-    fidInputDf = fidFileDf.copy()
-    fidResultsDf = pd.DataFrame()
-
-    # Database choice
-    print('Available databases:')
-    print('; '.join(
-      [f'[{i+1}] {os.path.basename(database)}' for i, database in enumerate(fidDatabases)]
-    ))
-    try:
-      databaseNum = int(input('Database number (default=1): '))
-      assert databaseNum > 0 and databaseNum <= len(fidDatabases)
-    except (ValueError, AssertionError):
-      print(f'Warning: invalid number, [1] {os.path.basename(fidDatabases[0])} will be used.')
-      databaseNum = 1
-    fidDatabase = pd.read_csv(fidDatabases[databaseNum-1])
 
-    # FID Analysis
-    for _, inputRow in fidInputDf.iterrows():
-      # Find closest row in fidDatabase to inputRow[TIME_COLUMN]
-      rowResult = fidDatabase.iloc[(fidDatabase[TIME_COLUMN]-inputRow[TIME_COLUMN]).abs().argsort()[:1]]
-      newResults = pd.concat([inputRow, rowResult.squeeze().drop([TIME_COLUMN])])
-      fidResultsDf = pd.concat([fidResultsDf, newResults.to_frame().T], ignore_index=True)
+    fidFileName = inputFiles[fileNum-1]
+    fidDatabase = load_database(select_database(fidDatabases))
 
     # Get from the user: mass of sample and volume of sample
-    while True:
-      try:
-        sampleMass = float(input('Mass of sample [g]: '))
-        assert sampleMass > 0
-        break
-      except (ValueError, AssertionError):
-        print('Error: invalid value. Try again.')
-    while True:
-      try:
-        sampleVol = float(input('Volume of sample [mL]: ')) # TODO: mL?
-        assert sampleVol > 0
-        break
-      except (ValueError, AssertionError):
-        print('Error: invalid value. Try again.')
-
-    # Volume and Mass of each compound
-    fidResultsDf['Volume'] = fidResultsDf['Area'] / fidResultsDf['Response Factor']
-    fidResultsDf['Volume in Sample'] = fidResultsDf['Volume'] * sampleVol / 5
-    fidResultsDf['Mass'] = fidResultsDf['Volume in Sample'] * fidResultsDf['Density']
-    tcdResultsDf['Volume'] = tcdResultsDf['Area'] / tcdResultsDf['Response Factor']
-    tcdResultsDf['Volume in Sample'] = tcdResultsDf['Volume'] * sampleVol / 5
-    tcdResultsDf['Mass'] = tcdResultsDf['Volume in Sample'] * tcdResultsDf['Density']
-
-    # Save csv table in output folder, using the input directory template
-    os.makedirs(os.path.join('output', experiment), exist_ok=True)
-    tcdResultsDf.to_csv(os.path.join('output', experiment, os.path.basename(tcdFileName).replace(".TX0", ".csv")), index=False)
-    fidResultsDf.to_csv(os.path.join('output', experiment, os.path.basename(fidFileName).replace(".TX0", ".csv")), index=False)
-    print(f'File saved to output/{experiment}/{os.path.basename(tcdFileName).replace(".TX0", ".csv")}')
-    print(f'File saved to output/{experiment}/{os.path.basename(fidFileName).replace(".TX0", ".csv")}')
+    sampleMass = input_positive('Mass of sample [g]: ')
+    sampleVol = input_positive('Volume of sample [mL]: ') # TODO: mL?
+
+    tcdResults, fidResults = gas_results(tcdFileName, fidFileName, tcdDatabase, fidDatabase, sampleVol)
+    save_results(experiment, tcdResults, results_name(tcdFileName))
+    save_results(experiment, fidResults, results_name(fidFileName))
 
     # Isolate specific compound
-    compoundsToIsolate = ['None', 'Nitrogen', 'Isobutylene', '1-Butene', '1,3-Butadiene', 'Butane', 'Isobutane']
     print('Isolate specific compound in analysis?')
-    print('; '.join([f'[{i}] {c}' for i, c in enumerate(compoundsToIsolate)]))
+    print('; '.join([f'[{i}] {c}' for i, c in enumerate(COMPOUNDS_TO_ISOLATE)]))
     try:
       compoundNum = int(input('Compound number (default=0): '))
-      assert compoundNum >= 0 and compoundNum < len(compoundsToIsolate)
+      assert compoundNum >= 0 and compoundNum < len(COMPOUNDS_TO_ISOLATE)
     except (ValueError, AssertionError):
       print('Warning: invalid value. [0] None will be considered.')
       compoundNum = 0
-    
-    if compoundNum != 0:
-      tcdResultsDf.loc[tcdResultsDf['Compound'] == compoundsToIsolate[compoundNum], 'Classification'] = compoundsToIsolate[compoundNum]
-      fidResultsDf.loc[fidResultsDf['Compound'] == compoundsToIsolate[compoundNum], 'Classification'] = compoundsToIsolate[compoundNum]
-
-    # Merge results to a single table
-    thisSummaryDf = pd.merge(
-      fidResultsDf.groupby('Classification')[['Mass']].sum(),
-      tcdResultsDf.groupby('Classification')[['Mass']].sum(),
-      'outer',
-      ['Classification', 'Mass']
-    )
-
-    # Append unaccounted row 
-    unaccountedRow = pd.Series(data={
-      'Mass': sampleMass - thisSummaryDf[['Mass']].sum().squeeze()
-    }, name='Unaccounted')
-    thisSummaryDf = pd.concat([thisSummaryDf, unaccountedRow.to_frame().T])
-
-    # Append sample row 
-    sampleRow = pd.Series(data={
-      'Mass': sampleMass
-    }, name='Sample')
-    thisSummaryDf = pd.concat([thisSummaryDf, sampleRow.to_frame().T])
 
-    # Identify this summary section
-    thisSummaryDf = thisSummaryDf.rename(columns={
-      'Mass': f'Mass_{num+1}'
-    })
+    samples.append(quantify.gas_sample(tcdResults, fidResults, sampleMass, COMPOUNDS_TO_ISOLATE[compoundNum]))
 
-    # Merge this summary with other triplicates
-    summaryDf = pd.concat([summaryDf, thisSummaryDf], axis=1)
-
-  summaryDf.to_excel(os.path.join('output', f'{experiment}_summary.xlsx'))
-  print(f'Summary saved to output/{experiment}_summary.xlsx')
+  # Summary of all samples, quantified at once
+  save_summary(experiment, quantify.gas_summaries(samples) if samples else pd.DataFrame())
 
 
 def liquid_analysis(experiment):
+  profiling.set_experiment(experiment)
   inputFiles = sorted(glob.glob(os.path.join('input', experiment, '*.csv')))
-  summaryDf = pd.DataFrame()
+  samples = []
 
-  databases = sorted(glob.glob(os.path.join('data', 'liquid', '*.csv')))
-  if len(databases) == 0:
-    raise Exception('No database found in data/liquid folder.')
+  databases = list_databases('liquid')
 
-  for num, file in enumerate(inputFiles):
+  for file in inputFiles:
     print(f'Processing {os.path.basename(file)}...')
-    fileDf = pd.read_csv(file).sort_values(by=[TIME_COLUMN])
-
-    # Internal variables for processing
-    inputDf = fileDf.copy()
-    resultsDf = pd.DataFrame()
 
     # Database choice
-    print('Available databases:')
-    print("; ".join(
-      [f'[{i+1}] {os.path.basename(database)}' for i, database in enumerate(databases)]
-    ))
-    try:
-      databaseNum = int(input('Database number (default=1): '))
-      assert databaseNum > 0 and databaseNum <= len(databases)
-    except (ValueError, AssertionError):
-      print(f'Warning: invalid number, [1] {os.path.basename(databases[0])} will be used.')
-      databaseNum = 1
-
-    database = pd.read_csv(databases[databaseNum-1])
-    for _, dbRow in database.iterrows():  
-      # Select only local Area peaks from inputDf
-      filteredDf = inputDf[
-        (inputDf.shift(1, fill_value=0)[PEAK_COLUMN] < inputDf[PEAK_COLUMN]) &
-        (inputDf.shift(-1, fill_value=0)[PEAK_COLUMN] < inputDf[PEAK_COLUMN])
-      ]
-      # Find closest row in filteredDf to dbRow[TIME_COLUMN]
-      rowResult = filteredDf.iloc[(filteredDf[TIME_COLUMN]-dbRow[TIME_COLUMN]).abs().argsort()[:1]]
-      newResults = pd.concat([dbRow, rowResult.squeeze().drop([TIME_COLUMN])])
-      resultsDf = pd.concat([resultsDf, newResults.to_frame().T], ignore_index=True)
-      # Filter out found compounds in inputDf
-      inputDf = inputDf[(inputDf[TIME_COLUMN].isin(resultsDf[TIME_COLUMN]) == False)]
-
-    # Get area of internal standard from previous resultsDf
-    isArea = resultsDf.loc[resultsDf['Classification'] == 'internal standard', 'Area'].squeeze()
+    database = load_database(select_database(databases))
+    results = liquid_results(file, database)
 
     # Get from the user: mass of internal standard and mass of sample
-    while True:
-      try:
-        sampleMass = float(input('Mass of sample [g]: '))
-        assert sampleMass > 0
-        break
-      except (ValueError, AssertionError):
-        print('Error: invalid value. Try again.')
-    while True:
-      try:
-        isMass = float(input('Mass of Internal Standard [g]: '))
-        assert isMass > 0
-        break
-      except (ValueError, AssertionError):
-        print('Error: invalid value. Try again.')
-
-    # Merge results with input file, so unclassified compounds are still present in output
-    resultsDf = pd.merge(
-      fileDf,
-      resultsDf,
-      'outer',
-      fileDf.keys().tolist()
-    ).sort_values(by=[TIME_COLUMN])
-
-    # Save csv table in output folder, using the input directory template
-    os.makedirs(os.path.join('output', experiment), exist_ok=True)
-    resultsDf.to_csv(os.path.join('output', experiment, os.path.basename(file)), index=False)
-    print(f'File saved to output/{experiment}/{os.path.basename(file)}\n')
-    
-    # Fill empty values of resultsDf
-    resultsDf[['RRF']] = resultsDf[['RRF']].fillna(value=1)
-    resultsDf[['Classification']] = resultsDf[['Classification']].fillna(value='unidentified')
-    
-    # Normalized Area and Mass of each compound
-    resultsDf['NormalizedArea'] = resultsDf['Area'] / resultsDf['RRF']
-    resultsDf['Mass'] = resultsDf['NormalizedArea'] * isMass / isArea
-
-    # Summary
-    thisSummaryDf = resultsDf.groupby('Classification')[['Mass']].sum()
-    unaccountedRow = pd.Series(data={
-      'Mass': sampleMass - thisSummaryDf[['Mass']].sum().squeeze() + isMass
-    }, name='unaccounted')
-    thisSummaryDf = pd.concat([thisSummaryDf, unaccountedRow.to_frame().T])
-
-    sampleRow = pd.Series(data={
-      'Mass': sampleMass
-    }, name='Sample')
-    thisSummaryDf = pd.concat([thisSummaryDf, sampleRow.to_frame().T])
-
-    # Identify this summary section
-    thisSummaryDf = thisSummaryDf.rename(columns={
-      'Mass': f'Mass_{num+1}'
-    })
-
-    # Merge this summary with other triplicates
-    summaryDf = pd.concat([summaryDf, thisSummaryDf], axis=1)
-
-  summaryDf.to_excel(os.path.join('output', f'{experiment}_summary.xlsx'))
-  print(f'Summary saved to output/{experiment}_summary.xlsx')
+    sampleMass = input_positive('Mass of sample [g]: ')
+    isMass = input_positive('Mass of Internal Standard [g]: ')
+
+    save_results(experiment, results, results_name(file))
+    print()
+
+    samples.append(quantify.liquid_sample(results, sampleMass, isMass))
+
+  # Summary of all samples, quantified at once
+  save_summary(experiment, quantify.liquid_summaries(samples) if samples else pd.DataFrame())
@@ -0,0 +1,451 @@
+import csv
+import glob
+import json
+import os
+
+import alignment as align
+import analysis
+import build
+import compare
+import output
+import plot
+import profiling
+import quantify
+import tx0
+from database import load_database
+
+# Manifest with one job per experiment, in JSON, YAML or CSV format.
+#
+# JSON/YAML: a list of jobs, or an object with a "jobs" list. Each job has:
+#   experiment: folder name under input/
+#   type: "liquid" or "gas"
+#   function: "analysis", "plot" or "both" (default "analysis")
+#   database: liquid database, by number (as listed in the terminal) or file name (default 1)
+#   peakDetection: liquid peak detection options, as in peaks.find_peaks (JSON/YAML only):
+#     height, prominence, width, plateau
+#   tcdDatabase, fidDatabase: gas databases, same format (default 1)
+#   peakSource: gas peaks from the TX0 reports ("report", default) or integrated from the
+#     RAX traces ("raw"); liquid samples integrate their file when it is a RAX trace
+#   decimate: number of min/max buckets each trace is reduced to before plotting (default: all points)
+#   uniqueMatches: match each TCD compound to one peak only, and each liquid peak to one compound
+#     only, instead of the closest one of every peak (TCD) or compound (liquid) (default false;
+#     matches within an alignment tolerance are always unique)
+#   alignment: retention time drift correction and matching tolerance, as in alignment.py
+#     (JSON/YAML only): anchors, window, reference, maxShift, tolerance, ambiguity, and for gas
+#     jobs the same options of one detector (e.g. tcdAnchors, fidReference). reference is a RAX
+#     file of the experiment.
+#   compare: plot the traces as a comparison of many runs instead of one subplot per trace, as
+#     in compare.py (JSON/YAML only): views (heatmap, waterfall, overlay), points, markers (the
+#     compounds of the databases of the job). Gas plot jobs may then omit samples, to compare
+#     every TCD/FID pair of traces of the experiment.
+#   samples: list of samples, each with
+#     liquid: file, mass, isMass
+#     gas: tcd, fid (file names, with or without extension), mass, volume, isolate (default "None").
+#       A sample with only one of tcd and fid is paired with the report of the other detector
+#       with the same sample name, acquisition time and instrument (TX0 headers).
+#
+# CSV: one row per sample, with the job and sample keys above as columns. Rows of the
+# same experiment are grouped into one job, in order of appearance.
+
+JOB_KEYS = ['experiment', 'type', 'function', 'database', 'tcdDatabase', 'fidDatabase', 'peakSource', 'decimate', 'uniqueMatches']
+FUNCTIONS = ['analysis', 'plot', 'both']
+TYPES = ['liquid', 'gas']
+
+
+def read_manifest(path):
+  extension = os.path.splitext(path)[1].lower()
+  if extension == '.json':
+    with open(path) as f:
+      jobs = json.load(f)
+  elif extension in ['.yaml', '.yml']:
+    try:
+      import yaml
+    except ImportError:
+      raise Exception('PyYAML is required to read YAML manifests (pip3 install pyyaml).')
+    with open(path) as f:
+      jobs = yaml.safe_load(f)
+  elif extension == '.csv':
+    jobs = read_csv_manifest(path)
+  else:
+    raise Exception(f'Unsupported manifest format: {path}. Use JSON, YAML or CSV.')
+
+  if isinstance(jobs, dict):
+    jobs = jobs.get('jobs', [])
+  if not isinstance(jobs, list):
+    raise Exception(f'Invalid manifest {path}: expected a list of jobs.')
+  return jobs
+
+
+def read_csv_manifest(path):
+  jobs = {}
+  with open(path, newline='') as f:
+    for row in csv.DictReader(f):
+      row = {k.strip(): v.strip() for k, v in row.items() if v is not None and v.strip() != ''}
+      job = jobs.setdefault(row.get('experiment'), {'samples': []})
+      for key in JOB_KEYS:
+        if key in row:
+          job[key] = row.pop(key)
+      if row:
+        job['samples'].append(row)
+  return list(jobs.values())
+
+
+def validate_job(job):
+  job = dict(job)
+  if not job.get('experiment'):
+    raise Exception('Manifest job without experiment.')
+  experiment = job['experiment']
+  if not os.path.isdir(os.path.join('input', experiment)):
+    raise Exception(f'Experiment folder input/{experiment} not found.')
+  if job.get('type') not in TYPES:
+    raise Exception(f'Invalid type for {experiment}: {job.get("type")}. Use liquid or gas.')
+  job.setdefault('function', 'analysis')
+  if job.get('decimate') is not None:
+    try:
+      decimate = int(job['decimate'])
+    except (TypeError, ValueError):
+      decimate = 0
+    if decimate < 1:
+      raise Exception(f'Invalid decimate for {experiment}: {job["decimate"]}. Use a number of buckets of at least 1.')
+    job['decimate'] = decimate
+  unique = str(job.get('uniqueMatches', False)).lower()
+  if unique not in ['true', 'false', '1', '0', '']:
+    raise Exception(f'Invalid uniqueMatches for {experiment}: {job["uniqueMatches"]}. Use true or false.')
+  job['uniqueMatches'] = unique in ['true', '1']
+  if job.get('peakSource', 'report') not in ['report', 'raw']:
+    raise Exception(f'Invalid peakSource for {experiment}: {job["peakSource"]}. Use report or raw.')
+  if job['function'] not in FUNCTIONS:
+    raise Exception(f'Invalid function for {experiment}: {job["function"]}. Use analysis, plot or both.')
+
+  detection = job.get('peakDetection') or {}
+  if not isinstance(detection, dict) or set(detection) - set(['height', 'prominence', 'width', 'plateau']):
+    raise Exception(f'Invalid peakDetection options for {experiment}: {detection}.')
+  options = job.get('alignment')
+  detectors = align.DETECTORS if job['type'] == 'gas' else []
+  keys = align.OPTIONS + [d + o[0].upper() + o[1:] for d in detectors for o in align.OPTIONS]
+  if options is not None and (not isinstance(options, dict) or set(options) - set(keys)):
+    raise Exception(f'Invalid alignment options for {experiment}: {options}.')
+  if job.get('compare') is not None:
+    if not isinstance(job['compare'], dict):
+      raise Exception(f'Invalid compare options for {experiment}: {job["compare"]}.')
+    job['compare'] = compare.check_options(job['compare'])
+
+  samples = []
+  partners = None
+  for sample in job.get('samples', []):
+    sample = dict(sample)
+    if job['type'] == 'gas' and ('tcd' in sample) != ('fid' in sample):
+      partners = report_partners(experiment) if partners is None else partners
+      sample = paired_sample(experiment, sample, partners)
+    required = ['file', 'mass', 'isMass'] if job['type'] == 'liquid' else ['tcd', 'fid', 'mass', 'volume']
+    if job['type'] == 'gas' and job['function'] == 'plot':
+      required = ['tcd', 'fid']
+    missing = [key for key in required if key not in sample]
+    if missing:
+      raise Exception(f'Sample of {experiment} missing {", ".join(missing)}.')
+    for key in ['mass', 'volume', 'isMass']:
+      if key in sample:
+        sample[key] = float(sample[key])
+        if sample[key] <= 0:
+          raise Exception(f'Invalid {key} for sample of {experiment}: {sample[key]}.')
+    sample.setdefault('isolate', 'None')
+    samples.append(sample)
+  job['samples'] = samples
+  comparison = job['function'] == 'plot' and job.get('compare') is not None
+  if len(samples) == 0 and (job['type'] == 'gas' and not comparison or job['function'] != 'plot'):
+    raise Exception(f'No samples given for experiment {experiment}.')
+  return job
+
+
+# Report of the other detector of each TX0 report of an experiment, by file name without
+# extension, from the metadata of the reports
+def report_partners(experiment):
+  fileNames = sorted(glob.glob(os.path.join('input', experiment, '*.TX0')))
+  pairs, _ = tx0.pair_reports(fileNames)
+  partners = {}
+  for tcdFile, fidFile in pairs:
+    tcdName, fidName = [os.path.splitext(os.path.basename(f))[0] for f in (tcdFile, fidFile)]
+    partners[tcdName], partners[fidName] = fidName, tcdName
+  return partners
+
+
+def paired_sample(experiment, sample, partners):
+  detector, other = ('tcd', 'fid') if 'tcd' in sample else ('fid', 'tcd')
+  name = os.path.splitext(sample[detector])[0]
+  if name not in partners:
+    raise Exception(f'No {other.upper()} report found for {sample[detector]} in input/{experiment}.')
+  return {**sample, other: partners[name]}
+
+
+# Database given by number (1-based, as listed in the terminal) or by file name
+def resolve_database(kind, choice):
+  databases = analysis.list_databases(kind)
+  if choice is None:
+    return databases[0]
+  try:
+    num = int(choice)
+  except ValueError:
+    path = os.path.join('data', kind, str(choice))
+    if path not in databases:
+      raise Exception(f'Database {choice} not found in data/{kind} folder.')
+    return path
+  if num <= 0 or num > len(databases):
+    raise Exception(f'Invalid database number for data/{kind}: {num}.')
+  return databases[num-1]
+
+
+# Input file of an experiment, with extension replaced (e.g. TCD/FID given without extension)
+def resolve_file(experiment, name, extension=None):
+  if extension is not None:
+    name = os.path.splitext(name)[0] + extension
+  path = os.path.join('input', experiment, name)
+  if not os.path.isfile(path):
+    raise Exception(f'File {path} not found.')
+  return path
+
+
+# Alignment options of a job, with its reference traces as paths
+def resolve_alignment(experiment, options):
+  if options is None:
+    return None
+  return {
+    key: resolve_file(experiment, value, '.RAX') if key.lower().endswith('reference') and value else value
+    for key, value in options.items()
+  }
+
+
+# Analysis of one gas replicate: saves its results and returns its matched peaks, quantified
+# with the other replicates of the experiment by experiment_summary.
+# aligned: TCD and FID peak tables of the replicate and their aligned retention times, from
+# align_tasks (parsed and aligned alone otherwise)
+def gas_replicate(experiment, sample, tcdDatabaseFile, fidDatabaseFile, extension='.TX0', alignment=None, unique=False, aligned=None):
+  profiling.set_experiment(experiment)
+  tcdFileName = resolve_file(experiment, sample['tcd'], extension)
+  fidFileName = resolve_file(experiment, sample['fid'], extension)
+  tcdDatabase = load_database(tcdDatabaseFile)
+  fidDatabase = load_database(fidDatabaseFile)
+  if aligned is None:
+    tcdResults, fidResults = analysis.gas_results(tcdFileName, fidFileName, tcdDatabase, fidDatabase, sample['volume'], alignment, unique)
+  else:
+    frames, alignedRt = aligned
+    fileNames = (tcdFileName, fidFileName)
+    tcdResults, fidResults = analysis.match_gas(*frames, tcdDatabase, fidDatabase, sample['volume'], alignment, fileNames, alignedRt, unique)
+  analysis.save_results(experiment, tcdResults, analysis.results_name(tcdFileName))
+  analysis.save_results(experiment, fidResults, analysis.results_name(fidFileName))
+  return quantify.gas_arrays(tcdResults, fidResults)
+
+
+# Analysis of one liquid replicate: saves its results and returns its matched peaks.
+# aligned: peak table of the replicate and its aligned retention times, from align_tasks
+def liquid_replicate(experiment, sample, databaseFile, detection=None, alignment=None, unique=False, aligned=None):
+  profiling.set_experiment(experiment)
+  file = resolve_file(experiment, sample['file'])
+  if aligned is None:
+    results = analysis.liquid_results(file, load_database(databaseFile), detection, alignment, unique)
+  else:
+    (fileDf,), alignedRt = aligned
+    results = analysis.match_liquid(fileDf, load_database(databaseFile), detection, alignment, file, alignedRt, unique)
+  analysis.save_results(experiment, results, analysis.results_name(file))
+  return quantify.liquid_arrays(results)
+
+
+# Sample of quantify.gas_summaries or liquid_summaries: the matched peaks of a replicate
+# (arrays), with the databases of its job and its parameters
+def quantified_sample(job, sample, arrays):
+  if job['type'] == 'liquid':
+    database = load_database(resolve_database('liquid', job.get('database')))
+    return dict(arrays, database=database, mass=sample['mass'], isMass=sample['isMass'])
+  tcdDatabase = load_database(resolve_database('tcd', job.get('tcdDatabase')))
+  fidDatabase = load_database(resolve_database('fid', job.get('fidDatabase')))
+  return dict(arrays, tcdDatabase=tcdDatabase, fidDatabase=fidDatabase, mass=sample['mass'], volume=sample['volume'], isolate=sample['isolate'])
+
+
+# Summary of gas or liquid samples, all quantified in one batch
+def summarize(kind, samples):
+  return quantify.gas_summaries(samples) if kind == 'gas' else quantify.liquid_summaries(samples)
+
+
+# Summary of an experiment, from the matched peaks of every replicate of its job
+def experiment_summary(job, arrays):
+  return summarize(job['type'], [quantified_sample(job, sample, a) for sample, a in zip(job['samples'], arrays)])
+
+
+# Replicate tasks of a job, as (function, arguments) in triplicate order
+def replicate_tasks(job):
+  experiment = job['experiment']
+  alignment = resolve_alignment(experiment, job.get('alignment'))
+  unique = job.get('uniqueMatches', False)
+  if job['type'] == 'liquid':
+    databaseFile = resolve_database('liquid', job.get('database'))
+    detection = job.get('peakDetection')
+    return [(liquid_replicate, (experiment, sample, databaseFile, detection, alignment, unique)) for sample in job['samples']]
+  tcdDatabaseFile = resolve_database('tcd', job.get('tcdDatabase'))
+  fidDatabaseFile = resolve_database('fid', job.get('fidDatabase'))
+  extension = '.RAX' if job.get('peakSource') == 'raw' else '.TX0'
+  return [(gas_replicate, (experiment, sample, tcdDatabaseFile, fidDatabaseFile, extension, alignment, unique)) for sample in job['samples']]
+
+
+# Reports or traces of a replicate task
+def task_inputs(function, args):
+  experiment, sample = args[0], args[1]
+  if function is liquid_replicate:
+    return [resolve_file(experiment, sample['file'])]
+  extension = args[4]
+  return [resolve_file(experiment, sample['tcd'], extension), resolve_file(experiment, sample['fid'], extension)]
+
+
+# Replicate tasks of a job with the peaks of every replicate parsed and aligned beforehand, the
+# replicates of each detector in one batch of alignment.align_runs. Tasks of jobs without
+# alignment are returned as they are.
+def align_tasks(tasks):
+  if not tasks:
+    return tasks
+  function, args = tasks[0]
+  alignment = args[4] if function is liquid_replicate else args[5]
+  if alignment is None:
+    return tasks
+  fileNames = [task_inputs(function, args) for function, args in tasks]
+  if function is liquid_replicate:
+    frames = [analysis.parse_peaks(*files) for files in fileNames]
+    alignedRts = analysis.align_detector([f for f, in frames], load_database(args[2]), alignment, [f for f, in fileNames], 'liquid')
+  else:
+    frames = [analysis.parse_peaks(*files, gas=True) for files in fileNames]
+    tcdFrames, fidFrames = [tcd for tcd, _ in frames], [fid for _, fid in frames]
+    alignedRts = analysis.align_gas(tcdFrames, fidFrames, load_database(args[2]), load_database(args[3]), alignment, fileNames)
+  return [(function, (*args, (f, rt))) for (function, args), f, rt in zip(tasks, frames, alignedRts)]
+
+
+# Input files of a replicate task: its reports or traces, and its databases (with the traces
+# its alignment is estimated from)
+def replicate_files(function, args):
+  inputs = task_inputs(function, args)
+  if function is liquid_replicate:
+    databases, alignment = [args[2]], args[4]
+  else:
+    databases, alignment = [args[2], args[3]], args[5]
+  references = [value for key, value in (alignment or {}).items() if key.lower().endswith('reference') and value]
+  if references:
+    databases += references + [f for f in map(align.trace_file, inputs) if f and f not in inputs]
+  return inputs, databases
+
+
+# Replicate tasks of a job that reuse the matched peaks of replicates already built from the
+# same inputs, parameters and code (all are run again with force), with the key of each replicate.
+# The replicates to build are aligned together by align_tasks.
+def build_tasks(job, force=False):
+  experiment = job['experiment']
+  replicates = replicate_tasks(job)
+  keys, outputs = [], []
+  for function, args in replicates:
+    inputs, databases = replicate_files(function, args)
+    keys.append(build.build_key(build.ANALYSIS_MODULES, inputs + databases, [function.__name__, *args, output.formats]))
+    outputs.append([path for f in inputs for path in output.results_files(experiment, analysis.results_name(f))])
+  stale = [num for num, (key, paths) in enumerate(zip(keys, outputs)) if force or not build.is_built(experiment, key, paths)]
+  for num, task in zip(stale, align_tasks([replicates[num] for num in stale])):
+    replicates[num] = task
+  tasks = [
+    (build.cached_replicate, (experiment, key, paths, force, function, *args))
+    for (function, args), key, paths in zip(replicates, keys, outputs)
+  ]
+  return tasks, keys
+
+
+# RAX files plotted by a job: (TCD, FID) pairs of gas samples, or every trace of a liquid experiment
+def plot_files(job):
+  experiment = job['experiment']
+  if job['type'] == 'gas' and not job['samples']:
+    return compare.gas_pairs(experiment)
+  if job['type'] == 'gas':
+    return [
+      (resolve_file(experiment, s['tcd'], '.RAX'), resolve_file(experiment, s['fid'], '.RAX'))
+      for s in job['samples']
+    ]
+  return sorted(glob.glob(os.path.join('input', experiment, '*.RAX')))
+
+
+# Databases marked on the comparison of a job: the liquid database, or the TCD and FID ones
+def plot_databases(job):
+  options = job.get('compare')
+  if options is None or not options['markers']:
+    return []
+  if job['type'] == 'gas':
+    return [resolve_database('tcd', job.get('tcdDatabase')), resolve_database('fid', job.get('fidDatabase'))]
+  return [resolve_database('liquid', job.get('database'))]
+
+
+def plot_key(job):
+  files = plot_files(job)
+  if job['type'] == 'gas':
+    files = [f for pair in files for f in pair]
+  params = [job['type'], [os.path.basename(f) for f in files], job.get('decimate'), job.get('compare')]
+  return build.build_key(build.PLOT_MODULES, files + plot_databases(job), params)
+
+
+# Figure of a plot job, rendered off-screen, and saved to output/{experiment}_plot.png with save
+def plot_figure(job, save=True):
+  pairs = plot_files(job) if job['type'] == 'gas' else None
+  if job.get('compare') is not None:
+    return compare.compare_plot(job['experiment'], job['type'] == 'gas', pairs, job['compare'], plot_databases(job), False, save)
+  if job['type'] == 'gas':
+    return plot.gas_plot(job['experiment'], pairs, False, job.get('decimate'), save)
+  return plot.liquid_plot(job['experiment'], False, job.get('decimate'), save)
+
+
+def run_plot(job):
+  plot_figure(job)
+
+
+# Whether the summary (from these replicates) or plot of an experiment was built with the
+# same key and still exists
+def analysis_fresh(experiment, replicateKeys):
+  key = build.summary_key(replicateKeys)
+  return build.is_fresh(experiment, 'summary', key, output.summary_files(experiment))
+
+
+def plot_fresh(experiment, key):
+  return build.is_fresh(experiment, 'plot', key, [os.path.join('output', f'{experiment}_plot.png')])
+
+
+# Run one job without prompts. Outputs whose inputs, parameters and code did not change
+# since they were built are skipped, and so are unchanged replicates of a stale summary,
+# unless overwrite is set.
+def run_job(job, overwrite=False):
+  job = validate_job(job)
+  experiment = job['experiment']
+  profiling.set_experiment(experiment)
+  if job['function'] in ['analysis', 'both']:
+    tasks, keys = build_tasks(job, overwrite)
+    if analysis_fresh(experiment, keys) and not overwrite:
+      print(f'Output for {experiment} is up to date. Skipping peak analysis.')
+    else:
+      print(f'\nExecuting peak analysis function for {experiment}.')
+      arrays = [function(*args) for function, args in tasks]
+      analysis.save_summary(experiment, experiment_summary(job, arrays))
+      build.record_summary(experiment, keys)
+  if job['function'] in ['plot', 'both']:
+    key = plot_key(job)
+    if plot_fresh(experiment, key) and not overwrite:
+      print(f'Plot for {experiment} is up to date. Skipping plot.')
+    else:
+      print(f'\nExecuting plot function for {experiment}.')
+      run_plot(job)
+      build.record(experiment, 'plot', key)
+
+
+# Process every job of the manifest, on a process pool when numJobs is not 1
+# (0 or None uses all CPUs); returns the experiments that failed
+def run_manifest(path, overwrite=False, numJobs=1):
+  jobs = read_manifest(path)
+  print(f'Found {len(jobs)} jobs in {path}.')
+  if numJobs != 1:
+    import scheduler
+    return scheduler.run_parallel(jobs, numJobs, overwrite)
+  failed = []
+  for job in jobs:
+    try:
+      run_job(job, overwrite)
+    except Exception as e:
+      print('Error:', e)
+      print('Skipping to next experiment.')
+      failed.append(job.get('experiment'))
+  return failed
@@ -0,0 +1,636 @@
+#!/bin/python3
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+from matching import assemble_matches, match_nearest
+from rax import GAS_FREQ, LIQUID_FREQ
+
+TIME_COLUMN = 'RT'
+PEAK_COLUMN = 'Area'
+
+
+# Synthetic peak report and compound database with uniformly spread retention times
+def synthetic_matching_data(numPeaks, numCompounds, seed=0):
+  rng = np.random.default_rng(seed)
+  database = pd.DataFrame({
+    TIME_COLUMN: np.sort(rng.uniform(0, 60, numCompounds)).round(3),
+    'Compound': [f'Compound {i}' for i in range(numCompounds)],
+    'Classification': rng.choice(['alkane', 'alkene', 'aromatic', 'fatty acid'], numCompounds),
+    'Response Factor': rng.uniform(1e5, 1e7, numCompounds),
+    'Density': rng.uniform(1e-4, 1e-3, numCompounds),
+  })
+  peaks = pd.DataFrame({
+    TIME_COLUMN: np.sort(rng.uniform(0, 60, numPeaks)).round(3),
+    PEAK_COLUMN: rng.uniform(1e3, 1e6, numPeaks),
+  })
+  return peaks, database
+
+
+# Matching loop as previously implemented in analysis.gas_analysis (TCD branch)
+def legacy_match(peaks, database):
+  resultsDf = pd.DataFrame()
+  for _, inputRow in peaks.iterrows():
+    rowResult = database.iloc[(database[TIME_COLUMN]-inputRow[TIME_COLUMN]).abs().argsort()[:1]]
+    newResults = pd.concat([inputRow, rowResult.squeeze().drop([TIME_COLUMN])])
+    resultsDf = pd.concat([resultsDf, newResults.to_frame().T], ignore_index=True)
+    database = database[(database[TIME_COLUMN].isin(resultsDf[TIME_COLUMN]) == False)]
+  return resultsDf
+
+
+def engine_match(peaks, database, unique=True):
+  matches = match_nearest(peaks[TIME_COLUMN], database[TIME_COLUMN], unique=unique)
+  return assemble_matches(peaks, database, matches, [TIME_COLUMN])
+
+
+def bench_matching(numPeaks, numCompounds, legacyPeaks):
+  peaks, database = synthetic_matching_data(numPeaks, numCompounds)
+  print(f'Matching {numPeaks} peaks against {numCompounds} compounds')
+
+  start = time.perf_counter()
+  engine_match(peaks, database, unique=True)
+  engineUnique = time.perf_counter() - start
+  print(f'  engine (unique):        {engineUnique:10.3f} s')
+
+  start = time.perf_counter()
+  engine_match(peaks, database, unique=False)
+  engineNearest = time.perf_counter() - start
+  print(f'  engine (nearest):       {engineNearest:10.3f} s')
+
+  # The legacy loop is timed on a subset of peaks and extrapolated linearly, which
+  # underestimates it since its row-by-row concat grows quadratically
+  legacyPeaks = min(legacyPeaks, numPeaks)
+  start = time.perf_counter()
+  legacy_match(peaks.iloc[:legacyPeaks], database)
+  legacy = (time.perf_counter() - start) * numPeaks / legacyPeaks
+  label = 'measured' if legacyPeaks == numPeaks else f'extrapolated from {legacyPeaks} peaks'
+  print(f'  legacy loop:            {legacy:10.3f} s ({label})')
+  print(f'  speedup (unique):       {legacy / engineUnique:10.1f}x')
+
+
+# Classifications of each synthetic database (TCD and FID ones disjoint, as in data/)
+GAS_CLASSES = {'tcd': ['Hydrogen', 'Carbon Dioxide', 'Nitrogen'], 'fid': ['C1-C4 alkanes', 'C1-C4 alkenes', 'C5+ hydrocarbons']}
+LIQUID_CLASSES = ['alkane', 'alkene', 'aromatic', 'fatty acid']
+RUN_TIME = 40 # Length of the synthetic chromatograms [min]
+
+TX0_HEADER = '''"===================================================================================================================================="
+"Software Version:",6.3.4.0700,"Date:","2021-07-30","6:22:41 PM"
+"Sample Name:","{sample}","Data Acquisition Time:","2021-07-30","4:45:08 PM"
+"Instrument Name:","Clarus590","Channel:","{channel}"
+"Rack/Vial:",0,0,"Operator:","manager"
+"Sample Amount:",1.000000,"Dilution Factor:",1.000000
+"Cycle:",1,"Result File :","c:\\gc data\\results\\{sample}.rst "
+"Sequence File :","C:\\GC DATA\\Sequences\\benchmark.seq "
+"===================================================================================================================================="
+""
+""
+"DEFAULT REPORT"
+"Peak","Time","Area","Component","Height","Norm. Area","Adjusted","Amount"
+"#","[min]","[uV*sec]","Name","[uV]","[%]","Amount","[%]"
+------,------,------,------,------,------,------,------
+'''
+
+
+# Gas (tcd/fid) or liquid compound database, with numCompounds retention times
+def synthetic_database(kind, numCompounds, rng):
+  rt = np.sort(rng.uniform(1, RUN_TIME - 1, numCompounds)).round(3)
+  names = [f'Compound {i}' for i in range(numCompounds)]
+  if kind == 'liquid':
+    classification = rng.choice(LIQUID_CLASSES, numCompounds).astype(object)
+    # Internal standard at the compound furthest from its neighbours, so no other compound takes its peak
+    gaps = np.diff(np.concatenate([[0], rt, [RUN_TIME]]))
+    classification[np.argmax(np.minimum(gaps[:-1], gaps[1:]))] = 'internal standard'
+    return pd.DataFrame({
+      TIME_COLUMN: rt, 'Compound': names, 'nC': rng.integers(5, 25, numCompounds),
+      'Classification': classification, 'RRF': rng.uniform(0.8, 1.5, numCompounds).round(5),
+    })
+  return pd.DataFrame({
+    TIME_COLUMN: rt, 'Compound': names, 'Classification': rng.choice(GAS_CLASSES[kind], numCompounds),
+    'Response Factor': rng.uniform(1e6, 4e7, numCompounds), 'Density': rng.uniform(1e-4, 2e-3, numCompounds),
+    'MW': rng.uniform(2, 120, numCompounds).round(3),
+  })
+
+
+# Peak report close to a database: most peaks near compound retention times, the rest
+# unidentified, and a large peak at the internal standard (liquid databases)
+def synthetic_peaks(database, numPeaks, rng):
+  standard = database.loc[database['Classification'] == 'internal standard', TIME_COLUMN].to_numpy()
+  numKnown = numPeaks - numPeaks // 4 - len(standard)
+  known = rng.choice(database[TIME_COLUMN].to_numpy(), numKnown) + rng.normal(0, 0.005, numKnown)
+  rt = np.concatenate([standard, known, rng.uniform(1, RUN_TIME - 1, numPeaks // 4)]).round(3)
+  area = rng.lognormal(11, 1.5, numPeaks).round(3)
+  area[:len(standard)] = area.max() * 2
+  order = np.argsort(rt, kind='stable')
+  return pd.DataFrame({TIME_COLUMN: rt[order], 'Height': (area * rng.uniform(5, 30, numPeaks)).round()[order], PEAK_COLUMN: area[order]})
+
+
+def write_tx0(path, peaksDf, sample, channel):
+  norm = peaksDf[PEAK_COLUMN] / peaksDf[PEAK_COLUMN].sum() * 100
+  with open(path, 'w', encoding='latin1', newline='\r\n') as f:
+    f.write(TX0_HEADER.format(sample=sample, channel=channel))
+    for i, (rt, height, area, n) in enumerate(zip(peaksDf[TIME_COLUMN], peaksDf['Height'], peaksDf[PEAK_COLUMN], norm)):
+      f.write(f'{i+1},{rt:.3f},{area:.2f},"",{height:.6g},{n:.2f},----------,0.00\n')
+    f.write('"","",------,"",------,------,------,------\n')
+    f.write(f'"","",{peaksDf[PEAK_COLUMN].sum():.2f},"",{peaksDf["Height"].sum():.2f},100.00,0.0000,100.00\n')
+
+
+# RAX trace of numPoints samples: drifting baseline with noise and one gaussian peak per report peak
+def write_rax(path, peaksDf, numPoints, freq, rng):
+  t = np.arange(numPoints) / (freq * 60)
+  points = 270000 + 2000 * t / max(t[-1], 1) + rng.normal(0, 150, numPoints)
+  for rt, height in zip(peaksDf[TIME_COLUMN], peaksDf['Height'] / 10):
+    center = int(rt / RUN_TIME * numPoints)
+    sigma = 2 + rng.uniform(0, 4)
+    window = np.arange(max(center - int(6 * sigma), 0), min(center + int(6 * sigma) + 1, numPoints))
+    points[window] += height * np.exp(-((window - center) / sigma) ** 2 / 2)
+  with open(path, 'w', newline='\r\n') as f:
+    f.write(f'Checksum Passed\n\nFilename : <{path}>\n\n[Raw Data Points]\n\n')
+    f.write('\n'.join(map(str, points.astype(np.int64).tolist())))
+    f.write('\n\n\n[Instrument Method Data Header]\n\n0\n')
+
+
+# Input and data folders of numExperiments liquid and gas experiments, each with numReplicates
+# samples of numPeaks peaks (TX0/CSV reports) and numPoints samples (RAX traces), analysed
+# against databases of numCompounds compounds
+def synthetic_workspace(root, numExperiments, numReplicates, numPeaks, numCompounds, numPoints, seed=0):
+  rng = np.random.default_rng(seed)
+  databases = {}
+  for kind in ['tcd', 'fid', 'liquid']:
+    os.makedirs(os.path.join(root, 'data', kind), exist_ok=True)
+    databases[kind] = synthetic_database(kind, numCompounds, rng)
+    databases[kind].to_csv(os.path.join(root, 'data', kind, 'database_1.csv'), index=False)
+
+  experiments = {'liquid': [], 'gas': []}
+  for num in range(numExperiments):
+    liquid = f'BENCH_LIQUID_{num+1:02d}'
+    gas = f'BENCH_GAS_{num+1:02d}'
+    for experiment in [liquid, gas]:
+      os.makedirs(os.path.join(root, 'input', experiment), exist_ok=True)
+    for rep in range(numReplicates):
+      name = f'EXP_{num+1:02d}_{rep+1:02d}'
+      peaksDf = synthetic_peaks(databases['liquid'], numPeaks, rng)
+      peaksDf.to_csv(os.path.join(root, 'input', liquid, f'{name}.csv'), index=False)
+      write_rax(os.path.join(root, 'input', liquid, f'{name}.RAX'), peaksDf, numPoints, LIQUID_FREQ, rng)
+      for detector in ['TCD', 'FID']:
+        peaksDf = synthetic_peaks(databases[detector.lower()], numPeaks, rng)
+        write_tx0(os.path.join(root, 'input', gas, f'{name}_{detector}.TX0'), peaksDf, name, 'AB'[detector == 'TCD'])
+        write_rax(os.path.join(root, 'input', gas, f'{name}_{detector}.RAX'), peaksDf, numPoints, GAS_FREQ, rng)
+    experiments['liquid'].append(liquid)
+    experiments['gas'].append(gas)
+  return experiments
+
+
+# Answers to the prompts of analysis.liquid_analysis and analysis.gas_analysis, so the
+# interactive functions run unattended
+def liquid_answers(numReplicates):
+  return '1\n1.0\n0.01\n' * numReplicates
+
+
+def gas_answers(numReplicates):
+  # Files are listed sorted, *_FID.TX0 before *_TCD.TX0 of each sample; gas_analysis stops at 3 samples
+  answers = ''.join(f'{2*i+2}\n1\n{2*i+1}\n1\n1.0\n10\n0\n' for i in range(min(numReplicates, 3)))
+  return answers + ('0\n' if numReplicates < 3 else '')
+
+
+def gas_pairs(experiment):
+  folder = os.path.join('input', experiment)
+  return [
+    (os.path.join(folder, f'{name}_TCD.RAX'), os.path.join(folder, f'{name}_FID.RAX'))
+    for name in sorted({f.rsplit('_', 1)[0] for f in os.listdir(folder)})[:3]
+  ]
+
+
+# Results of numSamples gas and liquid samples, for the quantification benchmark
+def synthetic_samples(numSamples, numPeaks, numCompounds, root, rng):
+  from analysis import match_gas, match_liquid
+  from database import CompoundDatabase
+  databases = {}
+  for kind in ['tcd', 'fid', 'liquid']:
+    synthetic_database(kind, numCompounds, rng).to_csv(os.path.join(root, f'{kind}.csv'), index=False)
+    databases[kind] = CompoundDatabase(os.path.join(root, f'{kind}.csv'))
+  gas, liquid = [], []
+  for _ in range(numSamples):
+    # Columns of parsed TX0 reports
+    tcdFileDf = synthetic_peaks(databases['tcd'].frame, numPeaks, rng)[[TIME_COLUMN, PEAK_COLUMN]]
+    fidFileDf = synthetic_peaks(databases['fid'].frame, numPeaks, rng)[[TIME_COLUMN, PEAK_COLUMN]]
+    gas.append((*match_gas(tcdFileDf, fidFileDf, databases['tcd'], databases['fid'], rng.uniform(5, 30)), rng.uniform(0.5, 2)))
+    fileDf = synthetic_peaks(databases['liquid'].frame, numPeaks, rng)
+    liquid.append((match_liquid(fileDf, databases['liquid']), rng.uniform(1, 3), rng.uniform(0.01, 0.1)))
+  return gas, liquid
+
+
+# Summaries as previously computed in analysis.gas_summary and analysis.liquid_summary: a pandas
+# groupby of the results tables of each sample, kept as the reference of the batched summaries
+def legacy_gas_summary(tcdResults, fidResults, sampleMass):
+  thisSummaryDf = pd.merge(
+    fidResults.to_frame().groupby('Classification')[['Mass']].sum(),
+    tcdResults.to_frame().groupby('Classification')[['Mass']].sum(),
+    'outer',
+    ['Classification', 'Mass']
+  )
+  unaccountedRow = pd.Series(data={'Mass': sampleMass - thisSummaryDf[['Mass']].sum().squeeze()}, name='Unaccounted')
+  sampleRow = pd.Series(data={'Mass': sampleMass}, name='Sample')
+  return pd.concat([thisSummaryDf, unaccountedRow.to_frame().T, sampleRow.to_frame().T])
+
+
+def legacy_liquid_summary(results, sampleMass, isMass):
+  resultsDf = results.to_frame()
+  isArea = resultsDf.loc[resultsDf['Classification'] == 'internal standard', 'Area'].squeeze()
+  resultsDf[['RRF']] = resultsDf[['RRF']].fillna(value=1)
+  resultsDf[['Classification']] = resultsDf[['Classification']].fillna(value='unidentified')
+  resultsDf['Mass'] = resultsDf['Area'] / resultsDf['RRF'] * isMass / isArea
+  thisSummaryDf = resultsDf.groupby('Classification')[['Mass']].sum()
+  unaccountedRow = pd.Series(data={'Mass': sampleMass - thisSummaryDf[['Mass']].sum().squeeze() + isMass}, name='unaccounted')
+  sampleRow = pd.Series(data={'Mass': sampleMass}, name='Sample')
+  return pd.concat([thisSummaryDf, unaccountedRow.to_frame().T, sampleRow.to_frame().T])
+
+
+def bench_quantify(numSamples, numPeaks, numCompounds):
+  import analysis
+  import quantify
+  root = tempfile.mkdtemp(prefix='chromatography-bench-')
+  try:
+    gas, liquid = synthetic_samples(numSamples, numPeaks, numCompounds, root, np.random.default_rng(0))
+  finally:
+    shutil.rmtree(root, ignore_errors=True)
+  print(f'Quantifying {numSamples} samples of {numPeaks} peaks against {numCompounds} compounds')
+
+  # One pandas summary per sample, merged, as the batch mode previously did
+  start = time.perf_counter()
+  gasSamples = analysis.merge_summaries([legacy_gas_summary(tcd, fid, mass) for tcd, fid, mass in gas])
+  gasSamplesTime = time.perf_counter() - start
+
+  start = time.perf_counter()
+  gasBatch = quantify.gas_summaries([quantify.gas_sample(tcd, fid, mass) for tcd, fid, mass in gas])
+  gasBatchTime = time.perf_counter() - start
+
+  start = time.perf_counter()
+  liquidSamples = analysis.merge_summaries([legacy_liquid_summary(results, mass, isMass) for results, mass, isMass in liquid])
+  liquidSamplesTime = time.perf_counter() - start
+
+  start = time.perf_counter()
+  liquidBatch = quantify.liquid_summaries([quantify.liquid_sample(results, mass, isMass) for results, mass, isMass in liquid])
+  liquidBatchTime = time.perf_counter() - start
+
+  pd.testing.assert_frame_equal(gasSamples, gasBatch, rtol=1e-9)
+  pd.testing.assert_frame_equal(liquidSamples, liquidBatch, rtol=1e-9)
+  print(f'  gas per sample:         {gasSamplesTime:10.3f} s')
+  print(f'  gas batched:            {gasBatchTime:10.3f} s ({gasSamplesTime / gasBatchTime:.0f}x)')
+  print(f'  liquid per sample:      {liquidSamplesTime:10.3f} s')
+  print(f'  liquid batched:         {liquidBatchTime:10.3f} s ({liquidSamplesTime / liquidBatchTime:.0f}x)')
+  print('  summaries match')
+
+  # Memory of the results of one sample, as kept during the analysis and as output tables
+  compact = np.mean([tcd.nbytes() + fid.nbytes() for tcd, fid, _ in gas[:20]])
+  frames = np.mean([sum(r.to_frame().memory_usage(deep=True).sum() for r in [tcd, fid]) for tcd, fid, _ in gas[:20]])
+  print(f'  gas results per sample:    {compact / 1024:8.1f} KB ({frames / 1024:.1f} KB as tables)')
+  compact = np.mean([results.nbytes() for results, _, _ in liquid[:20]])
+  frames = np.mean([results.to_frame().memory_usage(deep=True).sum() for results, _, _ in liquid[:20]])
+  print(f'  liquid results per sample: {compact / 1024:8.1f} KB ({frames / 1024:.1f} KB as tables)')
+
+
+# TX0 parser as previously implemented in analysis.parse_tx0: fixed header length, and every
+# value that is not a number dropped after parsing
+def legacy_tx0(fileName):
+  fileDf = pd.read_csv(
+    fileName, encoding='latin1', skiprows=15, header=None,
+    names=[TIME_COLUMN, PEAK_COLUMN], usecols=[1,2]
+  )
+  return fileDf.apply(pd.to_numeric, errors='coerce').dropna().sort_values(by=[TIME_COLUMN])
+
+
+# Parse numReports synthetic TX0 reports of numPeaks peaks with the report parser and the
+# previous one, and pair them by their metadata
+def bench_tx0(numReports, numPeaks):
+  import tx0
+  rng = np.random.default_rng(0)
+  database = synthetic_database('fid', 100, rng)
+  root = tempfile.mkdtemp(prefix='chromatography-bench-')
+  try:
+    files = []
+    for num in range(numReports // 2):
+      for detector in ['TCD', 'FID']:
+        files.append(os.path.join(root, f'S{num:05d}_{detector}.TX0'))
+        write_tx0(files[-1], synthetic_peaks(database, numPeaks, rng), f'S{num:05d}', 'AB'[detector == 'TCD'])
+    print(f'Parsing {len(files)} TX0 reports of {numPeaks} peaks')
+
+    start = time.perf_counter()
+    legacy = [legacy_tx0(f) for f in files]
+    legacyTime = time.perf_counter() - start
+    start = time.perf_counter()
+    parsed = [tx0.read_report(f) for f in files]
+    parserTime = time.perf_counter() - start
+    start = time.perf_counter()
+    pairs, unpaired = tx0.pair_reports(files)
+    pairTime = time.perf_counter() - start
+  finally:
+    shutil.rmtree(root, ignore_errors=True)
+
+  for old, (peaksDf, _) in zip(legacy, parsed):
+    new = peaksDf[[TIME_COLUMN, PEAK_COLUMN]].sort_values(by=[TIME_COLUMN])
+    pd.testing.assert_frame_equal(old.reset_index(drop=True), new.reset_index(drop=True))
+  assert len(pairs) == len(files) // 2 and not unpaired
+  print(f'  previous parser:        {legacyTime:10.3f} s ({len(files) / legacyTime:.0f} reports/s)')
+  print(f'  report parser:          {parserTime:10.3f} s ({len(files) / parserTime:.0f} reports/s, {legacyTime / parserTime:.1f}x)')
+  print(f'  pairing by metadata:    {pairTime:10.3f} s ({len(pairs)} pairs)')
+  print('  peak tables match')
+
+
+# Drift correction of numRuns runs of the same sample, each shifted and stretched by up to
+# drift [min] at the end of the run, aligned in one batch and run by run. Reports the peaks
+# matched as in the run without drift, with and without alignment.
+def bench_alignment(numRuns, numPeaks, numCompounds, drift):
+  import alignment
+  from database import CompoundDatabase
+  rng = np.random.default_rng(0)
+  root = tempfile.mkdtemp(prefix='chromatography-bench-')
+  try:
+    synthetic_database('fid', numCompounds, rng).to_csv(os.path.join(root, 'fid.csv'), index=False)
+    database = CompoundDatabase(os.path.join(root, 'fid.csv'))
+  finally:
+    shutil.rmtree(root, ignore_errors=True)
+  # Anchors spread over the run, each with a large peak at its retention time
+  anchorRows = np.linspace(0, numCompounds - 1, 6).round().astype(int)
+  anchors = list(database.frame['Compound'].iloc[anchorRows])
+  peaksDf = synthetic_peaks(database.frame, numPeaks, rng)
+  rt = np.concatenate([peaksDf[TIME_COLUMN].to_numpy(), database.rt[anchorRows]])
+  area = np.concatenate([peaksDf[PEAK_COLUMN].to_numpy(), np.full(len(anchorRows), peaksDf[PEAK_COLUMN].max() * 2)])
+  order = np.argsort(rt, kind='stable')
+  rt, area = rt[order], area[order]
+  shift = rng.uniform(-drift / 2, drift / 2, numRuns)
+  stretch = 1 + rng.uniform(-drift / 2, drift / 2, numRuns) / RUN_TIME
+  runs = [rt * b + a for a, b in zip(shift, stretch)]
+  options = dict(anchors=anchors, window=drift)
+  print(f'Aligning {numRuns} runs of {len(rt)} peaks against {numCompounds} compounds (drift up to {drift} min)')
+
+  start = time.perf_counter()
+  aligned = alignment.align_runs(database, runs, [area] * numRuns, options, detector='fid')
+  batchTime = time.perf_counter() - start
+  start = time.perf_counter()
+  single = [alignment.align_runs(database, [runRt], [area], options, detector='fid')[0] for runRt in runs]
+  singleTime = time.perf_counter() - start
+  assert all(np.array_equal(a, b) for a, b in zip(aligned, single))
+
+  expected = match_nearest(rt, database.index)
+  def matched(rts):
+    return np.mean([np.mean(match_nearest(r, database.index) == expected) for r in rts])
+  print(f'  run by run:             {singleTime:10.3f} s')
+  print(f'  batched:                {batchTime:10.3f} s ({singleTime / batchTime:.0f}x, {numRuns / batchTime:.0f} runs/s)')
+  print(f'  peaks matched as without drift: {matched(runs):.1%} without alignment, {matched(aligned):.1%} aligned')
+
+
+# Render the comparison of N synthetic traces of numPoints points, for each N of runCounts,
+# and the stack of one subplot per trace for the counts up to stackLimit
+def bench_compare(runCounts, numPoints, gridPoints, stackLimit):
+  import compare
+  import plot
+  rng = np.random.default_rng(0)
+  t = np.arange(numPoints) / (LIQUID_FREQ * 60)
+  centers = np.sort(rng.uniform(0.05, 0.95, 40)) * t[-1]
+  heights = rng.lognormal(10, 1, len(centers))
+  plot.new_figure((4, 4), False).savefig(io.BytesIO(), format='png') # Fonts are loaded by the first figure
+  print(f'Comparing runs of {numPoints} points on a grid of {gridPoints} points')
+  print(f'  {"Runs":>6}{"Resample [s]":>14}{"Render [s]":>12}{"Stack [s]":>12}')
+  for numRuns in runCounts:
+    series = []
+    for shift in rng.normal(0, 0.05, numRuns):
+      points = 270000 + rng.normal(0, 150, numPoints)
+      for center, height in zip(centers + shift, heights):
+        points += height * np.exp(-((t - center) / 0.02) ** 2 / 2)
+      series.append((t, points))
+
+    start = time.perf_counter()
+    compare.stack_traces(series, gridPoints)
+    resampleTime = time.perf_counter() - start
+    start = time.perf_counter()
+    columns = [('benchmark', series, [f'run {num}' for num in range(numRuns)], (centers, [''] * len(centers)))]
+    fig = compare.comparison_figure(columns, compare.VIEWS, gridPoints)
+    fig.savefig(io.BytesIO(), format='png')
+    renderTime = time.perf_counter() - start - resampleTime
+    stackTime = ''
+    if numRuns <= stackLimit:
+      start = time.perf_counter()
+      fig = plot.new_figure((12, 8), False)
+      plot.plot_column(fig, series, [f'run {num}' for num in range(numRuns)], 1, 1, 'benchmark', None)
+      fig.savefig(io.BytesIO(), format='png')
+      stackTime = f'{time.perf_counter() - start:12.3f}'
+    print(f'  {numRuns:>6}{resampleTime:14.3f}{renderTime:12.3f}{stackTime:>12}')
+
+
+# Run the existing entry points over every experiment of the workspace. Returns the
+# number of processed items (peaks or points), for the throughput.
+def run_case(case, experiments, sizes):
+  import analysis
+  import plot
+  numReplicates = sizes['replicates']
+  if case == 'liquid_analysis':
+    for experiment in experiments['liquid']:
+      sys.stdin = io.StringIO(liquid_answers(numReplicates))
+      analysis.liquid_analysis(experiment)
+    return len(experiments['liquid']) * numReplicates * sizes['peaks']
+  if case == 'gas_analysis':
+    for experiment in experiments['gas']:
+      sys.stdin = io.StringIO(gas_answers(numReplicates))
+      analysis.gas_analysis(experiment)
+    return len(experiments['gas']) * min(numReplicates, 3) * 2 * sizes['peaks']
+  if case == 'readRaxFile':
+    count = 0
+    for experiment in experiments['liquid'] + experiments['gas']:
+      for f in sorted(os.listdir(os.path.join('input', experiment))):
+        if f.endswith('.RAX'):
+          count += len(plot.readRaxFile(os.path.join('input', experiment, f), 'GAS' in experiment)[1])
+    return count
+  if case == 'liquid_plot':
+    for experiment in experiments['liquid']:
+      plot.liquid_plot(experiment, show=False, decimate=sizes['decimate'])
+    return len(experiments['liquid']) * numReplicates * sizes['points']
+  if case == 'gas_plot':
+    for experiment in experiments['gas']:
+      plot.gas_plot(experiment, gas_pairs(experiment), show=False, decimate=sizes['decimate'])
+    return len(experiments['gas']) * min(numReplicates, 3) * 2 * sizes['points']
+  raise Exception(f'Unknown benchmark case: {case}.')
+
+
+# Measure one case in a fresh process, so the peak RSS only accounts for that case.
+# With the cache, a first untimed run fills it and the measured run reads it.
+def measure_case(root, case, experiments, sizes, useCache):
+  os.chdir(root)
+  os.environ['CHROMATOGRAPHY_CACHE'] = os.path.join(root, '.cache') if useCache else ''
+  with contextlib.redirect_stdout(io.StringIO()):
+    if useCache:
+      run_case(case, experiments, sizes)
+    rssBefore = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start, cpuStart = time.perf_counter(), time.process_time()
+    items = run_case(case, experiments, sizes)
+    wall, cpu = time.perf_counter() - start, time.process_time() - cpuStart
+  peakRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  return dict(
+    wall=wall, cpu=cpu, items=items, throughput=items / wall if wall > 0 else None,
+    peak_rss_mb=peakRss / 1024, rss_growth_mb=(peakRss - rssBefore) / 1024
+  )
+
+
+def git_revision():
+  try:
+    return subprocess.run(
+      ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+      cwd=os.path.dirname(os.path.abspath(__file__))
+    ).stdout.strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+
+def read_history(path):
+  if not os.path.exists(path):
+    return []
+  with open(path) as f:
+    return [json.loads(line) for line in f if line.strip()]
+
+
+# Previous record of the same case with the same sizes, to compare against
+def previous_record(history, record):
+  for previous in reversed(history):
+    if previous['case'] == record['case'] and previous['sizes'] == record['sizes'] and previous['cache'] == record['cache']:
+      return previous
+  return None
+
+
+# Run the benchmark suite on a synthetic workspace and append one JSON line per case to
+# the history file. Returns the cases slower than the previous run of the same sizes by
+# more than tolerance (fraction of its wall time).
+def run_suite(cases, sizes, history, repeat=1, useCache=False, tolerance=0.25, workdir=None):
+  root = os.path.abspath(workdir or tempfile.mkdtemp(prefix='chromatography-bench-'))
+  print(f'Generating synthetic workspace in {root}')
+  start = time.perf_counter()
+  experiments = synthetic_workspace(
+    root, sizes['experiments'], sizes['replicates'], sizes['peaks'], sizes['compounds'], sizes['points']
+  )
+  print(f'  {sizes["experiments"]} liquid and gas experiments generated in {time.perf_counter() - start:.1f} s')
+
+  previousRecords = read_history(history)
+  regressions = []
+  context = multiprocessing.get_context('spawn')
+  print(f'{"case":<16}{"wall [s]":>10}{"cpu [s]":>10}{"items/s":>14}{"peak RSS [MB]":>15}{"change":>10}')
+  try:
+    for case in cases:
+      results = []
+      for _ in range(repeat):
+        with context.Pool(1) as pool:
+          results.append(pool.apply(measure_case, (root, case, experiments, sizes, useCache)))
+      best = min(results, key=lambda r: r['wall'])
+      best['peak_rss_mb'] = max(r['peak_rss_mb'] for r in results)
+      record = dict(
+        timestamp=time.strftime('%Y-%m-%dT%H:%M:%S'), revision=git_revision(), case=case,
+        sizes=sizes, cache=useCache, repeat=repeat, **best,
+        python=platform.python_version(), numpy=np.__version__, pandas=pd.__version__,
+        cpus=os.cpu_count(),
+      )
+
+      previous = previous_record(previousRecords, record)
+      change = ''
+      if previous:
+        ratio = record['wall'] / previous['wall'] - 1
+        change = f'{ratio:+.0%}'
+        if ratio > tolerance:
+          regressions.append(case)
+          change += ' !'
+      print(f'{case:<16}{record["wall"]:>10.3f}{record["cpu"]:>10.3f}{record["throughput"] or 0:>14.0f}{record["peak_rss_mb"]:>15.1f}{change:>10}')
+
+      os.makedirs(os.path.dirname(history), exist_ok=True)
+      with open(history, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+  finally:
+    if workdir is None:
+      shutil.rmtree(root, ignore_errors=True)
+  return regressions
+
+
+CASES = ['liquid_analysis', 'gas_analysis', 'readRaxFile', 'liquid_plot', 'gas_plot']
+
+
+# Command line of the benchmarks (also main.py bench); returns the exit status
+def main(argv=None):
+  parser = argparse.ArgumentParser(description='Benchmarks for chromatography-utils.')
+  subparsers = parser.add_subparsers(dest='benchmark')
+
+  suite = subparsers.add_parser('suite', help='time the analysis and plot functions on synthetic experiments (default)')
+  suite.add_argument('--cases', nargs='+', choices=CASES, default=CASES)
+  suite.add_argument('--experiments', type=int, default=2, help='liquid and gas experiments')
+  suite.add_argument('--replicates', type=int, default=3, help='samples per experiment (gas analysis uses up to 3)')
+  suite.add_argument('--peaks', type=int, default=1000, help='peaks per report')
+  suite.add_argument('--compounds', type=int, default=100, help='compounds per database')
+  suite.add_argument('--points', type=int, default=20000, help='points per RAX trace')
+  suite.add_argument('--decimate', type=int, help='min/max buckets per plotted trace')
+  suite.add_argument('--repeat', type=int, default=1, help='runs per case, the fastest is recorded')
+  suite.add_argument('--cache', action='store_true', help='measure reads from a warm cache of parsed files')
+  suite.add_argument('--history', default=os.path.join('output', 'benchmark_history.jsonl'), help='JSON lines file the results are appended to')
+  suite.add_argument('--tolerance', type=float, default=0.25, help='slowdown over the previous run reported as a regression')
+  suite.add_argument('--workdir', help='keep the synthetic workspace in this folder')
+
+  matching = subparsers.add_parser('matching', help='compare the matching engine with the previous matching loop')
+  matching.add_argument('--peaks', type=int, default=10000)
+  matching.add_argument('--compounds', type=int, default=50000)
+  matching.add_argument('--legacy-peaks', type=int, default=200, help='peaks timed with the legacy loop')
+
+  quantification = subparsers.add_parser('quantify', help='compare the batched quantification with per-sample summaries')
+  quantification.add_argument('--samples', type=int, default=1000)
+  quantification.add_argument('--peaks', type=int, default=200, help='peaks per report')
+  quantification.add_argument('--compounds', type=int, default=100, help='compounds per database')
+
+  aligning = subparsers.add_parser('align', help='compare the batched drift correction with run by run alignment')
+  aligning.add_argument('--runs', type=int, default=500)
+  aligning.add_argument('--peaks', type=int, default=200, help='peaks per report')
+  aligning.add_argument('--compounds', type=int, default=100, help='compounds per database')
+  aligning.add_argument('--drift', type=float, default=0.3, help='largest drift [min] of a run')
+
+  comparison = subparsers.add_parser('compare', help='time the comparison plot of many runs, against one subplot per run')
+  comparison.add_argument('--runs', type=int, nargs='+', default=[10, 100, 500])
+  comparison.add_argument('--points', type=int, default=20000, help='points per trace')
+  comparison.add_argument('--grid', type=int, default=2000, help='points of the common time grid')
+  comparison.add_argument('--stack-limit', type=int, default=20, help='largest number of runs plotted one subplot per run')
+
+  reports = subparsers.add_parser('tx0', help='compare the TX0 report parser with the previous parser')
+  reports.add_argument('--reports', type=int, default=2000)
+  reports.add_argument('--peaks', type=int, default=50, help='peaks per report')
+
+  argv = sys.argv[1:] if argv is None else list(argv)
+  if not argv or argv[0] not in ['suite', 'matching', 'quantify', 'align', 'tx0', 'compare', '-h', '--help']:
+    argv = ['suite'] + argv
+  args = parser.parse_args(argv)
+  if args.benchmark == 'matching':
+    bench_matching(args.peaks, args.compounds, args.legacy_peaks)
+  elif args.benchmark == 'quantify':
+    bench_quantify(args.samples, args.peaks, args.compounds)
+  elif args.benchmark == 'compare':
+    bench_compare(args.runs, args.points, args.grid, args.stack_limit)
+  elif args.benchmark == 'tx0':
+    bench_tx0(args.reports, args.peaks)
+  elif args.benchmark == 'align':
+    bench_alignment(args.runs, args.peaks, args.compounds, args.drift)
+  else:
+    sizes = dict(
+      experiments=args.experiments, replicates=args.replicates, peaks=args.peaks,
+      compounds=args.compounds, points=args.points, decimate=args.decimate
+    )
+    regressions = run_suite(args.cases, sizes, os.path.abspath(args.history), args.repeat, args.cache, args.tolerance, args.workdir)
+    if regressions:
+      print(f'Regressions over {args.tolerance:.0%}: {"; ".join(regressions)}')
+      return 1
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,113 @@
+import json
+import os
+import numpy as np
+
+import cache
+
+# Dependency tracking of the outputs of batch jobs. Each replicate, summary and plot has
+# a key, the digest of the content of its input files (reports, traces and databases),
+# its parameters and the code of the modules that produce it. The key of the last build
+# of each output is kept in output/.build/state.json, with the matched peaks of each
+# replicate, so only outputs whose key changed are built again. The summary of an experiment
+# is quantified from the matched peaks of all its replicates at once.
+
+BUILD_DIR = os.path.join('output', '.build')
+STATE_FILE = os.path.join(BUILD_DIR, 'state.json')
+
+# Modules whose code produces each kind of output; any change to them makes the outputs stale
+ANALYSIS_MODULES = ['alignment', 'analysis', 'batch', 'cache', 'database', 'integration', 'matching', 'output', 'peaks', 'quantify', 'rax', 'results', 'tx0']
+PLOT_MODULES = ['cache', 'compare', 'database', 'plot', 'rax']
+
+codeVersions = {}
+
+
+def code_version(modules):
+  key = tuple(modules)
+  if key not in codeVersions:
+    root = os.path.dirname(os.path.abspath(__file__))
+    sources = []
+    for module in modules:
+      with open(os.path.join(root, f'{module}.py'), 'rb') as f:
+        sources.append(cache.digest(f.read().decode('utf-8', 'replace')))
+    codeVersions[key] = cache.digest('|'.join(sources))
+  return codeVersions[key]
+
+
+# Content hash of an input file, through the cache of file hashes when it is enabled
+def input_hash(path):
+  return cache.content_hash(path) if cache.enabled() else cache.file_hash(path)
+
+
+def build_key(modules, files, parameters):
+  return cache.digest(json.dumps(dict(
+    code=code_version(modules),
+    files={os.path.basename(f): input_hash(f) for f in files},
+    parameters=parameters,
+  ), sort_keys=True, default=str))
+
+
+# Key of an experiment summary, from the keys of its replicates in triplicate order
+def summary_key(replicateKeys):
+  return cache.digest('|'.join(replicateKeys))
+
+
+def read_state():
+  try:
+    with open(STATE_FILE) as f:
+      return json.load(f)
+  except FileNotFoundError:
+    return {}
+
+
+def is_fresh(experiment, output, key, paths):
+  return read_state().get(experiment, {}).get(output) == key and all(os.path.exists(p) for p in paths)
+
+
+def record(experiment, output, key):
+  state = read_state()
+  state.setdefault(experiment, {})[output] = key
+  cache.write_atomic(STATE_FILE, json.dumps(state, indent=2, sort_keys=True))
+
+
+# Record the summary of an experiment built from these replicates, and remove the stored
+# peaks of its other replicates
+def record_summary(experiment, replicateKeys):
+  record(experiment, 'summary', summary_key(replicateKeys))
+  folder = os.path.join(BUILD_DIR, experiment)
+  for f in os.listdir(folder) if os.path.isdir(folder) else []:
+    if f.endswith('.npz') and f[:-4] not in replicateKeys:
+      os.remove(os.path.join(folder, f))
+
+
+def replicate_path(experiment, key):
+  return os.path.join(BUILD_DIR, experiment, f'{key}.npz')
+
+
+def write_arrays(path, arrays):
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  tmp = f'{path}.{os.getpid()}.tmp'
+  with open(tmp, 'wb') as f:
+    np.savez(f, **arrays)
+  os.replace(tmp, path)
+
+
+def read_arrays(path):
+  with np.load(path, allow_pickle=False) as arrays:
+    return {name: arrays[name] for name in arrays.files}
+
+
+# Whether a replicate was already built with the same key and its result files still exist
+def is_built(experiment, key, outputs):
+  return os.path.exists(replicate_path(experiment, key)) and all(os.path.exists(f) for f in outputs)
+
+
+# Matched peaks of one replicate (a task of batch.replicate_tasks, as arrays): the stored ones
+# when it is built, otherwise computed by function(*args) and stored
+def cached_replicate(experiment, key, outputs, force, function, *args):
+  path = replicate_path(experiment, key)
+  if not force and is_built(experiment, key, outputs):
+    print(f'Replicate {", ".join(os.path.basename(f) for f in outputs)} of {experiment} is up to date.')
+    return read_arrays(path)
+  arrays = function(*args)
+  write_arrays(path, arrays)
+  return arrays
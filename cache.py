@@ -0,0 +1,249 @@
+import glob
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+
+# On-disk cache of parsed input files. Entries are addressed by the content hash of the
+# source file and the parser used, and store one .npy file per column, read back with
+# memory mapping. The content hash of a file is itself cached by path, mtime and size,
+# so unchanged files are not hashed again.
+#
+# The size of the cache is measured once by each process, then kept up to date with the
+# entries it writes: the cache is only listed again when it goes over MAX_SIZE, and the least
+# recently used entries and content hashes are then evicted down to LOW_WATER of it.
+#
+# The cache folder is set by the CHROMATOGRAPHY_CACHE environment variable (default
+# .cache); an empty value disables the cache. numpy and pandas are only imported to read and
+# write entries, so clearing the cache does not load them.
+
+DEFAULT_DIR = '.cache'
+MAX_SIZE = 1024 ** 3 # Size limit of the cache in bytes, least recently used entries are evicted
+LOW_WATER = 0.8 # Fraction of MAX_SIZE left after an eviction, so the next ones are not immediate
+
+cacheSize = None # Size of the cache in bytes, as measured by this process plus its writes since
+
+
+def cache_dir():
+  return os.environ.get('CHROMATOGRAPHY_CACHE', DEFAULT_DIR)
+
+
+def enabled():
+  return cache_dir() != ''
+
+
+def digest(text):
+  return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+
+def file_hash(path):
+  h = hashlib.blake2b(digest_size=16)
+  with open(path, 'rb') as f:
+    for block in iter(lambda: f.read(1024 * 1024), b''):
+      h.update(block)
+  return h.hexdigest()
+
+
+# Content hash of a file, looked up by absolute path, mtime and size
+def content_hash(path):
+  stat = os.stat(path)
+  statKey = digest(f'{os.path.abspath(path)}|{stat.st_mtime_ns}|{stat.st_size}')
+  statFile = os.path.join(cache_dir(), 'stat', statKey)
+  try:
+    with open(statFile) as f:
+      fileHash = f.read()
+    os.utime(statFile) # Mark as recently used
+    return fileHash
+  except FileNotFoundError:
+    pass
+  fileHash = file_hash(path)
+  write_atomic(statFile, fileHash)
+  add_size(len(fileHash))
+  return fileHash
+
+
+def write_atomic(path, text):
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  tmp = f'{path}.{uuid.uuid4().hex}.tmp'
+  with open(tmp, 'w') as f:
+    f.write(text)
+  os.replace(tmp, path)
+
+
+def entry_dir(path, kind):
+  return os.path.join(cache_dir(), 'entries', digest(f'{kind}|{content_hash(path)}'))
+
+
+# Columns of a cache entry, memory mapped, or None when it is missing (or evicted by another
+# process while being read)
+def read_entry(entry):
+  import numpy as np
+  try:
+    with open(os.path.join(entry, 'meta.json')) as f:
+      meta = json.load(f)
+    os.utime(os.path.join(entry, 'meta.json')) # Mark as recently used
+    return {
+      name: np.load(os.path.join(entry, f'{i}.npy'), mmap_mode='r')
+      for i, name in enumerate(meta['columns'])
+    }
+  except OSError:
+    return None
+
+
+def write_entry(entry, source, kind, columns):
+  import numpy as np
+  tmp = f'{entry}.{uuid.uuid4().hex}.tmp'
+  os.makedirs(tmp)
+  for i, values in enumerate(columns.values()):
+    np.save(os.path.join(tmp, f'{i}.npy'), np.asarray(values))
+  with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+    json.dump(dict(source=os.path.abspath(source), kind=kind, columns=list(columns)), f)
+  try:
+    os.rename(tmp, entry)
+  except OSError:
+    shutil.rmtree(tmp, ignore_errors=True) # Stored concurrently by another process
+    return
+  add_size(entry_size(entry))
+
+
+# Columns (dict of arrays) parsed from a file, from the cache when available.
+# parse(path) must return a dict of arrays or a DataFrame; kind identifies the parser.
+def cached_columns(path, kind, parse):
+  import numpy as np
+  import pandas as pd
+  if not enabled():
+    columns = parse(path)
+    return dict(columns.items()) if isinstance(columns, pd.DataFrame) else columns
+
+  entry = entry_dir(path, kind)
+  columns = read_entry(entry)
+  if columns is None:
+    columns = parse(path)
+    if isinstance(columns, pd.DataFrame):
+      columns = {name: columns[name].to_numpy() for name in columns.columns}
+    # Only numeric columns are stored, text columns could not be memory mapped
+    if all(np.asarray(values).dtype.kind in 'biuf' for values in columns.values()):
+      write_entry(entry, path, kind, columns)
+  return columns
+
+
+# DataFrame parsed from a file, from the cache when available
+def cached_frame(path, kind, parse):
+  import pandas as pd
+  if not enabled():
+    return parse(path)
+  return pd.DataFrame(cached_columns(path, kind, parse))
+
+
+def entries():
+  return glob.glob(os.path.join(cache_dir(), 'entries', '*', 'meta.json'))
+
+
+def entry_size(entry):
+  return sum(os.path.getsize(f) for f in glob.glob(os.path.join(entry, '*')))
+
+
+# (last use, size, path) of every entry and content hash of the cache, without those being
+# written (.tmp)
+def usage():
+  items = []
+  for meta in entries():
+    entry = os.path.dirname(meta)
+    if not entry.endswith('.tmp'):
+      try:
+        items.append((os.path.getmtime(meta), entry_size(entry), entry))
+      except FileNotFoundError:
+        pass
+  for statFile in glob.glob(os.path.join(cache_dir(), 'stat', '*')):
+    if not statFile.endswith('.tmp'):
+      try:
+        items.append((os.path.getmtime(statFile), os.path.getsize(statFile), statFile))
+      except FileNotFoundError:
+        pass
+  return items
+
+
+# Count size bytes written to the cache, and evict once it goes over maxSize (MAX_SIZE by
+# default, read at each call). Other processes writing to the cache are seen when it is
+# measured again, at the first write and after each eviction.
+def add_size(size, maxSize=None):
+  global cacheSize
+  if maxSize is None:
+    maxSize = MAX_SIZE
+  if cacheSize is None:
+    cacheSize = sum(itemSize for _, itemSize, _ in usage())
+  else:
+    cacheSize += size
+  if cacheSize > maxSize:
+    cacheSize = evict(int(maxSize * LOW_WATER))
+
+
+# Remove least recently used entries and content hashes until the cache fits in maxSize
+# bytes (MAX_SIZE by default). Returns the size of the cache left.
+def evict(maxSize=None):
+  if maxSize is None:
+    maxSize = MAX_SIZE
+  items = usage()
+  total = sum(size for _, size, _ in items)
+  for _, size, path in sorted(items):
+    if total <= maxSize:
+      break
+    if os.path.isdir(path):
+      shutil.rmtree(path, ignore_errors=True)
+    else:
+      try:
+        os.remove(path)
+      except FileNotFoundError:
+        pass
+    total -= size
+  return total
+
+
+# Remove the cache entries of the given source files, or the whole cache.
+# Returns the number of entries removed.
+def clear(paths=None):
+  global cacheSize
+  cacheSize = None # Measured again at the next write
+  if paths is None:
+    removed = len(entries())
+    shutil.rmtree(cache_dir(), ignore_errors=True)
+    return removed
+  sources = set(os.path.abspath(p) for p in paths)
+  removed = 0
+  for meta in entries():
+    with open(meta) as f:
+      source = json.load(f)['source']
+    if source in sources:
+      shutil.rmtree(os.path.dirname(meta), ignore_errors=True)
+      removed += 1
+  return removed
+
+
+# Time to read every input file when parsed and stored in the cache (cold), and when
+# read back from the cache (warm)
+def report(root='input'):
+  import analysis
+  import rax
+
+  readers = [
+    ('TX0 reports', '*.TX0', analysis.read_tx0),
+    ('CSV reports', '*.csv', analysis.read_peak_csv),
+    ('RAX traces', '*.RAX', rax.load_rax),
+  ]
+  print(f'{"Files":<12} {"Count":>6} {"Cold [s]":>10} {"Warm [s]":>10} {"Speedup":>8}')
+  for label, pattern, reader in readers:
+    files = sorted(glob.glob(os.path.join(root, '**', pattern), recursive=True))
+    if len(files) == 0:
+      continue
+    clear(files)
+    start = time.perf_counter()
+    for f in files:
+      reader(f)
+    cold = time.perf_counter() - start
+    start = time.perf_counter()
+    for f in files:
+      reader(f)
+    warm = time.perf_counter() - start
+    print(f'{label:<12} {len(files):>6} {cold:>10.3f} {warm:>10.3f} {cold / warm:>7.1f}x')
@@ -0,0 +1,236 @@
+import glob
+import os
+import numpy as np
+
+import profiling
+from database import load_database
+from plot import new_figure, readRaxFile, save_plot, show_plot
+
+# Comparison of many RAX traces of an experiment on one figure, instead of one subplot per
+# trace. The traces of each detector are resampled to a common time grid and stacked into a
+# (run x time) array, drawn in one or more views:
+#   heatmap: one row of color per run
+#   waterfall: the traces offset above each other, at most WATERFALL_TRACES of them
+#   overlay: median of the runs with the band of their 5th to 95th percentiles, and the
+#     retention times of the compounds of a database
+# Each view draws a fixed number of artists, so the time to render does not grow with the
+# number of runs. The baseline of each run (its median) is subtracted in every view.
+#
+# Comparison options (the compare key of manifest jobs):
+#   views: views drawn, one row of the figure each (default heatmap and overlay)
+#   points: size of the time grid (default 2000)
+#   markers: mark the compounds of the databases of the job on the overlays (default true)
+
+VIEWS = ['heatmap', 'waterfall', 'overlay']
+OPTIONS = ['views', 'points', 'markers']
+DEFAULT_VIEWS = ['heatmap', 'overlay']
+GRID_POINTS = 2000
+WATERFALL_TRACES = 50
+LABELED_RUNS = 40 # Runs named on the axis of the heatmap; beyond, they are numbered
+
+
+# RAX traces of one detector of a gas experiment ('tcd' or 'fid', by file name), or of a
+# liquid experiment
+def experiment_traces(experiment, detector='liquid'):
+  raxFiles = sorted(glob.glob(os.path.join('input', experiment, '*.RAX')))
+  if detector == 'liquid':
+    return raxFiles
+  suffix = f'_{detector.upper()}'
+  return [f for f in raxFiles if os.path.splitext(os.path.basename(f))[0].upper().endswith(suffix)]
+
+
+# (TCD, FID) pairs of the traces of a gas experiment, by file name
+def gas_pairs(experiment):
+  fidFiles = {os.path.basename(f).upper(): f for f in experiment_traces(experiment, 'fid')}
+  pairs = []
+  for tcdFile in experiment_traces(experiment, 'tcd'):
+    stem, extension = os.path.splitext(os.path.basename(tcdFile))
+    fidFile = fidFiles.get((stem[:-len('_TCD')] + '_FID' + extension).upper())
+    if fidFile:
+      pairs.append((tcdFile, fidFile))
+  return pairs
+
+
+# Grid of points times spanning every trace
+def time_grid(series, points=GRID_POINTS):
+  start = min(t[0] for t, _ in series)
+  stop = max(t[-1] for t, _ in series)
+  return np.linspace(start, stop, points)
+
+
+# Traces resampled to the grid, as a (run x grid) array: the value of each cell is the mean
+# of the trace (linear between its points) over the cell, from its cumulative integral at the
+# edges of the cell. A grid finer than a trace interpolates it linearly, and a coarser one
+# averages its points instead of skipping them. Cells outside a trace are NaN. The traces are
+# placed on one axis, each run offset past the previous one, so the edges of every cell of
+# every run are interpolated at once.
+def resample(series, grid):
+  numRuns = len(series)
+  step = grid[1] - grid[0] if len(grid) > 1 else 1.0
+  edges = np.concatenate([grid - step / 2, [grid[-1] + step / 2]])
+  counts = [len(points) for _, points in series]
+  starts = np.array([t[0] for t, _ in series], dtype=float)
+  stops = np.array([t[-1] for t, _ in series], dtype=float)
+  span = max(stops.max(), edges[-1]) - min(starts.min(), edges[0]) + 1
+  offsets = np.arange(numRuns) * span
+
+  t = np.concatenate([np.asarray(t, dtype=float) for t, _ in series]) + np.repeat(offsets, counts)
+  y = np.concatenate([np.asarray(points, dtype=float) for _, points in series])
+  areas = (y[1:] + y[:-1]) / 2 * np.diff(t)
+  areas[np.cumsum(counts)[:-1] - 1] = 0 # Between the last point of a run and the first of the next
+  integral = np.concatenate([[0], np.cumsum(areas)])
+
+  runEdges = np.clip(edges, starts[:, None], stops[:, None])
+  positions = (runEdges + offsets[:, None]).ravel()
+  previous = np.clip(np.searchsorted(t, positions, 'right') - 1, 0, len(t) - 1)
+  cumulative = integral[previous] + (positions - t[previous]) * (y[previous] + np.interp(positions, t, y)) / 2
+  cumulative = cumulative.reshape(runEdges.shape)
+  widths = np.diff(runEdges, axis=1)
+  with np.errstate(invalid='ignore', divide='ignore'):
+    values = np.diff(cumulative, axis=1) / widths
+  # Cells on a single point of a trace (zero width inside it) take its interpolated value
+  single = (widths == 0) & (grid >= starts[:, None]) & (grid <= stops[:, None])
+  if single.any():
+    runs = np.nonzero(single)[0]
+    values[single] = np.interp(grid[np.nonzero(single)[1]] + offsets[runs], t, y)
+  values[~single & (widths <= 0)] = np.nan
+  return values.astype(np.float32)
+
+
+# Traces stacked on a common grid, each without its baseline (median)
+def stack_traces(series, points=GRID_POINTS):
+  grid = time_grid(series, points)
+  stacked = resample(series, grid)
+  with np.errstate(all='ignore'):
+    stacked -= np.nanmedian(stacked, axis=1, keepdims=True)
+  return grid, stacked
+
+
+# Retention times and names of the compounds of a database
+def library_markers(databaseFile):
+  database = load_database(databaseFile)
+  names = database.frame['Compound'].astype(str).to_numpy() if 'Compound' in database.frame else [''] * len(database)
+  return database.rt, names
+
+
+def signal_limit(stacked):
+  finite = stacked[np.isfinite(stacked)]
+  return max(float(np.percentile(finite, 99.5)), 1.0) if len(finite) else 1.0
+
+
+# Runs as rows of color, on a square root scale so small peaks show next to the largest ones
+def draw_heatmap(fig, ax, grid, stacked, labels):
+  from matplotlib.colors import PowerNorm
+  image = ax.imshow(
+    stacked, aspect='auto', interpolation='nearest', origin='lower', cmap='viridis',
+    extent=(grid[0], grid[-1], -0.5, len(stacked) - 0.5), norm=PowerNorm(0.5, 0, signal_limit(stacked), clip=True),
+  )
+  if len(labels) <= LABELED_RUNS:
+    ax.set_yticks(np.arange(len(labels)), labels, fontsize='small')
+  else:
+    ax.set_ylabel('Run')
+  fig.colorbar(image, ax=ax, pad=0.01)
+
+
+# Traces offset above each other, the first one at the bottom, drawn as one line (with gaps)
+def draw_waterfall(ax, grid, stacked, labels):
+  rows = np.unique(np.linspace(0, len(stacked) - 1, min(len(stacked), WATERFALL_TRACES)).round().astype(int))
+  offset = signal_limit(stacked) / 2
+  lines = np.full((len(rows), len(grid) + 1), np.nan)
+  lines[:, :-1] = stacked[rows] + offset * np.arange(len(rows))[:, None]
+  ax.plot(np.tile(np.append(grid, np.nan), len(rows)), lines.ravel(), linewidth=0.6)
+  if len(rows) <= LABELED_RUNS:
+    ax.set_yticks(offset * np.arange(len(rows)), [labels[r] for r in rows], fontsize='small')
+  else:
+    ax.set_yticks([])
+    ax.set_ylabel(f'{len(rows)} of {len(stacked)} runs')
+
+
+def draw_overlay(ax, grid, stacked, markers):
+  percentile = np.nanpercentile if np.isnan(stacked).any() else np.percentile
+  with np.errstate(all='ignore'):
+    low, median, high = percentile(stacked, [5, 50, 95], axis=0)
+  ax.fill_between(grid, low, high, alpha=0.3, linewidth=0, label=f'5-95% of {len(stacked)} runs')
+  ax.plot(grid, median, linewidth=0.8, label='Median')
+  if markers is not None:
+    rt, names = markers
+    shown = (rt >= grid[0]) & (rt <= grid[-1])
+    ax.vlines(rt[shown], 0, 1, transform=ax.get_xaxis_transform(), colors='gray', linestyles='dotted', linewidth=0.6)
+    for markerRt, name in zip(rt[shown], np.asarray(names)[shown]):
+      ax.text(markerRt, 1, f' {name}', transform=ax.get_xaxis_transform(), rotation=90, va='top', ha='right', fontsize=6)
+  ax.legend(loc='upper left', fontsize='small')
+
+
+# Figure of the views (rows) of each column: (title, series, labels, markers), markers as
+# (retention times, names) or None
+def comparison_figure(columns, views=None, points=GRID_POINTS, show=False):
+  views = DEFAULT_VIEWS if not views else views
+  fig = new_figure((8 * len(columns), 2 + 3 * len(views)), show)
+  for column, (title, series, labels, markers) in enumerate(columns):
+    grid, stacked = stack_traces(series, points)
+    axes = None
+    for row, view in enumerate(views):
+      ax = fig.add_subplot(len(views), len(columns), row * len(columns) + column + 1, sharex=axes)
+      axes = axes or ax
+      if view == 'heatmap':
+        draw_heatmap(fig, ax, grid, stacked, labels)
+      elif view == 'waterfall':
+        draw_waterfall(ax, grid, stacked, labels)
+      else:
+        draw_overlay(ax, grid, stacked, markers)
+      if row == 0:
+        ax.set_title(title)
+      if row == len(views) - 1:
+        ax.set_xlabel('Time [min]')
+      else:
+        ax.tick_params(labelbottom=False)
+  fig.tight_layout()
+  return fig
+
+
+def check_options(options):
+  options = dict(options or {})
+  if set(options) - set(OPTIONS):
+    raise Exception(f'Invalid comparison options: {", ".join(sorted(set(options) - set(OPTIONS)))}. Use {", ".join(OPTIONS)}.')
+  views = options.get('views') or DEFAULT_VIEWS
+  views = [views] if isinstance(views, str) else list(views)
+  invalid = [v for v in views if v not in VIEWS]
+  if invalid:
+    raise Exception(f'Invalid comparison view: {", ".join(map(str, invalid))}. Use {", ".join(VIEWS)}.')
+  options['views'] = views
+  options['points'] = int(options.get('points', GRID_POINTS))
+  if options['points'] < 2:
+    raise Exception(f'Invalid comparison points: {options["points"]}.')
+  options['markers'] = bool(options.get('markers', True))
+  return options
+
+
+# Comparison of the traces of an experiment: every trace of a liquid experiment, or the TCD
+# and FID traces of the pairs of a gas experiment (all pairs by file name by default), in two
+# columns. databases: database of each column (liquid, or TCD and FID) marked on the
+# overlays, None for no markers.
+# save: save the figure to output/{experiment}_plot.png. Returns the figure.
+def compare_plot(experiment, gas=False, pairs=None, options=None, databases=None, show=True, save=True):
+  profiling.set_experiment(experiment)
+  options = check_options(options)
+  if gas:
+    pairs = gas_pairs(experiment) if pairs is None else pairs
+    groups = [(f'{experiment}_TCD', [tcd for tcd, _ in pairs]), (f'{experiment}_FID', [fid for _, fid in pairs])]
+  else:
+    groups = [(experiment, experiment_traces(experiment))]
+  if not groups[0][1]:
+    raise Exception(f'No RAX files found in folder {experiment}. Skipping experiment.')
+
+  columns = []
+  for num, (title, files) in enumerate(groups):
+    series = [readRaxFile(f, gas) for f in files]
+    markers = library_markers(databases[num]) if databases and options['markers'] else None
+    columns.append((title, series, [os.path.splitext(os.path.basename(f))[0] for f in files], markers))
+
+  with profiling.stage('render', sum(len(points) for _, series, _, _ in columns for _, points in series)):
+    fig = comparison_figure(columns, options['views'], options['points'], show)
+    if save:
+      save_plot(fig, experiment)
+  if show:
+    show_plot(fig)
+  return fig
@@ -0,0 +1,56 @@
+import os
+import numpy as np
+import pandas as pd
+
+from matching import RtIndex
+
+TIME_COLUMN = 'RT' # Must have the same name in input files and data/database.csv
+
+loadedDatabases = {} # (path, mtime) -> CompoundDatabase, shared by all analyses of this process
+
+
+# Compound database from data/tcd, data/fid or data/liquid, with a retention time index
+# sorted once, a lookup of rows by compound name and the rows of each classification
+class CompoundDatabase:
+
+  def __init__(self, path):
+    self.path = path
+    self.frame = pd.read_csv(path)
+    self.rt = self.frame[TIME_COLUMN].to_numpy(dtype=float)
+    self.index = RtIndex(self.rt)
+    # Columns joined to matched peaks (every column but the retention time)
+    self.attributes = self.frame.drop(columns=[TIME_COLUMN])
+
+    self.compounds = {}
+    if 'Compound' in self.frame:
+      for row, name in enumerate(self.frame['Compound']):
+        self.compounds.setdefault(name, row)
+    self.groups = {}
+    if 'Classification' in self.frame:
+      self.groups = {
+        name: np.asarray(rows)
+        for name, rows in self.frame.groupby('Classification').indices.items()
+      }
+
+  def __len__(self):
+    return len(self.frame)
+
+  # RtIndex with no entries removed, for matching each compound only once
+  def rt_index(self):
+    return self.index.copy()
+
+  def compound(self, name):
+    if name not in self.compounds:
+      raise Exception(f'Compound {name} not found in {os.path.basename(self.path)}.')
+    return self.frame.iloc[self.compounds[name]]
+
+  def classification(self, name):
+    return self.frame.iloc[self.groups.get(name, [])]
+
+
+# Database parsed once per process, and again only if the file changes
+def load_database(path):
+  key = (os.path.abspath(path), os.path.getmtime(path))
+  if key not in loadedDatabases:
+    loadedDatabases[key] = CompoundDatabase(path)
+  return loadedDatabases[key]
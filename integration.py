@@ -0,0 +1,159 @@
+import numpy as np
+import pandas as pd
+
+from database import TIME_COLUMN
+from peaks import find_peaks
+from rax import load_rax
+
+PEAK_COLUMN = 'Area'
+METHODS = ['trapezoid', 'simpson']
+
+
+# Baseline under a signal: the minimum of each block of window samples, linearly
+# interpolated between blocks and never above the signal
+def estimate_baseline(y, window):
+  y = np.asarray(y, dtype=float)
+  if len(y) == 0:
+    return y
+  window = max(int(window), 1)
+  blocks = -(-len(y) // window)
+  padded = np.full(blocks * window, np.inf)
+  padded[:len(y)] = y
+  positions = padded.reshape(blocks, window).argmin(axis=1) + np.arange(blocks) * window
+  baseline = np.interp(np.arange(len(y)), positions, y[positions])
+  return np.minimum(baseline, y)
+
+
+# Centered moving average over window samples
+def moving_average(y, window):
+  if window <= 1 or len(y) < window:
+    return np.asarray(y, dtype=float)
+  total = np.cumsum(np.concatenate([[0.0], y]))
+  smooth = (total[window:] - total[:-window]) / window
+  half = (window - 1) // 2
+  return np.concatenate([y[:half], smooth, y[len(y) - (window - 1 - half):]])
+
+
+# Standard deviation of the noise of a signal, from the median absolute successive difference
+def noise_level(y):
+  if len(y) < 2:
+    return 0.0
+  return np.median(np.abs(np.diff(y))) / (0.6745 * np.sqrt(2))
+
+
+# Index of the first minimum of y in each segment [starts[k], starts[k+1]) (the last one up
+# to the end), for increasing starts
+def segment_argmin(y, starts):
+  if len(starts) == 0:
+    return np.empty(0, dtype=int)
+  offset = starts[0]
+  y = y[offset:]
+  lengths = np.diff(np.concatenate([starts, [offset + len(y)]]))
+  minima = np.minimum.reduceat(y, starts - offset)
+  positions = np.where(y == np.repeat(minima, lengths), np.arange(len(y)), len(y))
+  return np.minimum.reduceat(positions, starts - offset) + offset
+
+
+# Integral of y over [left, right] for every peak, with y sampled at times x
+def integrate_segments(x, y, left, right, method):
+  area = np.concatenate([[0.0], np.cumsum((y[1:] + y[:-1]) / 2 * np.diff(x))])
+  if method == 'trapezoid':
+    return area[right] - area[left]
+
+  # Composite Simpson rule over an even number of intervals (uniform sampling), from
+  # prefix sums of the samples at even and odd indices; an odd last interval is a trapezoid
+  parity = np.arange(len(y)) % 2
+  sums = np.zeros((2, len(y) + 1))
+  sums[0, 1:] = np.cumsum(np.where(parity == 0, y, 0))
+  sums[1, 1:] = np.cumsum(np.where(parity == 1, y, 0))
+  end = right - (right - left) % 2
+  h = x[np.minimum(left + 1, len(x) - 1)] - x[left]
+  even = left % 2
+  odd = 1 - even
+  oddSum = sums[odd, end] - sums[odd, np.minimum(left + 1, end)]
+  evenSum = sums[even, end + 1] - sums[even, left] - y[left] - y[end]
+  simpson = np.where(end > left, h / 3 * (y[left] + y[end] + 4 * oddSum + 2 * evenSum), 0.0)
+  return simpson + area[right] - area[end]
+
+
+# Peak tables (RT, Height, Area) of several raw traces, given as (time [min], points) pairs.
+#   baselineWindow: length [min] of the blocks used to estimate the baseline
+#   smooth: samples averaged before peak detection
+#   height, prominence: detection thresholds above the baseline, by default 5 times the
+#     noise level of each trace
+#   width: minimum peak width in samples, at half prominence (as peaks.find_peaks)
+#   method: 'trapezoid' or 'simpson'
+# Peaks are delimited where the signal returns to the baseline (within the noise level), or
+# split at the lowest point between two overlapping peaks. Areas are in signal units x seconds.
+def integrate_traces(traces, baselineWindow=1.0, smooth=5, height=None, prominence=None, width=None, method='trapezoid'):
+  if method not in METHODS:
+    raise Exception(f'Invalid integration method: {method}. Use {", ".join(METHODS)}.')
+
+  # Baseline correction and peak detection of each trace, on the same concatenated arrays
+  times, signals, smoothed, noise, peaks, offsets = [], [], [], [], [], [0]
+  for t, y in traces:
+    t = np.asarray(t, dtype=float)
+    y = np.asarray(y, dtype=float)
+    step = t[1] - t[0] if len(t) > 1 else 1.0
+    corrected = y - estimate_baseline(y, round(baselineWindow / step))
+    # Block minima sit at the bottom of the noise; center the noise on the baseline
+    corrected -= np.median(corrected) if len(corrected) else 0
+    smoothCorrected = moving_average(corrected, smooth)
+    level = noise_level(corrected)
+    tracePeaks = find_peaks(
+      smoothCorrected,
+      height=5 * level if height is None else height,
+      prominence=5 * level if prominence is None else prominence,
+      width=width, plateau='center', edge=np.inf
+    )
+    times.append(t * 60)
+    signals.append(corrected)
+    smoothed.append(smoothCorrected)
+    noise.append(np.full(len(y), level))
+    peaks.append(tracePeaks + offsets[-1])
+    offsets.append(offsets[-1] + len(y))
+
+  if offsets[-1] == 0:
+    return [pd.DataFrame({TIME_COLUMN: [], 'Height': [], PEAK_COLUMN: []}) for _ in traces]
+  x = np.concatenate(times)
+  y = np.concatenate(signals)
+  s = np.concatenate(smoothed)
+  peaks = np.concatenate(peaks).astype(int)
+  index = np.arange(len(y))
+
+  # Closest samples at the baseline before and after each point (trace ends included)
+  below = s <= np.concatenate(noise)
+  starts = np.array(offsets[:-1])
+  ends = np.array(offsets[1:])
+  below[starts[ends > starts]] = True
+  below[ends[ends > starts] - 1] = True
+  lastBelow = np.maximum.accumulate(np.where(below, index, 0))
+  nextBelow = np.minimum.accumulate(np.where(below, index, len(y) - 1)[::-1])[::-1]
+
+  # Drop lines at the valley between consecutive peaks
+  valleys = segment_argmin(s, peaks)
+  left = lastBelow[peaks]
+  right = nextBelow[peaks]
+  if len(peaks) > 1:
+    left[1:] = np.maximum(left[1:], valleys[:-1])
+    right[:-1] = np.minimum(right[:-1], valleys[:-1])
+
+  areas = integrate_segments(x, y, left, right, method)
+  trace = np.searchsorted(offsets, peaks, side='right') - 1
+  return [
+    pd.DataFrame({
+      TIME_COLUMN: x[peaks[trace == i]] / 60,
+      'Height': y[peaks[trace == i]],
+      PEAK_COLUMN: areas[trace == i],
+    })
+    for i in range(len(traces))
+  ]
+
+
+def integrate_trace(t, y, **options):
+  return integrate_traces([(t, y)], **options)[0]
+
+
+# Peak tables of RAX files, in the same format as the liquid CSV reports
+def integrate_rax(raxFiles, gas=False, **options):
+  return integrate_traces([load_rax(f, gas) for f in raxFiles], **options)
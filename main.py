@@ -9,18 +9,65 @@ PROJECT = dict(
   readme = 'README.md'
 )
 
+import argparse
 import glob
+import importlib
 import os
+import sys
+import time
 
-import analysis
-import plot
+startTime = time.perf_counter()
 
-def entrypoint():
+# Only modules without heavy dependencies are imported at startup; analysis, plot, batch,
+# watcher and benchmark (with pandas, numpy and matplotlib) and cache are imported through
+# load by the commands that use them.
+import output
+import profiling
 
-  # Get experiments subfolders from input folder
-  experiments = sorted([p.split(os.sep)[1] for p in glob.glob(os.path.join('input', '*'))])  
+importTimes = {} # module -> seconds taken by its first import
+
+
+def load(module):
+  if module not in sys.modules:
+    start = time.perf_counter()
+    importlib.import_module(module)
+    importTimes[module] = time.perf_counter() - start
+  return sys.modules[module]
+
+
+# Time to import each module loaded by the command (including the libraries it pulled in) and
+# total time since startup, on stderr
+def print_import_times():
+  print(f'\n{"Module":<12}{"Import [ms]":>12}', file=sys.stderr)
+  for module, seconds in importTimes.items():
+    print(f'{module:<12}{seconds * 1000:>12.1f}', file=sys.stderr)
+  print(f'{"total":<12}{(time.perf_counter() - startTime) * 1000:>12.1f}', file=sys.stderr)
+
+
+def clear_screen():
+  if not sys.stdout.isatty():
+    return
+  if os.name == 'nt':
+    os.system('cls')
+  else:
+    print('\033[H\033[2J', end='', flush=True)
+
+
+# Experiment subfolders of the input folder
+def list_experiments():
+  experiments = sorted([p.split(os.sep)[1] for p in glob.glob(os.path.join('input', '*'))])
   if len(experiments) == 0:
     raise Exception('No experiment found in input folder.')
+  return experiments
+
+
+# profilePrefix: files the stage profile is saved to, when profiling is enabled
+def entrypoint(profilePrefix=None):
+  analysis = load('analysis')
+  plot = load('plot')
+
+  # Get experiments subfolders from input folder
+  experiments = list_experiments()
   print(f'Found {len(experiments)} experiment folders: {"; ".join(experiments)}')
 
   print('Available functions: (1) peak analysis; (2) plot; (3) both.\n')
@@ -85,11 +132,187 @@ def entrypoint():
       else:
         print('Skipping.')
 
+  output.flush()
+  profiling.finish(profilePrefix)
 
-if __name__ == '__main__':
+
+# Run one subcommand; returns the exit status
+def command_entrypoint(args, profilePrefix=None):
+  if args.command == 'bench':
+    return load('benchmark').main(args.arguments)
+  if args.command == 'serve':
+    load('service').run(args.host, args.port, args.jobs, args.cache_size)
+    return 0
+  if args.command == 'cache':
+    cache = load('cache')
+    if args.action == 'clear':
+      print(f'Removed {cache.clear(args.files or None)} cache entries.')
+    else:
+      cache.report()
+    return 0
+
+  experiments = args.experiments or list_experiments()
+  if args.command == 'plot' and args.compare is not None:
+    run = comparison(args)
+    if run is None:
+      return 1
+  elif args.command == 'plot':
+    plot = load('plot')
+    run = plot.gas_plot if args.type == 'gas' else plot.liquid_plot
+  else:
+    analysis = load('analysis')
+    run = analysis.gas_analysis if args.command == 'analyze-gas' else analysis.liquid_analysis
+  failed = []
+  try:
+    for experiment in experiments:
+      print(f'\nExecuting {"plot" if args.command == "plot" else "peak analysis"} function for {experiment}.')
+      try:
+        run(experiment)
+      except Exception as e:
+        print('Error:', e)
+        print('Skipping to next experiment.')
+        failed.append(experiment)
+  finally:
+    output.flush()
+  profiling.finish(profilePrefix)
+  return 1 if failed else 0
+
+
+# Comparison plot of an experiment with the options of the plot command, None when invalid
+def comparison(args):
+  compare = load('compare')
+  gas = args.type == 'gas'
+  try:
+    options = compare.check_options(dict(views=[v.strip() for v in args.compare.split(',') if v.strip()], points=args.points, markers=args.markers is not None))
+    if args.markers is None:
+      databases = None
+    else:
+      batch = load('batch')
+      databases = [batch.resolve_database(kind, args.markers) for kind in (['tcd', 'fid'] if gas else ['liquid'])]
+  except Exception as e:
+    print('Error:', e)
+    return None
+  return lambda experiment: compare.compare_plot(experiment, gas, None, options, databases)
+
+
+def parse_args():
+  parser = argparse.ArgumentParser(description=PROJECT['description'])
+  parser.add_argument('--version', action='version', version=f'{PROJECT["name"]} {PROJECT["version"]}')
+  parser.add_argument('--manifest', help='run the jobs of a JSON, YAML or CSV manifest without prompts')
+  parser.add_argument('--overwrite', action='store_true', help='re-run jobs whose outputs already exist')
+  parser.add_argument('--jobs', type=int, default=1, help='number of worker processes for --manifest (0 uses all CPUs)')
+  parser.add_argument('--no-cache', action='store_true', help='do not use the cache of parsed input files')
+  parser.add_argument('--clear-cache', nargs='*', metavar='FILE', help='remove the cache entries of the given files, or the whole cache')
+  parser.add_argument('--cache-report', action='store_true', help='report cold and warm read times of the input folder')
+  parser.add_argument('--outputs', default='excel,csv', help=f'comma separated output formats: {", ".join(output.FORMATS)} (default excel,csv)')
+  parser.add_argument('--excel-engine', choices=output.EXCEL_ENGINES, help='library writing the Excel summaries (default openpyxl)')
+  parser.add_argument('--export', nargs='*', metavar='EXPERIMENT', help='write the Excel summaries and CSV results of the given experiments, or all, from the Parquet store')
+  parser.add_argument('--watch', metavar='EXPORT_DIR', help='analyse the files of an instrument export folder as they are written, until Ctrl+C')
+  parser.add_argument('--watch-config', metavar='FILE', help='JSON or YAML file with the parameters of the watched samples (defaults, experiments, samples)')
+  parser.add_argument('--watch-once', action='store_true', help='with --watch, stop once every file of the folder is processed')
+  parser.add_argument('--profile', nargs='?', const=os.path.join('output', 'profile'), metavar='PREFIX',
+    help='time each stage (parse, match, quantify, summarize, write, render) and save PREFIX.json and PREFIX.trace.json (default output/profile)')
+  parser.add_argument('--profile-memory', action='store_true', help='also record the allocations of each stage with --profile (slower)')
+  parser.add_argument('--import-times', action='store_true', help='print the time taken to import each module and the total run time on exit')
+
+  # Without a command, the experiments of the input folder are processed interactively
+  commands = parser.add_subparsers(dest='command', metavar='COMMAND')
+  for name, kind in [('analyze-liquid', 'liquid'), ('analyze-gas', 'gas')]:
+    command = commands.add_parser(name, help=f'peak analysis of {kind} experiments, prompting only for the samples')
+    command.add_argument('experiments', nargs='*', metavar='EXPERIMENT', help='folders under input/ (default all)')
+  command = commands.add_parser('plot', help='plot the RAX traces of experiments')
+  command.add_argument('experiments', nargs='*', metavar='EXPERIMENT', help='folders under input/ (default all)')
+  command.add_argument('--type', choices=['liquid', 'gas'], default='liquid', help='experiment type (default liquid)')
+  command.add_argument('--compare', nargs='?', const='heatmap,overlay', metavar='VIEWS',
+    help='compare the runs in one figure, with comma separated views: heatmap, waterfall, overlay (default heatmap,overlay); gas experiments compare every TCD/FID pair')
+  command.add_argument('--points', type=int, default=2000, help='size of the time grid of --compare (default 2000)')
+  command.add_argument('--markers', metavar='DATABASE', help='with --compare, mark the compounds of a database (number or file name) on the overlays')
+  command = commands.add_parser('cache', help='clear the cache of parsed files, or report its read times')
+  command.add_argument('action', choices=['clear', 'report'])
+  command.add_argument('files', nargs='*', metavar='FILE', help='files whose entries are cleared (default all)')
+  command = commands.add_parser('serve', help='serve the analyses and plots over HTTP to local clients')
+  command.add_argument('--host', default='127.0.0.1', help='address to listen on (default 127.0.0.1, local clients only)')
+  command.add_argument('--port', type=int, default=8765)
+  command.add_argument('--jobs', type=int, default=0, help='worker processes running the jobs (0 uses all CPUs)')
+  command.add_argument('--cache-size', type=int, default=128, help='results of jobs kept in memory')
+  command = commands.add_parser('bench', help='run benchmark.py with the given arguments', add_help=False)
+  command.add_argument('arguments', nargs=argparse.REMAINDER)
+  return parser.parse_args()
+
+
+def batch_entrypoint(manifest, overwrite, numJobs, profilePrefix=None):
+  batch = load('batch')
+  try:
+    failed = batch.run_manifest(manifest, overwrite, numJobs)
+  finally:
+    output.flush()
+  profiling.finish(profilePrefix)
+  if failed:
+    print(f'\n{len(failed)} jobs failed: {"; ".join(str(e) for e in failed)}')
+  return len(failed) == 0
+
+
+def watch_entrypoint(exportDir, configFile, once, profilePrefix=None):
+  watcher = load('watcher')
+  try:
+    failed = watcher.Watcher(exportDir, watcher.read_config(configFile)).run(once)
+  finally:
+    output.flush()
+  profiling.finish(profilePrefix)
+  if failed:
+    print(f'\n{len(failed)} samples failed: {", ".join(failed)}')
+  return len(failed) == 0
+
+
+def main():
+  args = parse_args()
+  if args.import_times:
+    import atexit
+    atexit.register(print_import_times)
+
+  if args.profile or args.profile_memory:
+    profiling.enable(memory=args.profile_memory)
+  profilePrefix = args.profile or os.path.join('output', 'profile')
+
+  try:
+    output.configure([f.strip() for f in args.outputs.split(',') if f.strip()], args.excel_engine)
+  except Exception as e:
+    print('Error:', e)
+    sys.exit(1)
+  if args.export is not None:
+    exported = output.export(args.export or None)
+    print(f'Exported {len(exported)} experiments from {output.STORE_DIR}.')
+    sys.exit(0)
+
+  if args.no_cache:
+    os.environ['CHROMATOGRAPHY_CACHE'] = ''
+  if args.clear_cache is not None or args.cache_report:
+    cache = load('cache')
+    if args.clear_cache is not None:
+      print(f'Removed {cache.clear(args.clear_cache or None)} cache entries.')
+    if args.cache_report:
+      cache.report()
+    sys.exit(0)
+
+  if args.manifest:
+    print(f'Project: {PROJECT["name"]} v{PROJECT["version"]}')
+    sys.exit(0 if batch_entrypoint(args.manifest, args.overwrite, args.jobs, profilePrefix) else 1)
+  if args.watch:
+    print(f'Project: {PROJECT["name"]} v{PROJECT["version"]}')
+    try:
+      sys.exit(0 if watch_entrypoint(args.watch, args.watch_config, args.watch_once, profilePrefix) else 1)
+    except Exception as e:
+      print('Error:', e)
+      sys.exit(1)
+  if args.command:
+    try:
+      sys.exit(command_entrypoint(args, profilePrefix))
+    except Exception as e:
+      print('Error:', e)
+      sys.exit(1)
 
   # Print project metadata
-  os.system('cls' if os.name == 'nt' else 'clear')
+  clear_screen()
   print(f'Project: {PROJECT["name"]} v{PROJECT["version"]}')
   print(f'Description: {PROJECT["description"]}')
   print(f'Authors: {"; ".join(PROJECT["authors"])}')
@@ -97,11 +320,16 @@ if __name__ == '__main__':
 
   print('\n===== Program Start =====\n')
   try:
-    entrypoint()
+    entrypoint(profilePrefix)
   except Exception as e:
     print('Error:', e)
     raise e
   except KeyboardInterrupt:
     print('\nProgram interrupted.')
   finally:
+    output.flush()
     print('\n===== Program End =====\n')
+
+
+if __name__ == '__main__':
+  main()
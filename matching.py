@@ -0,0 +1,126 @@
+import numpy as np
+import pandas as pd
+
+# Flag of each match of match_within, as written to the results tables
+MATCH_FLAGS = ['matched', 'out of tolerance', 'ambiguous', 'unmatched']
+
+
+# Sorted retention time index, supporting nearest lookups and removal of matched entries.
+# Removed positions are skipped with two path-compressed pointer arrays, so each lookup
+# and each removal costs O(log n) for the binary search plus an amortized near-constant skip.
+class RtIndex:
+
+  def __init__(self, rt, order=None, sortedRt=None):
+    if sortedRt is None:
+      rt = np.asarray(rt, dtype=float)
+      order = np.argsort(rt, kind='stable')
+      sortedRt = rt[order]
+    self.order = order
+    self.sortedRt = sortedRt
+    n = len(sortedRt)
+    # nextRight[p] -> first available position >= p (n when none)
+    self._nextRight = np.arange(n + 1)
+    # nextLeft[p+1] -> first available position <= p, shifted by one (0 when none)
+    self._nextLeft = np.arange(n + 1)
+
+  def __len__(self):
+    return len(self.sortedRt)
+
+  def copy(self):
+    # Fresh index over the same sorted arrays, with no entries removed
+    return RtIndex(None, self.order, self.sortedRt)
+
+  def _find(self, pointers, p):
+    root = p
+    while pointers[root] != root:
+      root = pointers[root]
+    while pointers[p] != root:
+      pointers[p], p = root, pointers[p]
+    return root
+
+  def nearest(self, x):
+    # Position (in the original row order) of the closest available entry, -1 if empty
+    n = len(self.sortedRt)
+    p = int(np.searchsorted(self.sortedRt, x))
+    right = self._find(self._nextRight, p)
+    left = self._find(self._nextLeft, p) - 1
+    if right >= n and left < 0:
+      return -1
+    if right >= n or (left >= 0 and x - self.sortedRt[left] <= self.sortedRt[right] - x):
+      return left
+    return right
+
+  def remove(self, position):
+    self._nextRight[position] = position + 1
+    self._nextLeft[position + 1] = position
+
+  def nearest_all(self, x):
+    # Vectorized nearest lookup for many queries, ignoring removals
+    x = np.asarray(x, dtype=float)
+    n = len(self.sortedRt)
+    if n == 0:
+      return np.full(len(x), -1)
+    p = np.searchsorted(self.sortedRt, x)
+    left = np.clip(p - 1, 0, n - 1)
+    right = np.clip(p, 0, n - 1)
+    useRight = np.abs(self.sortedRt[right] - x) < np.abs(self.sortedRt[left] - x)
+    return self.order[np.where(useRight, right, left)]
+
+  def count_within(self, x, distance):
+    # Number of entries within distance of each query, ignoring removals
+    x = np.asarray(x, dtype=float)
+    return np.searchsorted(self.sortedRt, x + distance, 'right') - np.searchsorted(self.sortedRt, x - distance, 'left')
+
+
+# Index of the closest reference row for every query retention time (-1 when no match).
+# With unique=True, queries are matched in the given order and each reference row is
+# removed once matched, so it cannot be assigned to a later query. With a tolerance, queries
+# farther than it from the closest reference row are unmatched (and remove no row).
+def match_nearest(queryRt, referenceRt, unique=False, tolerance=None):
+  index = referenceRt if isinstance(referenceRt, RtIndex) else RtIndex(referenceRt)
+  queryRt = np.asarray(queryRt, dtype=float)
+  if not unique:
+    result = index.nearest_all(queryRt)
+    if tolerance is not None and len(index):
+      rt = np.empty(len(index))
+      rt[index.order] = index.sortedRt
+      result[np.abs(rt[result] - queryRt) > tolerance] = -1
+    return result
+
+  result = np.full(len(queryRt), -1)
+  for i, x in enumerate(queryRt):
+    position = index.nearest(x)
+    if position < 0:
+      break
+    if tolerance is not None and abs(index.sortedRt[position] - x) > tolerance:
+      continue
+    index.remove(position)
+    result[i] = index.order[position]
+  return result
+
+
+# match_nearest within a tolerance, with the code of each match in MATCH_FLAGS. Queries with
+# more than one reference row within ambiguity of them (the tolerance by default) are left
+# unmatched and flagged as ambiguous, instead of being assigned to the closest one. Other
+# unmatched queries are out of tolerance when no reference row is within the tolerance, and
+# unmatched otherwise (without tolerance, or when the rows within it were matched before).
+def match_within(queryRt, referenceRt, unique=False, tolerance=None, ambiguity=None):
+  index = referenceRt if isinstance(referenceRt, RtIndex) else RtIndex(referenceRt)
+  queryRt = np.asarray(queryRt, dtype=float)
+  ambiguity = tolerance if ambiguity is None else ambiguity
+  ambiguous = index.count_within(queryRt, ambiguity) > 1 if ambiguity else np.zeros(len(queryRt), dtype=bool)
+
+  result = np.full(len(queryRt), -1)
+  candidates = np.flatnonzero(~ambiguous)
+  result[candidates] = match_nearest(queryRt[candidates], index, unique, tolerance)
+  outside = index.count_within(queryRt, tolerance) == 0 if tolerance is not None else np.zeros(len(queryRt), dtype=bool)
+  flags = np.select([ambiguous, result >= 0, outside], [2, 0, 1], 3).astype(np.int8)
+  return result, flags
+
+
+# Build the results table in a single allocation: every query row followed by the columns
+# of its matched reference row (all NaN for unmatched queries).
+def assemble_matches(queryDf, referenceDf, indices, dropColumns=()):
+  referenceDf = referenceDf.drop(columns=list(dropColumns)).reset_index(drop=True)
+  matchedDf = referenceDf.reindex(np.asarray(indices)).reset_index(drop=True)
+  return pd.concat([queryDf.reset_index(drop=True), matchedDf], axis=1)
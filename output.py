@@ -0,0 +1,220 @@
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+
+import profiling
+
+# Output formats of the results (one table per replicate file) and summaries (one table per
+# experiment):
+#   excel: output/{experiment}_summary.xlsx
+#   csv: output/{experiment}/{file}.csv
+#   parquet: append-only store of all experiments in output/store/{results,summaries}, written
+#     in batches of part files. The last write of each experiment (summaries) or file (results)
+#     is the current one. Excel and CSV files can be generated from it later with export.
+# Excel and CSV are written by default, as in the interactive mode; Parquet requires pyarrow.
+# pandas is only imported by the functions of the store, so the command line can read the
+# formats and configure the outputs without loading it.
+
+FORMATS = ['excel', 'csv', 'parquet']
+EXCEL_ENGINES = ['openpyxl', 'xlsxwriter']
+STORE_DIR = os.path.join('output', 'store')
+BATCH_ROWS = 200000 # Rows buffered before a part file is written to the store
+
+formats = ['excel', 'csv']
+excelEngine = 'openpyxl'
+pending = {'results': [], 'summaries': []} # Tables waiting to be written to the store
+pendingRows = 0
+lock = threading.RLock() # Tables are buffered and flushed from the threads of the watcher
+
+
+def configure(outputFormats=None, engine=None):
+  global formats, excelEngine
+  outputFormats = formats if outputFormats is None else list(outputFormats)
+  invalid = [f for f in outputFormats if f not in FORMATS]
+  if invalid:
+    raise Exception(f'Invalid output format: {", ".join(invalid)}. Use {", ".join(FORMATS)}.')
+  if engine is not None and engine not in EXCEL_ENGINES:
+    raise Exception(f'Invalid Excel engine: {engine}. Use {", ".join(EXCEL_ENGINES)}.')
+  if 'parquet' in outputFormats:
+    require('pyarrow', 'the Parquet results store')
+  if engine == 'xlsxwriter':
+    require('xlsxwriter', 'the xlsxwriter Excel engine')
+  formats = outputFormats
+  excelEngine = engine or excelEngine
+
+
+def require(module, feature):
+  try:
+    __import__(module)
+  except ImportError:
+    raise Exception(f'{module} is required for {feature} (pip3 install {module}).')
+
+
+def options():
+  return dict(outputFormats=formats, engine=excelEngine)
+
+
+def summary_path(experiment):
+  return os.path.join('output', f'{experiment}_summary.xlsx')
+
+
+def results_path(experiment, fileName):
+  return os.path.join('output', experiment, fileName)
+
+
+# Files an analysis must leave in place to be up to date (none for the store, which is append-only)
+def summary_files(experiment):
+  return [summary_path(experiment)] if 'excel' in formats else []
+
+
+def results_files(experiment, fileName):
+  return [results_path(experiment, fileName)] if 'csv' in formats else []
+
+
+def writes_results():
+  return 'csv' in formats or 'parquet' in formats
+
+
+def write_results(experiment, resultsDf, fileName):
+  if 'csv' in formats:
+    # Save csv table in output folder, using the input directory template
+    os.makedirs(os.path.join('output', experiment), exist_ok=True)
+    with profiling.stage('write', len(resultsDf)):
+      resultsDf.to_csv(results_path(experiment, fileName), index=False)
+    print(f'File saved to output/{experiment}/{fileName}')
+  if 'parquet' in formats:
+    table = resultsDf.reset_index(drop=True)
+    table.insert(0, 'row', range(len(table)))
+    # Columns and types of the table, which shares the store with tables of other columns
+    columns = json.dumps({column: str(dtype) for column, dtype in resultsDf.dtypes.items()})
+    append('results', table, experiment=experiment, file=fileName, columns=columns)
+
+
+def write_summary(experiment, summaryDf):
+  if 'excel' in formats:
+    with profiling.stage('write', len(summaryDf)):
+      summaryDf.to_excel(summary_path(experiment), engine=excelEngine)
+    print(f'Summary saved to output/{experiment}_summary.xlsx')
+  if 'parquet' in formats:
+    # Long format, as the number of replicates varies between experiments
+    table = summaryDf.reset_index(names='Classification')
+    table.insert(0, 'row', range(len(table)))
+    table = table.melt(id_vars=['row', 'Classification'], var_name='column', value_name='value')
+    append('summaries', table, experiment=experiment)
+
+
+# Buffer a table for the store, with the experiment, file and time of the write as columns
+def append(kind, table, **keys):
+  global pendingRows
+  for num, (key, value) in enumerate(keys.items()):
+    table.insert(num, key, value)
+  table.insert(len(keys), 'written', time.time_ns())
+  with lock:
+    pending[kind].append(table)
+    pendingRows += len(table)
+    if pendingRows >= BATCH_ROWS:
+      flush()
+
+
+# Columns of mixed types (e.g. a database column with numbers and text) are stored as text
+def store_frame(tables):
+  import pandas as pd
+  frame = pd.concat(tables, ignore_index=True)
+  for column in frame.columns:
+    if frame[column].dtype == object:
+      values = frame[column].dropna()
+      if not values.map(lambda v: isinstance(v, str)).all():
+        frame[column] = frame[column].map(lambda v: v if pd.isna(v) else str(v))
+  return frame
+
+
+# Write the buffered tables to one new part file per kind
+def flush():
+  global pendingRows
+  with lock:
+    for kind, tables in pending.items():
+      if not tables:
+        continue
+      folder = os.path.join(STORE_DIR, kind)
+      os.makedirs(folder, exist_ok=True)
+      frame = store_frame(tables)
+      name = f'part-{time.time_ns()}-{uuid.uuid4().hex[:8]}.parquet'
+      with profiling.stage('write', len(frame)):
+        frame.to_parquet(os.path.join(folder, f'.{name}.tmp'), index=False)
+        os.replace(os.path.join(folder, f'.{name}.tmp'), os.path.join(folder, name))
+      tables.clear()
+    pendingRows = 0
+
+
+# Run function(*args) in a worker process with the output options of the parent, and return
+# its result with the tables it buffered for the store, to be written by the parent
+def run_collected(options, function, *args):
+  configure(**options)
+  for kind in pending:
+    pending[kind].clear() # Left by a task of this worker that failed
+  result = function(*args)
+  tables = {kind: list(tables) for kind, tables in pending.items()}
+  for kind in pending:
+    pending[kind].clear()
+  return result, tables
+
+
+def extend(tables):
+  global pendingRows
+  for kind, kindTables in tables.items():
+    pending[kind].extend(kindTables)
+    pendingRows += sum(len(t) for t in kindTables)
+  if pendingRows >= BATCH_ROWS:
+    flush()
+
+
+# Current tables of the store (the last write of each experiment or file), for some experiments
+def read_store(kind, experiments=None):
+  require('pyarrow', 'the Parquet results store')
+  import pandas as pd
+  import pyarrow as pa
+  import pyarrow.parquet as pq
+  parts = sorted(glob.glob(os.path.join(STORE_DIR, kind, 'part-*.parquet')))
+  if not parts:
+    return pd.DataFrame()
+  filters = [('experiment', 'in', list(experiments))] if experiments else None
+  table = pa.concat_tables([pq.read_table(p, filters=filters) for p in parts], promote_options='permissive')
+  frame = table.to_pandas(types_mapper={pa.int64(): pd.Int64Dtype()}.get)
+  keys = ['experiment', 'file'] if kind == 'results' else ['experiment']
+  latest = frame.groupby(keys)['written'].transform('max')
+  return frame[frame['written'] == latest].reset_index(drop=True)
+
+
+# Summary table of an experiment as saved in Excel, from the store
+def stored_summary(summaries, experiment):
+  import pandas as pd
+  table = summaries[summaries['experiment'] == experiment]
+  summaryDf = table.set_index(['row', 'Classification', 'column'])['value'].unstack('column')
+  summaryDf = summaryDf[pd.unique(table['column'])].droplevel('row')
+  summaryDf.index.name = None
+  summaryDf.columns.name = None
+  return summaryDf.astype(float)
+
+
+# Generate the Excel summaries and CSV results of experiments (all by default) from the store
+def export(experiments=None, exportFormats=('excel', 'csv')):
+  summaries = read_store('summaries', experiments)
+  results = read_store('results', experiments)
+  exported = sorted(set(summaries.get('experiment', [])) | set(results.get('experiment', [])))
+  for experiment in exported:
+    if 'excel' in exportFormats and len(summaries) and experiment in set(summaries['experiment']):
+      with profiling.stage('write'):
+        stored_summary(summaries, experiment).to_excel(summary_path(experiment), engine=excelEngine)
+      print(f'Summary saved to output/{experiment}_summary.xlsx')
+    if 'csv' in exportFormats and len(results):
+      os.makedirs(os.path.join('output', experiment), exist_ok=True)
+      for fileName, table in results[results['experiment'] == experiment].groupby('file'):
+        columns = json.loads(table['columns'].iloc[0])
+        table = table.sort_values('row')[list(columns)]
+        table = table.astype({c: dtype for c, dtype in columns.items() if dtype.startswith('int')})
+        table.to_csv(results_path(experiment, fileName), index=False)
+        print(f'File saved to output/{experiment}/{fileName}')
+  return exported
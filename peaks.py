@@ -0,0 +1,104 @@
+import numpy as np
+
+PLATEAUS = ['none', 'first', 'center', 'last']
+
+
+# Indices of the local maxima of a signal (peak report areas or raw trace points).
+#   height: minimum value of the peak (a scalar, or an array with the threshold of each sample)
+#   prominence: minimum height of the peak above the highest of its two bases, the lowest
+#     points between the peak and the closest higher sample on each side (or the signal end);
+#     a scalar, or an array with the threshold of each sample
+#   width: minimum width in samples, at half prominence (interpolated between samples)
+#   plateau: flat maxima of equal values are ignored ('none'), or reported at their first,
+#     center or last sample
+#   edge: value assumed before the first and after the last sample
+def find_peaks(signal, height=None, prominence=None, width=None, plateau='none', edge=0.0):
+  if plateau not in PLATEAUS:
+    raise Exception(f'Invalid plateau handling: {plateau}. Use {", ".join(PLATEAUS)}.')
+  y = np.asarray(signal, dtype=float)
+  if len(y) == 0:
+    return np.empty(0, dtype=int)
+
+  if plateau == 'none':
+    padded = np.concatenate([[edge], y, [edge]])
+    peaks = np.flatnonzero((y > padded[:-2]) & (y > padded[2:]))
+  else:
+    # Collapse runs of equal values, so a plateau is a single candidate
+    starts = np.flatnonzero(np.concatenate([[True], y[1:] != y[:-1]]))
+    ends = np.concatenate([starts[1:], [len(y)]]) - 1
+    values = y[starts]
+    padded = np.concatenate([[edge], values, [edge]])
+    isMax = (values > padded[:-2]) & (values > padded[2:])
+    first, last = starts[isMax], ends[isMax]
+    peaks = {'first': first, 'center': (first + last) // 2, 'last': last}[plateau]
+
+  if height is not None:
+    peaks = peaks[y[peaks] >= (np.asarray(height)[peaks] if np.ndim(height) else height)]
+  if prominence is not None or width is not None:
+    prominences, leftBases, rightBases = peak_prominences(y, peaks)
+    keep = np.ones(len(peaks), dtype=bool)
+    if prominence is not None:
+      keep &= prominences >= (np.asarray(prominence)[peaks] if np.ndim(prominence) else prominence)
+    if width is not None:
+      keep &= peak_widths(y, peaks, prominences, leftBases, rightBases) >= width
+    peaks = peaks[keep]
+  return peaks
+
+
+# Closest sample strictly higher than each peak, on the left (-1 if none) and on the right
+# (len(y) if none). The closest higher sample is always found next to a sample at least as
+# high as its neighbours (a local maximum, possibly on a plateau, that may not be a peak), so
+# the monotonic stack runs over those only; the lowest point in between is the same.
+def higher_neighbours(y, peaks):
+  padded = np.concatenate([[-np.inf], y, [-np.inf]])
+  maxima = np.flatnonzero((y >= padded[:-2]) & (y >= padded[2:]))
+  heights = y[maxima]
+  left = np.full(len(maxima), -1)
+  right = np.full(len(maxima), len(y))
+  stack = []
+  for i, h in enumerate(heights):
+    while stack and heights[stack[-1]] <= h:
+      stack.pop()
+    if stack:
+      left[i] = maxima[stack[-1]]
+    stack.append(i)
+  stack = []
+  for i in range(len(maxima) - 1, -1, -1):
+    while stack and heights[stack[-1]] <= heights[i]:
+      stack.pop()
+    if stack:
+      right[i] = maxima[stack[-1]]
+    stack.append(i)
+  positions = np.searchsorted(maxima, peaks)
+  return left[positions], right[positions]
+
+
+# Prominence of each peak, with the positions of its left and right bases
+def peak_prominences(y, peaks):
+  y = np.asarray(y, dtype=float)
+  left, right = higher_neighbours(y, peaks)
+  leftStart = np.maximum(left, 0)
+  rightStop = np.minimum(right + 1, len(y))
+  # Lowest point between each peak and the closest higher samples (the closest one to the peak)
+  leftBases = np.array([p - np.argmin(y[s:p+1][::-1]) for s, p in zip(leftStart, peaks)], dtype=int)
+  rightBases = np.array([p + np.argmin(y[p:e]) for p, e in zip(peaks, rightStop)], dtype=int)
+  return y[peaks] - np.maximum(y[leftBases], y[rightBases]), leftBases, rightBases
+
+
+# Width in samples of each peak at half its prominence, within its bases: the distance between
+# the crossings of the half prominence level on each side, interpolated linearly between the
+# samples around them
+def peak_widths(y, peaks, prominences, leftBases, rightBases):
+  y = np.asarray(y, dtype=float)
+  level = y[peaks] - prominences / 2
+  widths = np.empty(len(peaks))
+  for i, (p, lb, rb) in enumerate(zip(peaks, leftBases, rightBases)):
+    left = p - np.argmax(y[lb:p+1][::-1] <= level[i])
+    right = p + np.argmax(y[p:rb+1] <= level[i])
+    leftCrossing, rightCrossing = float(left), float(right)
+    if y[left] < level[i]:
+      leftCrossing += (level[i] - y[left]) / (y[left + 1] - y[left])
+    if y[right] < level[i]:
+      rightCrossing -= (level[i] - y[right]) / (y[right - 1] - y[right])
+    widths[i] = rightCrossing - leftCrossing
+  return widths
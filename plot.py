@@ -3,76 +3,95 @@
 import glob
 import os
 import numpy as np
-from matplotlib import pyplot as plt
 
-LIQUID_FREQ = 6.25 # in Hz
-GAS_FREQ = 3.125 # in Hz
+import profiling
+from rax import load_rax
 
 
 def readRaxFile(raxFile, gas=False):
-  points = []
-  with open(raxFile) as f:
-    l = f.readline()
-    while l != '[Raw Data Points]\n':
-      l = f.readline()
-      if not l:
-        raise Exception(f'No Data Points found in file {raxFile}')
-    f.readline() # Skip one line
-    while True:
-      try:
-        points.append(int(f.readline()))
-      except ValueError:
-        break
-  if gas:
-    t = np.arange(len(points)) / (GAS_FREQ * 60)
-  else:
-    t = np.arange(len(points)) / (LIQUID_FREQ * 60)
-  return [t, np.array(points)]
+  with profiling.stage('parse') as stage:
+    t, points = load_rax(raxFile, gas)
+    stage.rows = len(points)
+  return [t, points]
+
+
+# Reduce a trace to the minimum and maximum of each of buckets groups of consecutive
+# points (in time order), which looks the same once drawn with about buckets pixels
+def decimate_minmax(t, y, buckets):
+  if buckets is None or len(y) <= 2 * buckets:
+    return t, y
+  size = -(-len(y) // buckets)
+  padded = np.pad(np.asarray(y), (0, size * buckets - len(y)), mode='edge').reshape(buckets, size)
+  offsets = np.arange(buckets) * size
+  lows = np.minimum(padded.argmin(axis=1) + offsets, len(y) - 1)
+  highs = np.minimum(padded.argmax(axis=1) + offsets, len(y) - 1)
+  indices = np.sort(np.stack([lows, highs], axis=1), axis=1).ravel()
+  return t[indices], y[indices]
+
+
+# New figure: drawn by pyplot when it is going to be shown, or rendered off-screen on the
+# Agg canvas otherwise, without pyplot global state
+def new_figure(figsize, show):
+  if show:
+    from matplotlib import pyplot as plt
+    return plt.figure(figsize=figsize)
+  from matplotlib.backends.backend_agg import FigureCanvasAgg
+  from matplotlib.figure import Figure
+  fig = Figure(figsize=figsize)
+  FigureCanvasAgg(fig)
+  return fig
+
+
+def save_plot(fig, experiment):
+  fig.savefig(os.path.join('output', f'{experiment}_plot.png'))
+  print(f'Plot saved to output/{experiment}_plot.png.')
 
 
-def liquid_plot(experiment):
+def show_plot(fig):
+  from matplotlib import pyplot as plt
+  print('Close the figure window to continue the program.')
+  plt.show()
+  plt.close(fig)
+
+
+# Stack of series in one column of the figure, the first one at the bottom, sharing its axes
+def plot_column(fig, series, files, column, columns, title, decimate):
+  rows = len(series)
+  ax1 = fig.add_subplot(rows, columns, columns * (rows - 1) + column)
+  ax1.plot(*decimate_minmax(*series[0], decimate), label=os.path.basename(files[0]))
+  ax1.legend()
+  ax = ax1
+  for i in range(1, rows):
+    ax = fig.add_subplot(rows, columns, columns * (rows - i - 1) + column, sharex=ax1, sharey=ax1)
+    ax.tick_params(labelbottom=False)
+    ax.plot(*decimate_minmax(*series[i], decimate), label=os.path.basename(files[i]))
+    ax.legend()
+  ax.set_title(title)
+
+
+# decimate: number of min/max buckets each trace is reduced to before drawing (None keeps all points)
+# save: save the figure to output/{experiment}_plot.png. Returns the figure.
+def liquid_plot(experiment, show=True, decimate=None, save=True):
+  profiling.set_experiment(experiment)
   raxFiles = sorted(glob.glob(os.path.join('input', experiment, '*.RAX')))
 
   if len(raxFiles) == 0:
     raise Exception(f'No RAX files found in folder {experiment}. Skipping experiment.')
-  
-  series = []
-
-  for raxFile in raxFiles:
-    series.append(readRaxFile(raxFile))
-
-  plt.figure(figsize=(12,8))
 
-  ax1 = plt.subplot(len(raxFiles), 1, len(raxFiles))
-  plt.plot(series[0][0], series[0][1], label=os.path.basename(raxFiles[0]))
-  plt.legend()
+  series = [readRaxFile(raxFile) for raxFile in raxFiles]
 
-  for i in range(1, len(series)):
-    ax = plt.subplot(len(series), 1, len(series) - i, sharex=ax1, sharey=ax1)
-    plt.setp(ax.get_xticklabels(), visible=False)
-    plt.plot(series[i][0], series[i][1], label=os.path.basename(raxFiles[i]))
-    plt.legend()
+  with profiling.stage('render', sum(len(points) for _, points in series)):
+    fig = new_figure((12,8), show)
+    plot_column(fig, series, raxFiles, 1, 1, experiment, decimate)
+    if save:
+      save_plot(fig, experiment)
+  if show:
+    show_plot(fig)
+  return fig
 
-  plt.title(experiment)
-  plt.savefig(os.path.join('output', f'{experiment}_plot.png'))
-
-  print(f'Plot saved to output/{experiment}_plot.png.')
-  print('Close the figure window to continue the program.')
-
-  plt.show()
-
-
-def gas_plot(experiment):
-  raxFiles = sorted(glob.glob(os.path.join('input', experiment, '*.RAX')))
-
-  if len(raxFiles) == 0:
-    raise Exception(f'No RAX files found in folder {experiment}. Skipping experiment.')
-  
-  tcdSeries = []
-  fidSeries = []
-  tcdFiles = []
-  fidFiles = []
 
+def select_gas_pairs(experiment, raxFiles):
+  pairs = []
   for num in range(3):
     print('Avaliable files:')
     print('; '.join(
@@ -85,8 +104,7 @@ def gas_plot(experiment):
         break
       except (ValueError, AssertionError):
         print('Error: invalid file number. Try again.')
-    tcdFiles.append(raxFiles[fileNum-1])
-    tcdSeries.append(readRaxFile(raxFiles[fileNum-1], True))
+    tcdFile = raxFiles[fileNum-1]
 
     while True:
       try:
@@ -95,37 +113,41 @@ def gas_plot(experiment):
         break
       except (ValueError, AssertionError):
         print('Error: invalid file number. Try again.')
-    fidFiles.append(raxFiles[fileNum-1])
-    fidSeries.append(readRaxFile(raxFiles[fileNum-1], True))
-
-  plt.figure(figsize=(16,8))
-
-  ax1 = plt.subplot(len(tcdFiles), 2, 2 * len(tcdFiles) - 1)
-  plt.plot(tcdSeries[0][0], tcdSeries[0][1], label=os.path.basename(tcdFiles[0]))
-  plt.legend()
-
-  for i in range(1, len(tcdSeries)):
-    ax = plt.subplot(len(tcdSeries), 2, 2 * (len(tcdSeries) - i) - 1, sharex=ax1, sharey=ax1)
-    plt.setp(ax.get_xticklabels(), visible=False)
-    plt.plot(tcdSeries[i][0], tcdSeries[i][1], label=os.path.basename(tcdFiles[i]))
-    plt.legend()
+    pairs.append((tcdFile, raxFiles[fileNum-1]))
+  return pairs
 
-  plt.title(f'{experiment}_TCD')
 
-  ax2 = plt.subplot(len(fidFiles), 2, 2 * len(fidFiles))
-  plt.plot(fidSeries[0][0], fidSeries[0][1], label=os.path.basename(fidFiles[0]))
-  plt.legend()
+# pairs: list of (TCD file, FID file) paths; asked through terminal when not given
+def gas_plot(experiment, pairs=None, show=True, decimate=None, save=True):
+  profiling.set_experiment(experiment)
+  raxFiles = sorted(glob.glob(os.path.join('input', experiment, '*.RAX')))
 
-  for i in range(1, len(fidSeries)):
-    ax = plt.subplot(len(fidSeries), 2, 2 * (len(fidSeries) - i), sharex=ax2, sharey=ax2)
-    plt.setp(ax.get_xticklabels(), visible=False)
-    plt.plot(fidSeries[i][0], fidSeries[i][1], label=os.path.basename(fidFiles[i]))
-    plt.legend()
+  if len(raxFiles) == 0:
+    raise Exception(f'No RAX files found in folder {experiment}. Skipping experiment.')
 
-  plt.title(f'{experiment}_FID')
+  if pairs is None:
+    pairs = select_gas_pairs(experiment, raxFiles)
+  tcdFiles = [tcdFile for tcdFile, _ in pairs]
+  fidFiles = [fidFile for _, fidFile in pairs]
+  tcdSeries = [readRaxFile(f, True) for f in tcdFiles]
+  fidSeries = [readRaxFile(f, True) for f in fidFiles]
+
+  with profiling.stage('render', sum(len(points) for _, points in tcdSeries + fidSeries)):
+    fig = new_figure((16,8), show)
+    plot_column(fig, tcdSeries, tcdFiles, 1, 2, f'{experiment}_TCD', decimate)
+    plot_column(fig, fidSeries, fidFiles, 2, 2, f'{experiment}_FID', decimate)
+    if save:
+      save_plot(fig, experiment)
+  if show:
+    show_plot(fig)
+  return fig
+
+
+# PNG image of a figure rendered off-screen
+def figure_png(fig):
+  import io
+  with profiling.stage('render'):
+    image = io.BytesIO()
+    fig.savefig(image, format='png')
+  return image.getvalue()
 
-  plt.savefig(os.path.join('output', f'{experiment}_plot.png'))
-  print(f'Plot saved to output/{experiment}_plot.png.')
-  print('Close the figure window to continue the program.')
-
-  plt.show()
@@ -0,0 +1,191 @@
+import functools
+import json
+import os
+import threading
+import time
+
+# Stages of the analysis and plot functions timed when profiling is enabled
+STAGES = ['parse', 'align', 'match', 'quantify', 'summarize', 'write', 'render']
+
+enabled = False
+traceMemory = False # Allocations through tracemalloc, which slows down every allocation
+records = [] # One dict per stage run, in order of completion
+currentExperiment = None
+stack = threading.local()
+
+
+class Stage:
+
+  def __init__(self, name, rows=None):
+    self.name = name
+    self.rows = rows
+
+  def __enter__(self):
+    self.experiment = currentExperiment
+    if traceMemory:
+      import tracemalloc
+      current, peak = tracemalloc.get_traced_memory()
+      parents = getattr(stack, 'stages', None)
+      if parents:
+        parents[-1].peak = max(parents[-1].peak, peak)
+      else:
+        stack.stages = parents = []
+      tracemalloc.reset_peak()
+      self.memoryStart = self.peak = current
+      parents.append(self)
+    self.cpuStart = time.process_time()
+    self.start = time.perf_counter()
+    return self
+
+  def __exit__(self, *exc):
+    wall = time.perf_counter() - self.start
+    cpu = time.process_time() - self.cpuStart
+    record = dict(
+      stage=self.name, experiment=self.experiment, start=self.start, wall=wall, cpu=cpu,
+      rows=self.rows, pid=os.getpid(), tid=threading.get_ident()
+    )
+    if traceMemory:
+      import tracemalloc
+      current, peak = tracemalloc.get_traced_memory()
+      peak = max(self.peak, peak)
+      record['allocated'] = current - self.memoryStart # Net bytes still allocated after the stage
+      record['peak'] = peak - self.memoryStart # Highest allocation above the start of the stage
+      stack.stages.pop()
+      if stack.stages:
+        stack.stages[-1].peak = max(stack.stages[-1].peak, peak)
+    records.append(record)
+    return False
+
+
+# Shared by every stage while profiling is disabled, so instrumented code only pays a call
+class NullStage:
+  rows = None
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    return False
+
+  def __setattr__(self, name, value):
+    pass
+
+nullStage = NullStage()
+
+
+# Context manager timing one stage of the current experiment. The row count can be given
+# or set on the returned object inside the block.
+def stage(name, rows=None):
+  return Stage(name, rows) if enabled else nullStage
+
+
+# Decorator timing every call of a function as one stage, with the length of its result as row count
+def profiled(name):
+  def decorator(function):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+      if not enabled:
+        return function(*args, **kwargs)
+      with Stage(name) as current:
+        result = function(*args, **kwargs)
+        current.rows = len(result) if hasattr(result, '__len__') else None
+      return result
+    return wrapper
+  return decorator
+
+
+def set_experiment(experiment):
+  global currentExperiment
+  currentExperiment = experiment
+
+
+def enable(memory=False):
+  global enabled, traceMemory
+  enabled = True
+  traceMemory = memory
+  if memory:
+    import tracemalloc
+    if not tracemalloc.is_tracing():
+      tracemalloc.start()
+
+
+# Run function(*args) in a worker process with the profiling options of the parent, and
+# return its result with the records of the stages it ran, removed from the worker records
+# (also when it fails) so they do not pile up over its tasks
+def run_collected(options, function, *args):
+  enable(**options)
+  start = len(records)
+  try:
+    result = function(*args)
+    return result, records[start:]
+  finally:
+    del records[start:]
+
+
+def options():
+  return dict(memory=traceMemory)
+
+
+# Totals of each stage (calls, wall and CPU time, rows, largest peak allocation), in STAGES order
+def summary(selected=None):
+  selected = records if selected is None else selected
+  totals = {}
+  for record in selected:
+    total = totals.setdefault(record['stage'], dict(stage=record['stage'], calls=0, wall=0.0, cpu=0.0, rows=0, peak=None))
+    total['calls'] += 1
+    total['wall'] += record['wall']
+    total['cpu'] += record['cpu']
+    total['rows'] += record['rows'] or 0
+    if 'peak' in record:
+      total['peak'] = max(total['peak'] or 0, record['peak'])
+  order = STAGES + sorted(set(totals) - set(STAGES))
+  return [totals[name] for name in order if name in totals]
+
+
+def print_summary():
+  if not records:
+    return
+  totals = summary()
+  wall = sum(total['wall'] for total in totals)
+  print(f'\n{"Stage":<12}{"Calls":>7}{"Wall [s]":>11}{"CPU [s]":>10}{"Share":>8}{"Rows":>10}{"Peak [MB]":>11}')
+  for total in totals:
+    peak = f'{total["peak"] / 2**20:.1f}' if total['peak'] is not None else '-'
+    share = total['wall'] / wall if wall > 0 else 0
+    print(f'{total["stage"]:<12}{total["calls"]:>7}{total["wall"]:>11.3f}{total["cpu"]:>10.3f}{share:>8.0%}{total["rows"]:>10}{peak:>11}')
+
+
+def save_json(path):
+  experiments = sorted(set(str(record['experiment']) for record in records))
+  with open(path, 'w') as f:
+    json.dump(dict(
+      stages=summary(),
+      experiments={e: summary([r for r in records if str(r['experiment']) == e]) for e in experiments},
+      records=records,
+    ), f, indent=2)
+
+
+# Chrome trace (chrome://tracing or Perfetto): one complete event per stage run, by process
+def save_chrome_trace(path):
+  origin = min((record['start'] for record in records), default=0)
+  events = [
+    dict(
+      name=record['stage'], cat=str(record['experiment']), ph='X', pid=record['pid'], tid=record['tid'],
+      ts=(record['start'] - origin) * 1e6, dur=record['wall'] * 1e6,
+      args={key: record[key] for key in ['experiment', 'rows', 'cpu', 'allocated', 'peak'] if key in record},
+    )
+    for record in records
+  ]
+  with open(path, 'w') as f:
+    json.dump(dict(traceEvents=events, displayTimeUnit='ms'), f)
+
+
+# Print the summary table and save the profile as prefix.json and prefix.trace.json
+def finish(prefix):
+  if not enabled:
+    return
+  print_summary()
+  if prefix and records:
+    os.makedirs(os.path.dirname(prefix) or '.', exist_ok=True)
+    save_json(f'{prefix}.json')
+    save_chrome_trace(f'{prefix}.trace.json')
+    print(f'Profile saved to {prefix}.json and {prefix}.trace.json')
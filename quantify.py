@@ -0,0 +1,209 @@
+import numpy as np
+import pandas as pd
+
+import profiling
+
+# Quantification of many samples at once. The peaks of N samples matched to the same database
+# are stacked into one (sample x row) matrix of areas, the mass of every compound of every
+# sample is computed from the response factors (gas) or RRFs (liquid) and densities of the
+# database as vectors, and the total of every classification with one product by a
+# (row x classification) indicator matrix, instead of one results table and one groupby per
+# sample. The summaries are the same as those of analysis.gas_summary and
+# analysis.liquid_summary merged by analysis.merge_summaries.
+
+
+# Areas of the peaks of N samples summed by matched database row, as a (sample x row) matrix,
+# NaN where no peak of the sample was matched to the row.
+#   areas: peak areas of each sample
+#   rows: database row matched to each peak of each sample (-1 when unmatched)
+def stack_areas(areas, rows, numRows):
+  numSamples = len(rows)
+  sample = np.repeat(np.arange(numSamples), [len(r) for r in rows])
+  rows = np.concatenate([np.asarray(r, dtype=np.int64) for r in rows] or [np.empty(0, dtype=np.int64)])
+  areas = np.concatenate([np.asarray(a, dtype=float) for a in areas] or [np.empty(0)])
+  matched = rows >= 0
+  cells = sample[matched] * numRows + rows[matched]
+  size = numSamples * numRows
+  stacked = np.bincount(cells, areas[matched], size).reshape(numSamples, numRows)
+  stacked[np.bincount(cells, minlength=size).reshape(numSamples, numRows) == 0] = np.nan
+  return stacked
+
+
+# (row x classification) matrix, with a one where the row belongs to the classification
+def class_indicator(classifications, names):
+  codes = pd.Index(names).get_indexer(pd.Series(classifications, dtype=object))
+  indicator = np.zeros((len(codes), len(names)))
+  rows = np.flatnonzero(codes >= 0)
+  indicator[rows, codes[rows]] = 1
+  return indicator
+
+
+# Total mass of each classification in each sample, NaN for the classifications without any
+# row present in the sample. Rows present without mass (unmatched, or without response factor)
+# count as zero, as in a groupby sum.
+def class_totals(masses, present, indicator):
+  totals = np.where(np.isnan(masses), 0, masses) @ indicator
+  totals[present.astype(float) @ indicator == 0] = np.nan
+  return totals
+
+
+# Compounds with a response factor of 0 (e.g. in the TCD database) have an infinite or NaN
+# mass, as in the pandas division, without a warning for each sample
+def gas_masses(areas, responseFactors, densities, volumes):
+  with np.errstate(divide='ignore', invalid='ignore'):
+    return areas / responseFactors * np.asarray(volumes, dtype=float)[:, None] / 5 * densities
+
+
+def liquid_masses(areas, rrfs, isAreas, isMasses):
+  with np.errstate(divide='ignore', invalid='ignore'):
+    return areas / rrfs * np.asarray(isMasses, dtype=float)[:, None] / isAreas[:, None]
+
+
+# Totals of N gas samples quantified with the same databases, as a (classification x sample)
+# table. database: TCD and FID database rows, with the columns of areas.
+# isolates: compound moved to a classification of its own in each sample ('None' for none)
+def gas_totals(database, areas, volumes, isolates=None):
+  masses = gas_masses(
+    areas, database['Response Factor'].to_numpy(dtype=float), database['Density'].to_numpy(dtype=float), volumes
+  )
+  isolates = np.asarray(['None'] * len(areas) if isolates is None else isolates, dtype=object)
+  classifications = database['Classification'].to_numpy(dtype=object)
+  compounds = database['Compound'].to_numpy(dtype=object)
+  names = sorted(set(pd.Series(classifications).dropna()) | (set(isolates) - {'None'}))
+  present = ~np.isnan(areas)
+  totals = np.full((len(areas), len(names)), np.nan)
+  for isolate in pd.unique(isolates):
+    selected = isolates == isolate
+    groups = classifications if isolate == 'None' else np.where(compounds == isolate, isolate, classifications)
+    totals[selected] = class_totals(masses[selected], present[selected], class_indicator(groups, names))
+  return pd.DataFrame(totals.T, index=names)
+
+
+# Totals of N liquid samples quantified with the same database, as a (classification x sample)
+# table. areas: the database rows, then the peaks left unidentified; the compounds without
+# classification or RRF are unidentified, with an RRF of 1.
+def liquid_totals(database, areas, present, isMasses):
+  rrfs = np.append(database['RRF'].fillna(1).to_numpy(dtype=float), 1.0)
+  classifications = np.append(database['Classification'].fillna('unidentified').to_numpy(dtype=object), 'unidentified')
+  names = sorted(set(classifications))
+  isRows = np.flatnonzero(classifications == 'internal standard')
+  isAreas = areas[:, isRows].sum(axis=1) if len(isRows) else np.full(len(areas), np.nan)
+  masses = liquid_masses(areas, rrfs, isAreas, isMasses)
+  return pd.DataFrame(class_totals(masses, present, class_indicator(classifications, names)).T, index=names)
+
+
+# Mass_n summary from the classification totals of N samples (NaN for the classifications
+# absent from a sample), with the rows of analysis.merge_summaries: the sorted classifications
+# of each sample, its unaccounted mass and its mass, in order of first appearance.
+#   offsets: mass added to the unaccounted mass of each sample (internal standard of liquid samples)
+def summary_frame(totalsDf, sampleMasses, unaccountedName, offsets=0):
+  totals = totalsDf.to_numpy(dtype=float)
+  sampleMasses = np.asarray(sampleMasses, dtype=float)
+  unaccounted = sampleMasses - np.nansum(totals, axis=0) + offsets
+
+  labels = list(totalsDf.index)
+  present = ~np.isnan(totals)
+  numLabels = present.any(axis=1).sum() + 2
+  order = {}
+  for column in present.T:
+    for label in sorted(label for label, p in zip(labels, column) if p) + [unaccountedName, 'Sample']:
+      order.setdefault(label, None)
+    if len(order) == numLabels:
+      break
+
+  summaryDf = pd.DataFrame(
+    np.vstack([totals, unaccounted, sampleMasses]),
+    index=labels + [unaccountedName, 'Sample'],
+    columns=[f'Mass_{num+1}' for num in range(len(sampleMasses))],
+  )
+  return summaryDf.loc[list(order)]
+
+
+# Classification totals of samples grouped by databases, in the order of the samples
+def grouped_totals(samples, key, totals):
+  groups = {}
+  for num, sample in enumerate(samples):
+    groups.setdefault(key(sample), []).append(num)
+  frames = []
+  for databases, nums in groups.items():
+    frame = totals(databases, [samples[num] for num in nums])
+    frame.columns = nums
+    frames.append(frame)
+  return pd.concat(frames, axis=1)[list(range(len(samples)))]
+
+
+# Mass_n summary of gas samples, quantified in one batch per pair of databases. Each sample
+# has its tcdDatabase and fidDatabase, the areas of its TCD and FID peaks (tcdAreas, fidAreas),
+# the database rows matched to them (tcdRows, fidRows, from analysis.gas_matches), and its
+# mass, volume and isolate.
+def gas_summaries(samples):
+  def totals(databases, group):
+    tcdDatabase, fidDatabase = databases
+    database = pd.concat([tcdDatabase.frame, fidDatabase.frame], ignore_index=True)
+    with profiling.stage('quantify', sum(len(s['tcdAreas']) + len(s['fidAreas']) for s in group)):
+      areas = stack_areas(
+        [np.concatenate([s['tcdAreas'], s['fidAreas']]) for s in group],
+        [np.concatenate([s['tcdRows'], np.where(s['fidRows'] >= 0, s['fidRows'].astype(np.int64) + len(tcdDatabase), -1)]) for s in group],
+        len(database),
+      )
+      return gas_totals(database, areas, [s['volume'] for s in group], [s.get('isolate', 'None') for s in group])
+
+  totalsDf = grouped_totals(samples, lambda s: (s['tcdDatabase'], s['fidDatabase']), totals)
+  with profiling.stage('summarize', len(samples)):
+    return summary_frame(totalsDf, [s['mass'] for s in samples], 'Unaccounted')
+
+
+# Mass_n summary of liquid samples, quantified in one batch per database. Each sample has its
+# database, the retention times and areas of its peaks (rt, areas), the peak matched to each
+# compound (matches, from analysis.liquid_matches), and its mass and isMass. As in
+# analysis.liquid_results, every compound is present, with the area of its peak, and every
+# peak is also unidentified unless the compound has exactly its retention time.
+def liquid_summaries(samples):
+  def totals(database, group):
+    numRows = len(database)
+    areas, rows = [], []
+    for s in group:
+      matched = np.flatnonzero(s['matches'] >= 0)
+      peaks = s['matches'][matched]
+      merged = peaks[s['rt'][peaks] == database.rt[matched]]
+      unidentified = np.ones(len(s['areas']), dtype=bool)
+      unidentified[merged] = False
+      areas.append(np.concatenate([s['areas'][peaks], s['areas'][unidentified]]))
+      rows.append(np.concatenate([matched, np.full(unidentified.sum(), numRows)]))
+    with profiling.stage('quantify', sum(len(s['areas']) for s in group)):
+      stacked = stack_areas(areas, rows, numRows + 1)
+      present = np.ones(stacked.shape, dtype=bool)
+      present[:, -1] = ~np.isnan(stacked[:, -1])
+      return liquid_totals(database.frame, stacked, present, [s['isMass'] for s in group])
+
+  totalsDf = grouped_totals(samples, lambda s: s['database'], totals)
+  with profiling.stage('summarize', len(samples)):
+    return summary_frame(totalsDf, [s['mass'] for s in samples], 'unaccounted', np.array([s['isMass'] for s in samples]))
+
+
+# Peaks of a liquid sample quantified by liquid_summaries, from its LiquidResults, as arrays
+# that can be stored and quantified later with the other samples of the experiment
+def liquid_arrays(results):
+  return dict(rt=np.asarray(results.rt), areas=np.asarray(results.areas), matches=np.asarray(results.matches))
+
+
+# Sample of liquid_summaries, from its LiquidResults
+def liquid_sample(results, sampleMass, isMass):
+  return dict(liquid_arrays(results), database=results.database, mass=sampleMass, isMass=isMass)
+
+
+# Peaks of a gas sample quantified by gas_summaries, from the GasResults of its TCD and FID
+# reports, as arrays
+def gas_arrays(tcdResults, fidResults):
+  return dict(
+    tcdAreas=np.asarray(tcdResults.areas), fidAreas=np.asarray(fidResults.areas),
+    tcdRows=np.asarray(tcdResults.rows), fidRows=np.asarray(fidResults.rows),
+  )
+
+
+# Sample of gas_summaries, from the GasResults of its TCD and FID reports
+def gas_sample(tcdResults, fidResults, sampleMass, isolate='None'):
+  return dict(
+    gas_arrays(tcdResults, fidResults), tcdDatabase=tcdResults.database, fidDatabase=fidResults.database,
+    mass=sampleMass, volume=tcdResults.sampleVol, isolate=isolate,
+  )
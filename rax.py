@@ -0,0 +1,120 @@
+import mmap
+import warnings
+import numpy as np
+
+LIQUID_FREQ = 6.25 # in Hz
+GAS_FREQ = 3.125 # in Hz
+
+DATA_HEADER = b'[Raw Data Points]'
+CHUNK_BYTES = 8 * 1024 * 1024 # Size of the text block parsed at once
+
+
+def sampling_freq(gas=False):
+  return GAS_FREQ if gas else LIQUID_FREQ
+
+
+def open_rax(raxFile):
+  with open(raxFile, 'rb') as f:
+    if f.seek(0, 2) == 0:
+      raise Exception(f'No Data Points found in file {raxFile}')
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+# Byte offsets [start, end) of the block of data points: the lines after the
+# [Raw Data Points] header and the blank line that follows it, up to the next blank line
+def data_block(mm, raxFile):
+  pos = mm.find(DATA_HEADER)
+  while pos >= 0:
+    end = pos + len(DATA_HEADER)
+    if (pos == 0 or mm[pos-1] == ord('\n')) and mm[end:end+1] in [b'\n', b'\r']:
+      break
+    pos = mm.find(DATA_HEADER, end)
+  if pos < 0:
+    raise Exception(f'No Data Points found in file {raxFile}')
+
+  blankLine = b'\n\r\n' if mm[end:end+1] == b'\r' else b'\n\n'
+  start = mm.find(b'\n', end) + 1 # End of header line
+  start = mm.find(b'\n', start) + 1 # Skip one line
+  if start == 0:
+    return len(mm), len(mm)
+
+  stop = mm.find(blankLine, start - 1)
+  return start, len(mm) if stop < 0 else stop + 1
+
+
+# Integer values of a chunk of lines, stopping at the first line which is not an integer.
+# Returns the values and whether the whole chunk was parsed.
+def parse_chunk(chunk):
+  lines = chunk.count(b'\n') + (0 if chunk.endswith(b'\n') else 1)
+  try:
+    with warnings.catch_warnings():
+      # Older NumPy versions warn and return the values parsed until unexpected content,
+      # which is detected below by the number of values
+      warnings.simplefilter('ignore', DeprecationWarning)
+      values = np.fromstring(chunk, dtype=np.int64, sep=' ') if chunk.strip() else np.empty(0, np.int64)
+    if len(values) == lines:
+      return values, True
+  except ValueError:
+    pass
+
+  # Unexpected content in the block: parse line by line, as the data stops at the first invalid line
+  values = []
+  for line in chunk.split(b'\n'):
+    try:
+      values.append(int(line))
+    except ValueError:
+      break
+  return np.array(values, dtype=np.int64), False
+
+
+def block_chunks(mm, start, end, chunkBytes=CHUNK_BYTES):
+  while start < end:
+    stop = end if end - start <= chunkBytes else mm.rfind(b'\n', start, start + chunkBytes) + 1
+    if stop <= start:
+      stop = mm.find(b'\n', start + chunkBytes, end) + 1 or end
+    values, complete = parse_chunk(mm[start:stop])
+    yield values
+    if not complete:
+      break
+    start = stop
+
+
+# Generator of the data points in chunks of about chunkBytes of text, for files too large
+# to be loaded at once. Yields (time [min], points) arrays for each chunk.
+def iter_rax_chunks(raxFile, gas=False, chunkBytes=CHUNK_BYTES):
+  mm = open_rax(raxFile)
+  try:
+    freq = sampling_freq(gas) * 60
+    count = 0
+    for values in block_chunks(mm, *data_block(mm, raxFile), chunkBytes):
+      yield np.arange(count, count + len(values)) / freq, values
+      count += len(values)
+  finally:
+    mm.close()
+
+
+# Time [min] and data points of a RAX file, parsed in chunks straight into the output
+# array. Points are stored as int32, unless they do not fit in it.
+def read_rax(raxFile, gas=False, dtype=np.int32):
+  mm = open_rax(raxFile)
+  try:
+    start, end = data_block(mm, raxFile)
+    capacity = 1 + sum(mm[i:min(i + CHUNK_BYTES, end)].count(b'\n') for i in range(start, end, CHUNK_BYTES))
+    points = np.empty(capacity, dtype=dtype)
+    count = 0
+    for values in block_chunks(mm, start, end):
+      info = np.iinfo(points.dtype)
+      if len(values) and (values.min() < info.min or values.max() > info.max):
+        points = points.astype(np.int64)
+      points[count:count + len(values)] = values
+      count += len(values)
+  finally:
+    mm.close()
+  return np.arange(count) / (sampling_freq(gas) * 60), points[:count]
+
+
+# Same as read_rax, using the cache of parsed files
+def load_rax(raxFile, gas=False):
+  import cache
+  points = cache.cached_columns(raxFile, 'rax', lambda f: {'points': read_rax(f)[1]})['points']
+  return np.arange(len(points)) / (sampling_freq(gas) * 60), points
@@ -0,0 +1,129 @@
+import numpy as np
+import pandas as pd
+
+from database import TIME_COLUMN
+from matching import MATCH_FLAGS, assemble_matches
+
+# Results of one input file, kept compact while the analysis runs: the columns of the peak
+# table as parsed (memory mapped from the cache when it is enabled) and one small integer per
+# match, the database row of each peak (gas) or the peak of each compound (liquid). Compound
+# names, classifications and factors stay in the CompoundDatabase, stored once and referenced
+# by row, and the quantities of each peak are computed as arrays when needed. The wide table
+# of the outputs, with the database columns joined to every peak, is only built by to_frame.
+
+
+# Smallest signed integer type holding the positions of n rows, and -1 for no match
+def index_dtype(n):
+  return np.int16 if n < 2**15 else np.int32
+
+
+# Column of a peak table in its most compact exact type: integer columns (e.g. Height) in the
+# smallest integer type holding their values. Floating point columns are written to the
+# outputs and keep their precision. Only kept in memory: peaks() restores the types of the file.
+def compact(values):
+  values = np.asarray(values)
+  if values.dtype.kind in 'iu' and len(values):
+    return pd.to_numeric(values, downcast='integer')
+  return values
+
+
+# Values of a database column for the matched rows, NaN for unmatched (-1) rows
+def take(values, rows):
+  values = np.asarray(values, dtype=float)
+  if len(values) == 0:
+    return np.full(len(rows), np.nan)
+  return np.where(rows >= 0, values[rows], np.nan)
+
+
+# Peak table of one file with its matches, positions among numTargets rows. Aligned runs
+# also keep the corrected retention time of each peak (alignedRt) and the flag of each match
+# (flags, codes of MATCH_FLAGS), written to the outputs as the Aligned RT and Match columns.
+class PeakResults:
+
+  def __init__(self, fileDf, database, matches, numTargets, alignedRt=None, flags=None):
+    self.columns = {name: compact(fileDf[name].to_numpy()) for name in fileDf.columns}
+    self.dtypes = {name: fileDf[name].dtype for name in fileDf.columns} # Written to the outputs
+    self.database = database
+    self.matches = np.asarray(matches).astype(index_dtype(numTargets))
+    self.alignedRt = alignedRt
+    self.flags = flags
+
+  def __len__(self):
+    return len(self.columns[TIME_COLUMN])
+
+  def peaks(self):
+    fileDf = pd.DataFrame({name: np.asarray(values, dtype=self.dtypes[name]) for name, values in self.columns.items()})
+    if self.alignedRt is not None:
+      fileDf.insert(fileDf.columns.get_loc(TIME_COLUMN) + 1, 'Aligned RT', self.alignedRt)
+    return fileDf
+
+  def match_flags(self):
+    return np.asarray(MATCH_FLAGS, dtype=object)[self.flags]
+
+  @property
+  def rt(self):
+    return np.asarray(self.columns[TIME_COLUMN], dtype=float)
+
+  @property
+  def areas(self):
+    return np.asarray(self.columns['Area'], dtype=float)
+
+  # Bytes held by the results, including the peak table
+  def nbytes(self):
+    arrays = list(self.columns.values()) + [self.matches, self.alignedRt, self.flags]
+    return sum(np.asarray(values).nbytes for values in arrays if values is not None)
+
+
+# Peaks of one TCD or FID report matched to the closest compound of the database (rows: -1
+# when unmatched), with the volume of the sample
+class GasResults(PeakResults):
+
+  def __init__(self, fileDf, database, rows, sampleVol, alignedRt=None, flags=None):
+    super().__init__(fileDf, database, rows, len(database), alignedRt, flags)
+    self.sampleVol = sampleVol
+
+  @property
+  def rows(self):
+    return self.matches
+
+  # Volume, Volume in Sample and Mass of each peak
+  def quantities(self):
+    attributes = self.database.attributes
+    with np.errstate(divide='ignore', invalid='ignore'): # Response factors of 0, as in quantify.gas_masses
+      volume = self.areas / take(attributes['Response Factor'], self.rows)
+      volumeInSample = volume * self.sampleVol / 5
+      mass = volumeInSample * take(attributes['Density'], self.rows)
+    return {
+      'Volume': volume,
+      'Volume in Sample': volumeInSample,
+      'Mass': mass,
+    }
+
+  def to_frame(self):
+    resultsDf = assemble_matches(self.peaks(), self.database.attributes, self.rows)
+    for name, values in self.quantities().items():
+      resultsDf[name] = values
+    if self.flags is not None:
+      resultsDf['Match'] = self.match_flags()
+    return resultsDf
+
+
+# Compounds of the database matched to the local Area peaks of one liquid sample (matches:
+# peak of each compound, -1 when unmatched). The results table is every peak, merged with the
+# compounds, so unclassified peaks are still present in output.
+class LiquidResults(PeakResults):
+
+  def __init__(self, fileDf, database, matches, alignedRt=None, flags=None):
+    super().__init__(fileDf, database, matches, len(fileDf), alignedRt, flags)
+
+  def to_frame(self):
+    fileDf = self.peaks()
+    resultsDf = assemble_matches(self.database.frame, fileDf, self.matches, [TIME_COLUMN])
+    if self.flags is not None:
+      resultsDf['Match'] = self.match_flags()
+    return pd.merge(
+      fileDf,
+      resultsDf,
+      'outer',
+      fileDf.keys().tolist()
+    ).sort_values(by=[TIME_COLUMN])
@@ -0,0 +1,85 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import analysis
+import batch
+import build
+import output
+import profiling
+
+
+# Submit function(*args) to the pool. Tables for the results store are returned to this
+# process, so they are written in batches, and so is the profile of the stages when enabled.
+def submit(executor, function, *args):
+  if profiling.enabled:
+    return executor.submit(profiling.run_collected, profiling.options(), output.run_collected, output.options(), function, *args)
+  return executor.submit(output.run_collected, output.options(), function, *args)
+
+
+# Run the jobs of a manifest on a pool of numJobs processes. Every replicate of every
+# experiment is a separate task; the summary of an experiment is quantified from the matched
+# peaks of all its replicates, in triplicate order, once they are done, so the output matches
+# the serial execution.
+# Returns the experiments that failed.
+def run_parallel(jobs, numJobs=None, overwrite=False):
+  numJobs = numJobs if numJobs and numJobs > 0 else os.cpu_count()
+  print(f'Running {len(jobs)} jobs on {numJobs} processes.')
+  failed = []
+  # job number -> experiment name, job, matched peaks and pending replicates, and whether its replicates
+  # (analysisFailed) or its plot (plotFailed) failed: a failed plot does not discard the summary
+  experiments = {}
+  pending = {} # future -> (job number, task kind, replicate number)
+
+  with ProcessPoolExecutor(max_workers=numJobs) as executor:
+    for jobNum, job in enumerate(jobs):
+      try:
+        job = batch.validate_job(job)
+        experiment = job['experiment']
+        if job['function'] in ['analysis', 'both']:
+          tasks, keys = batch.build_tasks(job, overwrite)
+          if batch.analysis_fresh(experiment, keys) and not overwrite:
+            print(f'Output for {experiment} is up to date. Skipping peak analysis.')
+          else:
+            experiments[jobNum] = dict(experiment=experiment, job=job, arrays=[None] * len(tasks), remaining=len(tasks), replicateKeys=keys)
+            for num, (function, args) in enumerate(tasks):
+              pending[submit(executor, function, *args)] = (jobNum, 'replicate', num)
+        if job['function'] in ['plot', 'both']:
+          key = batch.plot_key(job)
+          if batch.plot_fresh(experiment, key) and not overwrite:
+            print(f'Plot for {experiment} is up to date. Skipping plot.')
+          else:
+            experiments.setdefault(jobNum, dict(experiment=experiment))['plotKey'] = key
+            pending[submit(executor, batch.run_plot, job)] = (jobNum, 'plot', None)
+      except Exception as e:
+        print('Error:', e)
+        print('Skipping to next experiment.')
+        failed.append(job.get('experiment'))
+
+    for future in as_completed(pending):
+      jobNum, kind, num = pending[future]
+      state = experiments[jobNum]
+      try:
+        result = future.result()
+      except Exception as e:
+        print(f'Error in {state["experiment"]}:', e)
+        if not state.get('analysisFailed') and not state.get('plotFailed'):
+          failed.append(state['experiment'])
+        state['analysisFailed' if kind == 'replicate' else 'plotFailed'] = True
+        continue
+      if profiling.enabled:
+        result, records = result
+        profiling.records.extend(records)
+      result, tables = result
+      output.extend(tables)
+
+      if kind == 'replicate':
+        state['arrays'][num] = result
+        state['remaining'] -= 1
+        if state['remaining'] == 0 and not state.get('analysisFailed'):
+          profiling.set_experiment(state['experiment'])
+          analysis.save_summary(state['experiment'], batch.experiment_summary(state['job'], state['arrays']))
+          build.record_summary(state['experiment'], state['replicateKeys'])
+      else:
+        build.record(state['experiment'], 'plot', state['plotKey'])
+
+  return failed
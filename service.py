@@ -0,0 +1,372 @@
+import asyncio
+import base64
+import collections
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+import batch
+import build
+import cache
+
+# Local HTTP/JSON service running the analyses and plots of manifest jobs, for many clients
+# sharing one process that keeps pandas, matplotlib and the databases loaded:
+#   POST /jobs: submit a job, as in manifests, with optional "files" ({name: base64 content}).
+#     Returns its id, the key of its inputs: the content of its files and databases, its
+#     parameters and the code of the modules producing it.
+#   GET /jobs/{id}: status of the job (queued, running, done or failed, with its error)
+#   GET /jobs/{id}/summary: summary table as JSON (columns, index, data), or CSV with ?format=csv
+#   GET /jobs/{id}/plot.png: plot of the experiment
+#   GET /experiments: experiment folders of the input folder
+#   GET /health: jobs running and results cached
+# Errors are answered as JSON objects with an error message. The errors of the last FAILED_KEPT
+# failed jobs are kept.
+# Jobs run on a pool of worker processes, at most numJobs at a time, and at most MAX_PENDING
+# wait for a worker; further jobs are refused (503) until the queue drains. The results of the
+# last cacheSize jobs are kept in memory, so a job submitted again with the same inputs is
+# answered at once. Outputs are not written to the output folder.
+# Uploaded files are not written to the input folder, where they would replace the files of
+# jobs still waiting for a worker: each set of uploads gets its own workspace, UPLOADS_DIR/
+# {digest of the experiment and uploaded contents}, with an input/{experiment} folder holding
+# the files of input/{experiment} and the uploads, and the data folder. The job is validated
+# and run by a worker process from its workspace, which never changes once created.
+
+HOST = '127.0.0.1' # Only local clients by default; --host 0.0.0.0 serves the network
+PORT = 8765
+CACHE_SIZE = 128 # Results of jobs kept in memory
+MAX_PENDING = 64 # Jobs waiting for a worker
+MAX_BODY = 256 * 1024 * 1024 # Largest request, with the files it uploads
+UPLOADS_DIR = os.path.join('.service', 'uploads')
+SERVICE_MODULES = sorted(set(build.ANALYSIS_MODULES + build.PLOT_MODULES + ['service']))
+
+FAILED_KEPT = 256 # Failed jobs whose error is kept, the oldest are forgotten
+
+STATUS_TEXT = {200: 'OK', 202: 'Accepted', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 413: 'Payload Too Large', 500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+
+class HttpError(Exception):
+
+  def __init__(self, status, message):
+    super().__init__(message)
+    self.status = status
+
+  # Raised in worker processes, so it is sent back with its status
+  def __reduce__(self):
+    return HttpError, (self.status, str(self))
+
+
+# Import the analysis and plot modules once per worker, instead of once per job. Workers
+# change to the workspace of the jobs with uploads, so the cache folder is made absolute.
+def init_worker():
+  import output
+  import analysis
+  import plot
+  output.configure([])
+  if cache.enabled():
+    os.environ['CHROMATOGRAPHY_CACHE'] = os.path.abspath(cache.cache_dir())
+
+
+# Run in the workspace of a job with uploads (in a worker process, which runs one job at a
+# time), or in the current folder when root is None
+@contextlib.contextmanager
+def workspace(root):
+  if root is None:
+    yield
+    return
+  cwd = os.getcwd()
+  os.chdir(root)
+  try:
+    yield
+  finally:
+    os.chdir(cwd)
+
+
+# Summary table and plot of one job, run in a worker process
+def run_job(job, root=None):
+  import plot
+  result = {}
+  with workspace(root):
+    if job['function'] in ['analysis', 'both']:
+      arrays = [function(*args) for function, args in batch.align_tasks(batch.replicate_tasks(job))]
+      summaryDf = batch.experiment_summary(job, arrays)
+      result['summary'] = json.loads(summaryDf.to_json(orient='split'))
+      result['csv'] = summaryDf.to_csv()
+    if job['function'] in ['plot', 'both']:
+      result['png'] = plot.figure_png(batch.plot_figure(job, save=False))
+  return result
+
+
+# Whether a name sent by a client is a plain file name, that cannot reach outside its folder
+def plain_name(name):
+  return isinstance(name, str) and name != '' and os.path.basename(name) == name and not name.startswith('.')
+
+
+# Reject the experiment and file names of a job (samples and reference traces) that are not
+# plain file names, so clients only reach the files of their experiment folder
+def check_names(request):
+  if request.get('experiment') is not None and not plain_name(request['experiment']):
+    raise HttpError(400, f'Invalid experiment: {request["experiment"]}.')
+  names = []
+  for sample in request.get('samples') or []:
+    names += [sample[key] for key in ['file', 'tcd', 'fid'] if isinstance(sample, dict) and key in sample]
+  alignment = request.get('alignment')
+  if isinstance(alignment, dict):
+    names += [value for key, value in alignment.items() if key.lower().endswith('reference') and value]
+  for name in names:
+    if not plain_name(name):
+      raise HttpError(400, f'Invalid file name: {name}.')
+
+
+# Workspace of the files uploaded with a job: the files of input/{experiment}, replaced by the
+# uploads, and the data folder. Workspaces are addressed by their content, so the same uploads
+# share one, created once and never modified.
+def save_uploads(experiment, files):
+  if not isinstance(files, dict):
+    raise HttpError(400, 'Invalid files: expected an object of file names and base64 contents.')
+  if not plain_name(experiment):
+    raise HttpError(400, f'Invalid experiment: {experiment}.')
+  uploads = {}
+  for name, content in files.items():
+    if not plain_name(name):
+      raise HttpError(400, f'Invalid file name: {name}.')
+    try:
+      uploads[name] = base64.b64decode(content, validate=True)
+    except (TypeError, ValueError):
+      raise HttpError(400, f'Invalid base64 content of {name}.')
+
+  contents = {name: hashlib.blake2b(data, digest_size=16).hexdigest() for name, data in uploads.items()}
+  root = os.path.abspath(os.path.join(UPLOADS_DIR, cache.digest(json.dumps([experiment, contents], sort_keys=True))))
+  if os.path.isdir(root):
+    return root
+  tmp = f'{root}.{uuid.uuid4().hex}.tmp'
+  folder = os.path.join(tmp, 'input', experiment)
+  os.makedirs(folder)
+  source = os.path.join('input', experiment)
+  for name in sorted(os.listdir(source)) if os.path.isdir(source) else []:
+    path = os.path.join(source, name)
+    if name not in uploads and os.path.isfile(path):
+      try:
+        os.link(path, os.path.join(folder, name))
+      except OSError:
+        shutil.copy2(path, os.path.join(folder, name))
+  for name, data in uploads.items():
+    with open(os.path.join(folder, name), 'wb') as f:
+      f.write(data)
+  try:
+    os.symlink(os.path.abspath('data'), os.path.join(tmp, 'data'), target_is_directory=True)
+  except OSError:
+    shutil.copytree('data', os.path.join(tmp, 'data'))
+  try:
+    os.rename(tmp, root)
+  except OSError: # Created meanwhile by a request with the same uploads
+    shutil.rmtree(tmp, ignore_errors=True)
+  return root
+
+
+# Validated job and the key of its inputs, from the workspace root when given
+def prepare_job(request, root=None):
+  job = dict(request)
+  job.pop('files', None)
+  with workspace(root):
+    try:
+      job = batch.validate_job(job)
+      inputs = []
+      if job['function'] in ['analysis', 'both']:
+        for function, args in batch.replicate_tasks(job):
+          reports, databases = batch.replicate_files(function, args)
+          inputs += reports + databases
+      if job['function'] in ['plot', 'both']:
+        files = batch.plot_files(job)
+        inputs += [f for pair in files for f in pair] if job['type'] == 'gas' else files
+        inputs += batch.plot_databases(job)
+    except Exception as e:
+      raise HttpError(400, str(e))
+    return job, build.build_key(SERVICE_MODULES, sorted(set(inputs)), job)
+
+
+class Service:
+
+  def __init__(self, numJobs=None, cacheSize=CACHE_SIZE, maxPending=MAX_PENDING):
+    self.numJobs = numJobs if numJobs and numJobs > 0 else os.cpu_count()
+    self.cacheSize = cacheSize
+    self.maxPending = maxPending
+    self.results = collections.OrderedDict() # id -> result, least recently used first
+    self.jobs = {} # id -> status of the jobs queued, running or failed
+    self.executor = None
+    self.slots = None
+
+  def cached(self, jobId):
+    result = self.results.get(jobId)
+    if result is not None:
+      self.results.move_to_end(jobId)
+    return result
+
+  def store(self, jobId, result):
+    self.results[jobId] = result
+    self.results.move_to_end(jobId)
+    while len(self.results) > self.cacheSize:
+      self.results.popitem(last=False)
+
+  def pending(self):
+    return sum(1 for state in self.jobs.values() if state['status'] == 'queued')
+
+  async def submit(self, request):
+    if not isinstance(request, dict):
+      raise HttpError(400, 'Invalid job: expected an object.')
+    check_names(request)
+    loop = asyncio.get_running_loop()
+    # Uploads and file hashes run in a thread, so other requests are served meanwhile, and
+    # jobs with uploads are validated by a worker, from their workspace
+    root = None
+    if request.get('files'):
+      root = await loop.run_in_executor(None, save_uploads, request.get('experiment'), request['files'])
+      job, jobId = await loop.run_in_executor(self.executor, prepare_job, request, root)
+    else:
+      job, jobId = await loop.run_in_executor(None, prepare_job, request)
+    if self.cached(jobId) is not None:
+      return 200, {'id': jobId, 'status': 'done'}
+    state = self.jobs.get(jobId)
+    if state is not None and state['status'] in ['queued', 'running']:
+      return 202, {'id': jobId, 'status': state['status']}
+    if self.pending() >= self.maxPending:
+      raise HttpError(503, 'Too many jobs waiting. Try again later.')
+    self.jobs[jobId] = dict(status='queued', experiment=job['experiment'], submitted=time.time())
+    asyncio.ensure_future(self.run(jobId, job, root))
+    return 202, {'id': jobId, 'status': 'queued'}
+
+  async def run(self, jobId, job, root=None):
+    state = self.jobs[jobId]
+    async with self.slots:
+      state.update(status='running', started=time.time())
+      try:
+        result = await asyncio.get_running_loop().run_in_executor(self.executor, run_job, job, root)
+      except Exception as e:
+        state.update(status='failed', error=str(e), finished=time.time())
+        self.forget_failed()
+        return
+    self.store(jobId, result)
+    del self.jobs[jobId]
+
+  def forget_failed(self):
+    failed = sorted((state['finished'], jobId) for jobId, state in self.jobs.items() if state['status'] == 'failed')
+    for _, jobId in failed[:max(len(failed) - FAILED_KEPT, 0)]:
+      del self.jobs[jobId]
+
+  def status(self, jobId):
+    if self.cached(jobId) is not None:
+      return {'id': jobId, 'status': 'done'}
+    if jobId not in self.jobs:
+      raise HttpError(404, f'Job {jobId} not found.')
+    return {'id': jobId, **self.jobs[jobId]}
+
+  def result(self, jobId, name):
+    result = self.cached(jobId)
+    if result is None:
+      status = self.status(jobId)['status']
+      raise HttpError(404, f'Job {jobId} is {status}.')
+    if name not in result:
+      raise HttpError(404, f'Job {jobId} has no {"plot" if name == "png" else "summary"}.')
+    return result[name]
+
+  # Response (status, content type, body) to one request
+  async def route(self, method, path, query, body):
+    parts = [p for p in path.split('/') if p]
+    if method == 'GET' and parts == ['health']:
+      running = sum(1 for state in self.jobs.values() if state['status'] == 'running')
+      return json_response(200, {'status': 'ok', 'running': running, 'queued': self.pending(), 'cached': len(self.results)})
+    if method == 'GET' and parts == ['experiments']:
+      experiments = os.listdir('input') if os.path.isdir('input') else []
+      return json_response(200, sorted(e for e in experiments if os.path.isdir(os.path.join('input', e))))
+    if parts == ['jobs']:
+      if method != 'POST':
+        raise HttpError(405, 'Use POST to submit a job.')
+      try:
+        request = json.loads(body or b'{}')
+      except ValueError:
+        raise HttpError(400, 'Invalid JSON body.')
+      return json_response(*await self.submit(request))
+    if method == 'GET' and len(parts) == 2 and parts[0] == 'jobs':
+      return json_response(200, self.status(parts[1]))
+    if method == 'GET' and len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'summary':
+      if query.get('format', ['json'])[0] == 'csv':
+        return 200, 'text/csv', self.result(parts[1], 'csv').encode()
+      return json_response(200, self.result(parts[1], 'summary'))
+    if method == 'GET' and len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'plot.png':
+      return 200, 'image/png', self.result(parts[1], 'png')
+    raise HttpError(404, f'No route for {method} {path}.')
+
+  async def handle(self, reader, writer):
+    try:
+      try:
+        method, target, body = await read_request(reader)
+        url = urlsplit(target)
+        response = await self.route(method, url.path, parse_qs(url.query), body)
+      except HttpError as e:
+        response = json_response(e.status, {'error': str(e)})
+      except (ConnectionError, asyncio.IncompleteReadError):
+        raise
+      except Exception as e:
+        response = json_response(500, {'error': f'{type(e).__name__}: {e}'})
+      write_response(writer, *response)
+      await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+      pass
+    finally:
+      writer.close()
+
+  async def serve(self, host=HOST, port=PORT):
+    self.slots = asyncio.Semaphore(self.numJobs)
+    with ProcessPoolExecutor(max_workers=self.numJobs, initializer=init_worker) as self.executor:
+      server = await asyncio.start_server(self.handle, host, port)
+      print(f'Serving on http://{host}:{port} with {self.numJobs} workers (Ctrl+C to stop).')
+      async with server:
+        await server.serve_forever()
+
+
+def json_response(status, content):
+  return status, 'application/json', json.dumps(content).encode()
+
+
+# Method, target and body of an HTTP/1.1 request
+async def read_request(reader):
+  line = await reader.readline()
+  try:
+    method, target, _ = line.decode('latin1').split()
+  except ValueError:
+    raise HttpError(400, 'Invalid request line.')
+  headers = {}
+  while (line := await reader.readline()) not in [b'\r\n', b'\n', b'']:
+    name, _, value = line.decode('latin1').partition(':')
+    headers[name.strip().lower()] = value.strip()
+  try:
+    length = int(headers.get('content-length') or 0)
+  except ValueError:
+    raise HttpError(400, f'Invalid Content-Length: {headers["content-length"]}.')
+  if length < 0:
+    raise HttpError(400, f'Invalid Content-Length: {length}.')
+  if length > MAX_BODY:
+    raise HttpError(413, f'Request larger than {MAX_BODY} bytes.')
+  body = await reader.readexactly(length) if length else b''
+  return method.upper(), target, body
+
+
+def write_response(writer, status, contentType, body):
+  writer.write((
+    f'HTTP/1.1 {status} {STATUS_TEXT.get(status, "")}\r\n'
+    f'Content-Type: {contentType}\r\n'
+    f'Content-Length: {len(body)}\r\n'
+    'Connection: close\r\n\r\n'
+  ).encode('latin1') + body)
+
+
+def run(host=HOST, port=PORT, numJobs=None, cacheSize=CACHE_SIZE):
+  try:
+    asyncio.run(Service(numJobs, cacheSize).serve(host, port))
+  except KeyboardInterrupt:
+    print('\nService stopped.')
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from peaks import PLATEAUS, find_peaks, peak_prominences, peak_widths
+
+signal = pytest.importorskip('scipy.signal')
+
+
+# Random signals, as floats and as small integers (many plateaus)
+def random_signals(count=3000, seed=0):
+  rng = np.random.default_rng(seed)
+  for num in range(count):
+    size = rng.integers(3, 60)
+    yield rng.integers(0, 6, size).astype(float) if num % 2 else rng.random(size)
+
+
+# Peaks of scipy.signal.find_peaks: plateaus at their center, none on the signal ends
+def inner_peaks(y, **options):
+  peaks = find_peaks(y, plateau='center', edge=np.inf, **options)
+  return peaks[(peaks > 0) & (peaks < len(y) - 1)]
+
+
+def test_prominences_match_scipy():
+  for y in random_signals():
+    for plateau in PLATEAUS:
+      peaks = find_peaks(y, plateau=plateau)
+      prominences, leftBases, rightBases = peak_prominences(y, peaks)
+      expected = signal.peak_prominences(y, peaks)
+      np.testing.assert_allclose(prominences, expected[0])
+      np.testing.assert_array_equal(leftBases, expected[1])
+      np.testing.assert_array_equal(rightBases, expected[2])
+
+
+def test_plateau_stops_prominence():
+  # The plateau is not a peak with plateau='none', but still bounds the peak at 5
+  y = np.array([1, 0, 9, 9, 3, 5, 0], dtype=float)
+  np.testing.assert_array_equal(find_peaks(y), [0, 5])
+  np.testing.assert_allclose(peak_prominences(y, np.array([5]))[0], [2])
+
+
+def test_widths_match_scipy():
+  for y in [np.array([0, 0, 5, 0, 0], dtype=float), np.array([0, 1, 2, 3, 10, 3, 2, 1, 0], dtype=float), *random_signals()]:
+    peaks = inner_peaks(y)
+    prominences, leftBases, rightBases = peak_prominences(y, peaks)
+    expected = signal.peak_widths(y, peaks, 0.5, (prominences, leftBases, rightBases))[0]
+    np.testing.assert_allclose(peak_widths(y, peaks, prominences, leftBases, rightBases), expected)
+
+
+@pytest.mark.parametrize('options', [dict(prominence=1), dict(width=1), dict(width=2), dict(prominence=0.5, width=1.5)])
+def test_find_peaks_matches_scipy(options):
+  for y in random_signals():
+    np.testing.assert_array_equal(inner_peaks(y, **options), signal.find_peaks(y, **options)[0])
@@ -0,0 +1,165 @@
+import csv
+import datetime
+import os
+import numpy as np
+import pandas as pd
+
+from database import TIME_COLUMN
+
+# Parser of the ASCII reports exported by TotalChrom (.TX0): a header of "Key:",value fields
+# between two lines of '=', the report title, the names and units of the columns of the peak
+# table, a separator line of dashes, one row per peak, and the totals. The table is found by
+# its separator line, wherever the header ends, and each column is converted to its type once
+# for all rows; a value that does not convert is an error, not a missing peak.
+
+ENCODING = 'latin1'
+SEPARATOR = '------'
+TIME_FORMATS = ['%Y-%m-%d %I:%M:%S %p', '%Y-%m-%d %H:%M:%S', '%m/%d/%Y %I:%M:%S %p']
+# Detector of each channel of the instruments, for the pairing of TCD and FID reports
+CHANNELS = {'A': 'fid', 'B': 'tcd'}
+
+
+# Fields with a missing value are written as dashes
+def optional_float(values):
+  values = np.asarray(values, dtype=object)
+  missing = np.array([v.startswith('---') or v == '' for v in values], dtype=bool)
+  result = np.full(len(values), np.nan)
+  result[~missing] = np.asarray(values[~missing], dtype=float)
+  return result
+
+
+# Type of each column of the peak table, by name; other columns are kept as text
+CONVERTERS = {
+  'Peak': lambda values: np.asarray(values, dtype=np.int64),
+  'Time': lambda values: np.asarray(values, dtype=float),
+  'Area': lambda values: np.asarray(values, dtype=float),
+  'Component': lambda values: np.asarray(values, dtype=object),
+  'Height': optional_float,
+  'Norm. Area': optional_float,
+  'Adjusted': optional_float,
+  'Amount': optional_float,
+}
+COLUMN_NAMES = {'Time': TIME_COLUMN} # Names of the columns in the peak tables of the analyses
+
+
+# Header fields of the lines of a report: each "Key:" followed by its values (joined by spaces,
+# e.g. a date and a time), and lines of a single text (the report title) as Report
+def header_fields(rows, metadata):
+  for row in rows:
+    key = None
+    for field in row:
+      if field.rstrip().endswith(':'):
+        key = field.rstrip()[:-1].strip()
+        metadata[key] = ''
+      elif key is not None and field.strip():
+        metadata[key] = f'{metadata[key]} {field.strip()}'.strip()
+    if key is None and len(row) == 1 and row[0].strip() and not row[0].startswith('='):
+      metadata['Report'] = row[0].strip()
+  return metadata
+
+
+def convert(column, values, fileName, firstLine):
+  converter = CONVERTERS.get(column, lambda values: np.asarray(values, dtype=object))
+  try:
+    return converter(values)
+  except ValueError:
+    for num, value in enumerate(values):
+      try:
+        converter([value])
+      except ValueError:
+        raise Exception(f'Invalid {column} value "{value}" in {fileName}, line {firstLine + num}.')
+    raise
+
+
+# Lines of a report and the position of its table separator (None when it has no table)
+def read_lines(fileName, headerOnly=False):
+  with open(fileName, 'rb') as f:
+    if not headerOnly:
+      lines = f.read().decode(ENCODING).splitlines()
+      separator = next((num for num, line in enumerate(lines) if line.startswith(SEPARATOR)), None)
+      return lines, separator
+    lines = []
+    for line in f:
+      lines.append(line.decode(ENCODING).rstrip('\r\n'))
+      if lines[-1].startswith(SEPARATOR):
+        return lines, len(lines) - 1
+  return lines, None
+
+
+# Peak table of a report, with every column converted to its type, and its metadata: the
+# header fields (Sample Name, Data Acquisition Time, Instrument Name, Channel, ...), with the
+# units of the columns
+def read_report(fileName):
+  lines, separator = read_lines(fileName)
+  if separator is None or separator < 2:
+    raise Exception(f'No peak table found in {fileName}.')
+  names, units = csv.reader(lines[separator-2:separator])
+  end = separator + 1
+  while end < len(lines) and lines[end][:1].isdigit():
+    end += 1
+  rows = list(csv.reader(lines[separator+1:end]))
+  for num, row in enumerate(rows):
+    if len(row) != len(names):
+      raise Exception(f'Expected {len(names)} fields in {fileName}, line {separator + num + 2}: found {len(row)}.')
+
+  metadata = header_fields(csv.reader(lines[:separator-2] + lines[end:]), {})
+  metadata['Units'] = dict(zip(names, units))
+  columns = list(zip(*rows)) if rows else [()] * len(names)
+  peaksDf = pd.DataFrame({
+    COLUMN_NAMES.get(name, name): convert(name, values, fileName, separator + 2)
+    for name, values in zip(names, columns)
+  })
+  return peaksDf, metadata
+
+
+# Header fields of a report, without reading its peak table
+def read_metadata(fileName):
+  lines, separator = read_lines(fileName, headerOnly=True)
+  return header_fields(csv.reader(lines if separator is None else lines[:separator-2]), {})
+
+
+# Retention times and areas of the peaks of a report, as read by the analyses
+def peak_table(fileName):
+  peaksDf, _ = read_report(fileName)
+  return peaksDf[[TIME_COLUMN, 'Area']].sort_values(by=[TIME_COLUMN])
+
+
+def acquisition_time(metadata):
+  value = metadata.get('Data Acquisition Time')
+  for timeFormat in TIME_FORMATS:
+    try:
+      return datetime.datetime.strptime(value, timeFormat)
+    except (TypeError, ValueError):
+      pass
+  return None
+
+
+# Detector of a report: from its channel, or from its file name (..._TCD, ..._FID)
+def detector(fileName, metadata):
+  channel = CHANNELS.get(metadata.get('Channel', '').strip().upper())
+  if channel:
+    return channel
+  stem = os.path.splitext(os.path.basename(fileName))[0].upper()
+  return next((d for d in ['tcd', 'fid'] if stem.endswith('_' + d.upper())), None)
+
+
+# TCD and FID reports of the same injection (same sample name, acquisition time and
+# instrument), as (tcd, fid) pairs in order of acquisition. Returns the pairs and the reports
+# left unpaired.
+def pair_reports(fileNames):
+  injections = {}
+  for fileName in fileNames:
+    metadata = read_metadata(fileName)
+    key = (metadata.get('Sample Name'), metadata.get('Data Acquisition Time'), metadata.get('Instrument Name'))
+    injections.setdefault(key, {}).setdefault(detector(fileName, metadata), []).append((fileName, metadata))
+
+  pairs, unpaired = [], []
+  for reports in injections.values():
+    tcd, fid = reports.pop('tcd', []), reports.pop('fid', [])
+    if len(tcd) == 1 and len(fid) == 1:
+      pairs.append((tcd[0], fid[0]))
+    else:
+      unpaired += tcd + fid
+    unpaired += [report for others in reports.values() for report in others]
+  pairs.sort(key=lambda pair: (acquisition_time(pair[0][1]) or datetime.datetime.min, pair[0][0]))
+  return [(tcd, fid) for (tcd, _), (fid, _) in pairs], sorted(fileName for fileName, _ in unpaired)
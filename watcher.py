@@ -0,0 +1,289 @@
+import json
+import os
+import queue
+import re
+import shutil
+import threading
+import time
+
+import analysis
+import batch
+import build
+import cache
+import output
+import quantify
+from database import load_database
+
+# Files exported by the instruments, named {experiment}_{replicate}_{TCD|FID}.{TX0|RAX} (gas)
+# or {experiment}_{replicate}.{csv|RAX} (liquid), e.g. EXP_02_01_TCD.TX0 is the TCD report of
+# replicate 01 of experiment EXP_02
+GAS_PATTERN = re.compile(r'^(?P<experiment>.+)_(?P<replicate>\d+)_(?P<detector>TCD|FID)\.(?P<extension>TX0|RAX)$', re.IGNORECASE)
+LIQUID_PATTERN = re.compile(r'^(?P<experiment>.+)_(?P<replicate>\d+)\.(?P<extension>csv|RAX)$', re.IGNORECASE)
+
+POLL_INTERVAL = 2.0 # Seconds between scans of the export folder
+SETTLE_TIME = 1.0 # Seconds a file must stay unchanged before it is read, as it may still be written
+QUEUE_SIZE = 8 # Samples waiting between two stages; a full queue blocks the stage before it
+WATCH_DIR = os.path.join('output', '.watch') # Matched peaks and job of each replicate, and state of the processed samples
+STATE_FILE = os.path.join(WATCH_DIR, 'state.json')
+
+# Watch configuration, in JSON or YAML, with the parameters of the samples, as in manifests:
+#   defaults: parameters of every sample (mass, volume, isMass, isolate, database,
+#     tcdDatabase, fidDatabase, peakSource, uniqueMatches, alignment)
+#   experiments: parameters of the samples of each experiment, by experiment name
+#   samples: parameters of each sample, by {experiment}_{replicate}
+# Later entries override earlier ones.
+
+
+# Stored matched peaks and job of a replicate
+def replicate_files(experiment, replicate):
+  folder = os.path.join(WATCH_DIR, experiment)
+  return os.path.join(folder, f'{replicate}.npz'), os.path.join(folder, f'{replicate}.json')
+
+
+def read_config(path):
+  if path is None:
+    return {}
+  if os.path.splitext(path)[1].lower() in ['.yaml', '.yml']:
+    try:
+      import yaml
+    except ImportError:
+      raise Exception('PyYAML is required to read YAML watch configurations (pip3 install pyyaml).')
+    with open(path) as f:
+      return yaml.safe_load(f) or {}
+  with open(path) as f:
+    return json.load(f)
+
+
+def sample_parameters(config, experiment, replicate):
+  parameters = dict(config.get('defaults', {}))
+  parameters.update(config.get('experiments', {}).get(experiment, {}))
+  parameters.update(config.get('samples', {}).get(f'{experiment}_{replicate}', {}))
+  return parameters
+
+
+# Sample complete in the export folder: the TCD and FID files of a gas replicate, or the
+# report of a liquid one. Returns (experiment, replicate, type, {role: file}) or None.
+def complete_sample(files, experiment, replicate, peakSource):
+  extension = '.RAX' if peakSource == 'raw' else '.TX0'
+  tcd = files.get(('TCD', extension))
+  fid = files.get(('FID', extension))
+  if tcd and fid:
+    return experiment, replicate, 'gas', {'tcd': tcd, 'fid': fid}
+  report = files.get((None, '.CSV')) or (files.get((None, '.RAX')) if peakSource == 'raw' else None)
+  if report:
+    return experiment, replicate, 'liquid', {'file': report}
+  return None
+
+
+# Service processing the files of an export folder as they are written, through a pipeline of
+# threads connected by bounded queues:
+#   scan: finds new or changed files, waits until they are complete, copies them to
+#     input/{experiment} and queues each sample once all its files are present
+#   parse: reads the peak tables of the sample
+#   match: matches the peaks to the databases and saves the results
+#   summarize: stores the matched peaks of the sample and saves the experiment summary,
+#     quantified with the other replicates of its experiment in one batch
+class Watcher:
+
+  def __init__(self, exportDir, config=None, pollInterval=POLL_INTERVAL, settleTime=SETTLE_TIME, queueSize=QUEUE_SIZE):
+    if not os.path.isdir(exportDir):
+      raise Exception(f'Export folder {exportDir} not found.')
+    self.exportDir = exportDir
+    self.config = config or {}
+    self.pollInterval = pollInterval
+    self.settleTime = settleTime
+    self.parseQueue = queue.Queue(queueSize)
+    self.matchQueue = queue.Queue(queueSize)
+    self.summaryQueue = queue.Queue(queueSize)
+    self.stopping = threading.Event()
+    self.seen = {} # file name -> (size, mtime) at the previous scan
+    self.ready = {} # file name -> (sample, role, path, signature) of complete files
+    self.queued = {} # sample -> signatures of its files when it was last queued
+    self.state = self.read_state() # experiment -> replicate -> hashes of its files and parameters
+    self.failed = []
+
+  # State of the processed samples; those without stored peaks (e.g. stored by a previous
+  # version as summaries) are processed again
+  def read_state(self):
+    try:
+      with open(STATE_FILE) as f:
+        state = json.load(f)
+    except FileNotFoundError:
+      return {}
+    for experiment, replicates in state.items():
+      for replicate in list(replicates):
+        if not all(os.path.exists(path) for path in replicate_files(experiment, replicate)):
+          del replicates[replicate]
+    return state
+
+  def write_state(self):
+    cache.write_atomic(STATE_FILE, json.dumps(self.state, indent=2, sort_keys=True))
+
+  # Update the complete files of the export folder: those unchanged since the previous scan
+  # and for settleTime. Returns whether every file of the folder is complete.
+  def scan(self):
+    now = time.time()
+    names = set()
+    for entry in os.scandir(self.exportDir):
+      match = (GAS_PATTERN.match(entry.name) or LIQUID_PATTERN.match(entry.name)) if entry.is_file() else None
+      if not match:
+        continue
+      names.add(entry.name)
+      stat = entry.stat()
+      signature = (stat.st_size, stat.st_mtime_ns)
+      previous, self.seen[entry.name] = self.seen.get(entry.name), signature
+      if previous != signature or now - stat.st_mtime < self.settleTime:
+        self.ready.pop(entry.name, None)
+        continue
+      groups = match.groupdict()
+      role = (groups.get('detector') or '').upper() or None
+      self.ready[entry.name] = ((groups['experiment'], groups['replicate']), (role, '.' + groups['extension'].upper()), entry.path, signature)
+    for name in set(self.seen) - names:
+      del self.seen[name]
+      self.ready.pop(name, None)
+    return len(self.ready) == len(names)
+
+  # Complete samples whose files changed since they were last queued
+  def new_samples(self):
+    samples = {}
+    for sample, role, path, signature in self.ready.values():
+      samples.setdefault(sample, {})[role] = (path, signature)
+    for (experiment, replicate), files in sorted(samples.items()):
+      signatures = sorted(signature for _, signature in files.values())
+      if self.queued.get((experiment, replicate)) == signatures:
+        continue
+      parameters = sample_parameters(self.config, experiment, replicate)
+      sample = complete_sample({role: path for role, (path, _) in files.items()}, experiment, replicate, parameters.get('peakSource'))
+      if sample is not None:
+        self.queued[(experiment, replicate)] = signatures
+        yield sample, [path for path, _ in files.values()], parameters
+
+  # Copy the files of a sample to input/{experiment}. Returns the hashes of the files it is
+  # analysed from, and whether they or the parameters changed since it was processed.
+  def ingest(self, experiment, replicate, analysed, paths, parameters):
+    folder = os.path.join('input', experiment)
+    os.makedirs(folder, exist_ok=True)
+    for path in paths:
+      target = os.path.join(folder, os.path.basename(path))
+      if not os.path.exists(target) or build.input_hash(target) != build.input_hash(path):
+        shutil.copy2(path, target)
+    inputs = dict(
+      files={os.path.basename(path): build.input_hash(path) for path in analysed.values()},
+      parameters=cache.digest(json.dumps(parameters, sort_keys=True, default=str)),
+    )
+    known = self.state.get(experiment, {}).get(replicate, {})
+    return inputs, any(known.get(key) != value for key, value in inputs.items())
+
+  def scan_loop(self, once):
+    while not self.stopping.is_set():
+      complete = self.scan()
+      for (experiment, replicate, kind, analysed), paths, parameters in self.new_samples():
+        try:
+          inputs, changed = self.ingest(experiment, replicate, analysed, paths, parameters)
+        except Exception as e:
+          self.fail(experiment, replicate, e)
+          continue
+        if changed:
+          print(f'New sample {experiment}_{replicate} ({kind}).')
+          self.parseQueue.put((experiment, replicate, kind, analysed, parameters, inputs)) # Blocks while the pipeline is busy
+      if once and complete:
+        break
+      self.stopping.wait(self.pollInterval)
+    self.parseQueue.put(None)
+
+  # Job of one sample, validated as in manifests
+  def sample_job(self, experiment, kind, analysed, parameters):
+    jobKeys = batch.JOB_KEYS + ['peakDetection', 'alignment']
+    sample = {key: value for key, value in parameters.items() if key not in jobKeys}
+    sample.update({role: os.path.basename(path) for role, path in analysed.items()})
+    job = {key: value for key, value in parameters.items() if key in jobKeys}
+    job.update(experiment=experiment, type=kind, function='analysis', samples=[sample])
+    return batch.validate_job(job)
+
+  def parse_loop(self):
+    while (item := self.parseQueue.get()) is not None:
+      experiment, replicate, kind, analysed, parameters, inputs = item
+      try:
+        job = self.sample_job(experiment, kind, analysed, parameters)
+        sample = job['samples'][0]
+        roles = ['tcd', 'fid'] if kind == 'gas' else ['file']
+        paths = [batch.resolve_file(experiment, sample[role]) for role in roles]
+        frames = analysis.parse_peaks(*paths, gas=kind == 'gas')
+      except Exception as e:
+        self.fail(experiment, replicate, e)
+        continue
+      self.matchQueue.put((experiment, replicate, job, paths, frames, inputs))
+    self.matchQueue.put(None)
+
+  def match_loop(self):
+    while (item := self.matchQueue.get()) is not None:
+      experiment, replicate, job, paths, frames, inputs = item
+      sample = job['samples'][0]
+      try:
+        if job['type'] == 'gas':
+          tcdDatabase = load_database(batch.resolve_database('tcd', job.get('tcdDatabase')))
+          fidDatabase = load_database(batch.resolve_database('fid', job.get('fidDatabase')))
+          alignment = batch.resolve_alignment(experiment, job.get('alignment'))
+          tcdResults, fidResults = analysis.match_gas(*frames, tcdDatabase, fidDatabase, sample['volume'], alignment, paths, unique=job['uniqueMatches'])
+          analysis.save_results(experiment, tcdResults, analysis.results_name(paths[0]))
+          analysis.save_results(experiment, fidResults, analysis.results_name(paths[1]))
+          arrays = quantify.gas_arrays(tcdResults, fidResults)
+        else:
+          database = load_database(batch.resolve_database('liquid', job.get('database')))
+          alignment = batch.resolve_alignment(experiment, job.get('alignment'))
+          results = analysis.match_liquid(frames[0], database, job.get('peakDetection'), alignment, paths[0], unique=job['uniqueMatches'])
+          analysis.save_results(experiment, results, analysis.results_name(paths[0]))
+          arrays = quantify.liquid_arrays(results)
+      except Exception as e:
+        self.fail(experiment, replicate, e)
+        continue
+      self.summaryQueue.put((experiment, replicate, job, arrays, inputs))
+    self.summaryQueue.put(None)
+
+  # Store the matched peaks and job of the replicate and save the summary of its experiment,
+  # quantified at once from every replicate processed so far, in replicate order
+  def summary_loop(self):
+    while (item := self.summaryQueue.get()) is not None:
+      experiment, replicate, job, arrays, inputs = item
+      try:
+        arraysFile, jobFile = replicate_files(experiment, replicate)
+        build.write_arrays(arraysFile, arrays)
+        cache.write_atomic(jobFile, json.dumps(job, sort_keys=True))
+        replicates = self.state.setdefault(experiment, {})
+        replicates[replicate] = inputs
+        samples = []
+        for num in sorted(replicates, key=int):
+          arraysFile, jobFile = replicate_files(experiment, num)
+          with open(jobFile) as f:
+            replicateJob = json.load(f)
+          samples.append(batch.quantified_sample(replicateJob, replicateJob['samples'][0], build.read_arrays(arraysFile)))
+        analysis.save_summary(experiment, batch.summarize(job['type'], samples))
+        output.flush()
+        self.write_state()
+        print(f'Summary of {experiment} updated with replicate {replicate} ({len(replicates)} replicates).')
+      except Exception as e:
+        self.fail(experiment, replicate, e)
+
+  def fail(self, experiment, replicate, error):
+    print(f'Error in {experiment}_{replicate}:', error)
+    self.failed.append(f'{experiment}_{replicate}')
+
+  # Run until interrupted, or with once until every file of the export folder is processed.
+  # Returns the samples that failed.
+  def run(self, once=False):
+    print(f'Watching {self.exportDir} for new files{"" if once else " (Ctrl+C to stop)"}.')
+    workers = [
+      threading.Thread(target=loop, name=loop.__name__, daemon=True)
+      for loop in [self.parse_loop, self.match_loop, self.summary_loop]
+    ]
+    for worker in workers:
+      worker.start()
+    try:
+      self.scan_loop(once)
+    except KeyboardInterrupt:
+      print('\nStopping: finishing the samples in progress.')
+      self.stopping.set()
+      self.parseQueue.put(None)
+    for worker in workers:
+      worker.join()
+    return self.failed